@@ -1,30 +1,55 @@
-from fastapi import APIRouter, File, UploadFile, Form, HTTPException
-from fastapi.responses import JSONResponse
-from typing import Optional
+from fastapi import APIRouter, File, UploadFile, Form, Header, HTTPException
+from fastapi.responses import FileResponse, JSONResponse
+from typing import List, Optional
 from pydantic import BaseModel
 import logging
-import base64
 import asyncio
-import uuid
+import hmac
+import os
+import time
 
-from app.pipelines.glaucoma_pipeline import GlaucomaPipeline
-from app.pipelines.dr_pipeline import DRPipeline
 from app.services.supabase_service import SupabaseService
 from app.services.firebase_service import firebase_service
-from app.services.scan_pdf import build_scan_report_pdf
+from app.services.gemini_service import gemini_service
+from app.services.commentary_prefetch import commentary_prefetcher
+from app.services.pdf_renderer import pdf_render_service
+from app.services.report_cache import report_cache, report_inputs_hash
+from app.services.admission import AdmissionRejected, analysis_admission
+from app.services.model_registry import ModelReloadError, model_registry
+from app.services.analysis import AnalysisOptions, analyze
+from app.services.idempotency import (
+    MAX_KEY_LENGTH,
+    IdempotencyConflict,
+    IdempotencyInterrupted,
+    analysis_idempotency,
+    request_fingerprint,
+)
+from app.services.jobs import ARTIFACT_NAME, QUEUED, job_runner, job_store, public_job, submit
+from app.preprocessing.ingest import IngestError, ingest_upload
+from app.config import MODELS_DIR, settings
+from app.metrics import MemoryLedger, instrument_endpoint, track_stage
+from app import profiling
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-# Initialize pipelines and services
-glaucoma_pipeline = GlaucomaPipeline()
-dr_pipeline = DRPipeline()
+# Initialize services (clients are created on first use or by the startup warm-up;
+# models are loaded by the registry, preloaded in the master under app.serve)
 supabase_service = SupabaseService()
 
+
 @router.post("/analyze")
+@instrument_endpoint("analyze")
 async def analyze_image(
     image: UploadFile = File(...),
-    patient_id: str = Form(...)
+    patient_id: str = Form(...),
+    prefetch_commentary: Optional[bool] = Form(None),
+    priority: Optional[str] = Form(None),
+    diseases: Optional[str] = Form(None),
+    outputs: Optional[str] = Form(None),
+    persist: Optional[bool] = Form(None),
+    x_priority: Optional[str] = Header(None),
+    idempotency_key: Optional[str] = Header(None)
 ):
     """
     Analyze retinal image for Glaucoma and Diabetic Retinopathy
@@ -32,117 +57,194 @@ async def analyze_image(
     Args:
         image: Uploaded retinal image file
         patient_id: Patient user ID from Firebase
+        prefetch_commentary: Start Gemini doctor commentary in the background
+                             (defaults to settings.GEMINI_PREFETCH_ENABLED)
+        priority: Admission lane ("high" for doctor re-analysis, "normal", "bulk");
+                  may also be sent as the X-Priority header
+        diseases: Comma-separated subset of "glaucoma,dr" (default: both)
+        outputs: Comma-separated subset of "verdict,heatmap,overlay,original" (default: all);
+                 the verdict is always returned, Grad-CAM is skipped when no image is requested
+        persist: Upload the computed images to storage (default: true)
+        idempotency_key: Idempotency-Key header; retries with the same key, patient and
+                         payload share one analysis and get its response back
     
     Returns:
-        Combined results from both Glaucoma and DR analysis
+        Combined results from the selected analyses (unselected ones are null)
         Frontend will handle storing results in Firebase
+        429 with Retry-After when the inference queue is full
+        422 when the Idempotency-Key was used for a different request
+        (replayed responses carry Idempotent-Replayed: true; a response replayed
+        after completion has null *_base64 images)
     """
     try:
-        # Read image file
-        image_bytes = await image.read()
-        
-        # Run both pipelines in parallel for faster execution
-        logger.info(f"Starting analysis for patient {patient_id}")
-        
-        # Run Glaucoma and DR pipelines in parallel using asyncio.gather()
-        glaucoma_result, dr_result = await asyncio.gather(
-            glaucoma_pipeline.process(image_bytes, patient_id),
-            dr_pipeline.process(image_bytes, patient_id)
-        )
-        
-        # Prepare GradCAM data
-        # Glaucoma GradCAM returns dict with 'heatmap_only' and 'overlay'
-        glaucoma_gradcam_dict = {
-            "heatmap_only": glaucoma_result.get("gradcam_heatmap"),
-            "overlay": glaucoma_result.get("gradcam_overlay")
-        } if glaucoma_result.get("gradcam_heatmap") is not None else None
-        
-        # DR GradCAM (placeholder for now)
-        dr_gradcam_dict = {
-            "heatmap_only": dr_result.get("gradcam_heatmap"),
-            "overlay": dr_result.get("gradcam_overlay")
-        } if dr_result.get("gradcam_heatmap") is not None else None
-        
-        # Generate image_id for Supabase
-        image_id = str(uuid.uuid4())
-        
-        # Convert images to base64 for immediate display
-        original_base64 = base64.b64encode(image_bytes).decode('utf-8')
-        
-        # Convert Glaucoma GradCAM to base64
-        glaucoma_heatmap_base64 = None
-        glaucoma_overlay_base64 = None
-        if glaucoma_gradcam_dict and glaucoma_gradcam_dict.get("heatmap_only") is not None:
-            glaucoma_heatmap_bytes = supabase_service._heatmap_to_bytes(glaucoma_gradcam_dict["heatmap_only"])
-            glaucoma_heatmap_base64 = base64.b64encode(glaucoma_heatmap_bytes).decode('utf-8')
-            if glaucoma_gradcam_dict.get("overlay") is not None:
-                glaucoma_overlay_bytes = supabase_service._heatmap_to_bytes(glaucoma_gradcam_dict["overlay"])
-                glaucoma_overlay_base64 = base64.b64encode(glaucoma_overlay_bytes).decode('utf-8')
-        
-        # Convert DR GradCAM to base64
-        dr_heatmap_base64 = None
-        dr_overlay_base64 = None
-        if dr_gradcam_dict and dr_gradcam_dict.get("heatmap_only") is not None:
-            dr_heatmap_bytes = supabase_service._heatmap_to_bytes(dr_gradcam_dict["heatmap_only"])
-            dr_heatmap_base64 = base64.b64encode(dr_heatmap_bytes).decode('utf-8')
-            if dr_gradcam_dict.get("overlay") is not None:
-                dr_overlay_bytes = supabase_service._heatmap_to_bytes(dr_gradcam_dict["overlay"])
-                dr_overlay_base64 = base64.b64encode(dr_overlay_bytes).decode('utf-8')
-        
-        # For backward compatibility, use Glaucoma (or DR if Glaucoma not available)
-        default_heatmap_base64 = glaucoma_heatmap_base64 or dr_heatmap_base64
-        default_overlay_base64 = glaucoma_overlay_base64 or dr_overlay_base64
-        
-        # Upload to Supabase in background (non-blocking)
-        asyncio.create_task(
-            supabase_service.upload_images_async(
-                image_id=image_id,
-                original_image=image_bytes,
-                glaucoma_gradcam=glaucoma_gradcam_dict,
-                dr_gradcam=dr_gradcam_dict,
-                patient_id=patient_id
+        lane = analysis_admission.resolve_priority(priority or x_priority)
+        options = AnalysisOptions.parse(diseases, outputs, persist)
+        if idempotency_key is not None and not 0 < len(idempotency_key) <= MAX_KEY_LENGTH:
+            raise ValueError(f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    admitted_at = None
+    if not idempotency_key:
+        # Wait for an inference slot before the upload is read into memory
+        admitted_at = await _admit(lane, patient_id)
+    ingested = None
+    handed_off = False
+    ledger = MemoryLedger()
+    try:
+        # Stream the upload into a spool (size/pixel limits, sha256) instead of reading it whole
+        with track_stage("ingest"):
+            ingested = await ingest_upload(image)
+        ledger.hold(ingested.size)
+
+        async def run_analysis() -> dict:
+            nonlocal admitted_at
+            if admitted_at is None:
+                # Keyed requests are admitted only once they are known not to be duplicates
+                admitted_at = await _admit(lane, patient_id)
+            return await analyze(
+                ingested, patient_id, options, supabase_service,
+                ledger=ledger, prefetch_commentary=prefetch_commentary,
             )
+
+        if not idempotency_key:
+            # Return response immediately with base64 images
+            return JSONResponse(content=await run_analysis())
+
+        def release():
+            ingested.close()
+            if admitted_at is not None:
+                analysis_admission.release(admitted_at)
+
+        # From here the upload and inference slot belong to the (possibly shared) analysis,
+        # which keeps running if this client disconnects
+        handed_off = True
+        content, replayed = await analysis_idempotency.run(
+            f"{patient_id}:{idempotency_key}",
+            request_fingerprint(patient_id, options.as_dict(), ingested.sha256),
+            run_analysis,
+            release=release,
         )
+        if replayed:
+            logger.info(f"Replayed analysis {content.get('image_id')} for Idempotency-Key {idempotency_key!r}")
+        return JSONResponse(content=content, headers={"Idempotent-Replayed": "true"} if replayed else None)
         
-        # Return response immediately with base64 images
-        return JSONResponse(content={
-            "success": True,
-            "patient_id": patient_id,
-            "image_id": image_id,
-            "glaucoma": {
-                "result_msg": glaucoma_result["result_msg"],
-                "confidence": glaucoma_result["confidence"],
-                "prediction": glaucoma_result.get("prediction", ""),
-                "raw_output": glaucoma_result.get("raw_output", [])
-            },
-            "dr": {
-                "result_msg": dr_result["result_msg"],
-                "confidence": dr_result["confidence"],
-                "prediction": dr_result.get("prediction", ""),
-                "raw_output": dr_result.get("raw_output", [])
-            },
-            # Base64 images for immediate display
-            "image_base64": f"data:image/jpeg;base64,{original_base64}",
-            # Glaucoma images
-            "glaucoma_heatmap_base64": f"data:image/jpeg;base64,{glaucoma_heatmap_base64}" if glaucoma_heatmap_base64 else None,
-            "glaucoma_overlay_base64": f"data:image/jpeg;base64,{glaucoma_overlay_base64}" if glaucoma_overlay_base64 else None,
-            # DR images
-            "dr_heatmap_base64": f"data:image/jpeg;base64,{dr_heatmap_base64}" if dr_heatmap_base64 else None,
-            "dr_overlay_base64": f"data:image/jpeg;base64,{dr_overlay_base64}" if dr_overlay_base64 else None,
-            # Backward compatibility
-            "heatmap_base64": f"data:image/jpeg;base64,{default_heatmap_base64}" if default_heatmap_base64 else None,
-            "overlay_base64": f"data:image/jpeg;base64,{default_overlay_base64}" if default_overlay_base64 else None,
-            # URLs will be available after async upload completes (for history)
-            # These will be null initially but that's OK - history page will fetch from Supabase
-            "image_url": None,
-            "heatmap_url": None,
-            "overlay_url": None,
-            "gradcam_url": None  # For backward compatibility
-        })
-        
+    except HTTPException:
+        raise
+    except IdempotencyConflict as e:
+        logger.warning(f"Idempotency-Key {idempotency_key!r} reused by patient {patient_id}: {e}")
+        raise HTTPException(status_code=422, detail=str(e))
+    except IdempotencyInterrupted as e:
+        raise HTTPException(status_code=409, detail=str(e), headers={"Retry-After": "1"})
+    except IngestError as e:
+        logger.warning(f"Upload rejected for patient {patient_id}: {e}")
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
         logger.error(f"Error during analysis: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
+    finally:
+        ledger.observe("analyze")
+        if not handed_off:
+            if ingested is not None:
+                ingested.close()
+            if admitted_at is not None:
+                analysis_admission.release(admitted_at)
+
+
+async def _admit(lane: str, patient_id: str) -> float:
+    """Wait for an inference slot; 429 with Retry-After when the queue is full."""
+    try:
+        with track_stage("admission_wait"):
+            return await analysis_admission.acquire(lane)
+    except AdmissionRejected as e:
+        logger.warning(f"Analysis rejected for patient {patient_id}: {e}")
+        raise HTTPException(
+            status_code=429,
+            detail=f"Analysis queue is busy ({e.reason}); retry later",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+
+@router.post("/jobs", status_code=202)
+@instrument_endpoint("jobs_submit")
+async def submit_job(
+    images: List[UploadFile] = File(...),
+    patient_id: str = Form(...),
+    priority: Optional[str] = Form(None),
+    diseases: Optional[str] = Form(None),
+    outputs: Optional[str] = Form(None),
+    persist: Optional[bool] = Form(None),
+    x_priority: Optional[str] = Header(None)
+):
+    """
+    Queue an asynchronous analysis of one or more images and return its job ID right away
+    
+    Args:
+        images: Uploaded retinal image files (up to JOB_MAX_IMAGES)
+        patient_id: Patient user ID from Firebase
+        priority: Admission lane the job's analyses use (default: JOB_PRIORITY, "bulk");
+                  may also be sent as the X-Priority header
+        diseases, outputs, persist: As for /api/analyze
+    
+    Returns:
+        202 with the job ID and its status URL (also in Location)
+        429 with Retry-After when JOB_MAX_QUEUED jobs are already waiting
+    """
+    try:
+        lane = analysis_admission.resolve_priority(priority or x_priority or settings.JOB_PRIORITY)
+        options = AnalysisOptions.parse(diseases, outputs, persist)
+        if len(images) > settings.JOB_MAX_IMAGES:
+            raise ValueError(f"At most {settings.JOB_MAX_IMAGES} images per job")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        queued = await asyncio.to_thread(job_store.count, QUEUED)
+        if queued >= settings.JOB_MAX_QUEUED:
+            logger.warning(f"Job rejected for patient {patient_id}: {queued} jobs queued")
+            raise HTTPException(
+                status_code=429,
+                detail="Job queue is full; retry later",
+                headers={"Retry-After": str(analysis_admission.retry_after() * len(images))},
+            )
+        job = await submit(job_store, images, patient_id, options, lane)
+        job_runner.notify()
+        logger.info(f"Queued analysis job {job['id']} for patient {patient_id} ({len(images)} images)")
+        status_url = f"/api/jobs/{job['id']}"
+        return JSONResponse(
+            status_code=202,
+            content={"job_id": job["id"], "status": job["status"], "status_url": status_url},
+            headers={"Location": status_url},
+        )
+    except HTTPException:
+        raise
+    except IngestError as e:
+        logger.warning(f"Job upload rejected for patient {patient_id}: {e}")
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error queueing analysis job: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Job submission failed: {str(e)}")
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Job status, per-image results so far and artifact references
+    
+    Results fill in as images complete; each has its verdicts and "artifacts"
+    (storage URLs when persisted, otherwise /api/jobs/{id}/artifacts/... paths).
+    """
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job '{job_id}'")
+    return public_job(job)
+
+
+@router.get("/jobs/{job_id}/artifacts/{name}")
+async def get_job_artifact(job_id: str, name: str):
+    """Grad-CAM / original image kept with a job that was not persisted to storage"""
+    path = job_store.job_dir(job_id) / name
+    if not ARTIFACT_NAME.match(name) or await asyncio.to_thread(job_store.get, job_id) is None or not path.is_file():
+        raise HTTPException(status_code=404, detail="Artifact not found")
+    return FileResponse(path, media_type="image/jpeg")
 
 
 class ScanReportNotifyRequest(BaseModel):
@@ -160,14 +262,41 @@ class ScanReportNotifyRequest(BaseModel):
     dr_overlay_base64: Optional[str] = None
 
 
-@router.post("/scan-report-notify")
-async def scan_report_notify(body: ScanReportNotifyRequest):
+# Report builds in progress, keyed by (image_id, inputs_hash): concurrent retries share one build
+_report_builds: dict = {}
+
+
+async def _build_and_upload_report(body: ScanReportNotifyRequest, started: float) -> tuple:
     """
-    Build a PDF from scan images + summaries, upload to Supabase Storage,
-    and notify all doctors linked to the patient (patient_doctor status=active).
+    Generate commentary, render the PDF off-loop and upload it.
+
+    Returns (pdf_url, cacheable); reports rendered with transient fallback
+    commentary (circuit open, deadline exceeded, ...) are not cacheable.
     """
-    try:
-        pdf_bytes = build_scan_report_pdf(
+    # Use commentary prefetched by /analyze when available; otherwise fetch it
+    # without blocking the event loop (cached + pooled client). Gemini only gets
+    # the part of the end-to-end budget not reserved for PDF/upload/fan-out.
+    def commentary_budget() -> float:
+        elapsed = time.monotonic() - started
+        return settings.REPORT_NOTIFY_BUDGET_SECONDS - settings.REPORT_NOTIFY_RESERVE_SECONDS - elapsed
+
+    commentary_inputs = dict(
+        glaucoma_msg=body.glaucoma_result_msg or "",
+        dr_msg=body.dr_result_msg or "",
+        glaucoma_confidence=body.glaucoma_confidence,
+        dr_confidence=body.dr_confidence,
+    )
+    with track_stage("commentary"):
+        ai_data = await commentary_prefetcher.take(
+            body.image_id, **commentary_inputs, timeout=max(commentary_budget(), 0.0)
+        )
+        if ai_data is None:
+            ai_data = await gemini_service.build_doctor_explanation_async(
+                **commentary_inputs, timeout=commentary_budget()
+            )
+    # ReportLab is CPU-bound: render in the PDF worker pool, off the event loop
+    with track_stage("pdf_render"):
+        pdf_bytes = await pdf_render_service.render(
             patient_display_name=body.patient_display_name or "Patient",
             image_id=body.image_id,
             glaucoma_msg=body.glaucoma_result_msg or "",
@@ -179,29 +308,148 @@ async def scan_report_notify(body: ScanReportNotifyRequest):
             glaucoma_overlay_base64=body.glaucoma_overlay_base64,
             dr_heatmap_base64=body.dr_heatmap_base64,
             dr_overlay_base64=body.dr_overlay_base64,
+            ai_data=ai_data,
         )
-        pdf_url = supabase_service.upload_scan_report_pdf(
+    with track_stage("pdf_upload"):
+        pdf_url = await asyncio.to_thread(
+            supabase_service.upload_scan_report_pdf,
             body.patient_id,
             body.image_id,
             pdf_bytes,
         )
-        notify_result = firebase_service.notify_associated_doctors_scan_report(
+    fallback_reason = (ai_data or {}).get("fallback_reason")
+    return pdf_url, fallback_reason in (None, "missing_api_key")
+
+
+@router.post("/scan-report-notify")
+@instrument_endpoint("scan_report_notify")
+async def scan_report_notify(body: ScanReportNotifyRequest):
+    """
+    Build a PDF from scan images + summaries, upload to Supabase Storage,
+    and notify all doctors linked to the patient (patient_doctor status=active).
+
+    Re-notifying the same image_id with unchanged inputs reuses the already
+    uploaded PDF and only repeats the Firestore fan-out.
+    """
+    started = time.monotonic()
+    profiling.annotate(body.image_id)
+    try:
+        inputs_hash = report_inputs_hash(
             patient_id=body.patient_id,
-            image_id=body.image_id,
-            patient_display_name=body.patient_display_name or "Patient",
-            pdf_url=pdf_url,
-            glaucoma_msg=body.glaucoma_result_msg or "",
-            dr_msg=body.dr_result_msg or "",
+            patient_display_name=body.patient_display_name,
+            glaucoma_msg=body.glaucoma_result_msg,
+            dr_msg=body.dr_result_msg,
+            glaucoma_confidence=body.glaucoma_confidence,
+            dr_confidence=body.dr_confidence,
+            images=[
+                body.image_base64,
+                body.glaucoma_heatmap_base64,
+                body.glaucoma_overlay_base64,
+                body.dr_heatmap_base64,
+                body.dr_overlay_base64,
+            ],
         )
+        pdf_url = report_cache.get_pdf_url(body.image_id, inputs_hash)
+        report_cached = pdf_url is not None
+        if not report_cached:
+            build_key = (body.image_id, inputs_hash)
+            build = _report_builds.get(build_key)
+            if build is None:
+                build = asyncio.ensure_future(_build_and_upload_report(body, started))
+                _report_builds[build_key] = build
+                build.add_done_callback(lambda _: _report_builds.pop(build_key, None))
+            pdf_url, cacheable = await asyncio.shield(build)
+            if cacheable:
+                report_cache.set_pdf_url(body.image_id, inputs_hash, pdf_url)
+        with track_stage("notify_fanout"):
+            notify_result = await firebase_service.notify_associated_doctors_scan_report_async(
+                patient_id=body.patient_id,
+                image_id=body.image_id,
+                patient_display_name=body.patient_display_name or "Patient",
+                pdf_url=pdf_url,
+                glaucoma_msg=body.glaucoma_result_msg or "",
+                dr_msg=body.dr_result_msg or "",
+            )
         return JSONResponse(
             content={
                 "success": notify_result.get("ok", False),
                 "doctors_notified": notify_result.get("doctors_notified", 0),
                 "skipped": notify_result.get("skipped"),
                 "pdf_url": notify_result.get("pdf_url"),
+                "report_cached": report_cached,
             }
         )
     except Exception as e:
         logger.error(f"scan-report-notify failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+
+def _require_model_admin(token: Optional[str]):
+    expected = settings.MODEL_ADMIN_TOKEN
+    if not expected:
+        raise HTTPException(status_code=404, detail="Model admin endpoints are disabled")
+    if not token or not hmac.compare_digest(token, expected):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+class ModelReloadRequest(BaseModel):
+    # File name inside backend/models; defaults to the configured model path
+    weights_file: Optional[str] = None
+
+
+@router.get("/admin/models")
+async def list_models(x_admin_token: Optional[str] = Header(None)):
+    """Active model version per disease and any versions still draining."""
+    _require_model_admin(x_admin_token)
+    return {"pid": os.getpid(), "models": model_registry.describe(), "stats": model_registry.stats()}
+
+
+@router.post("/admin/models/{disease}/reload")
+async def reload_model(
+    disease: str,
+    body: Optional[ModelReloadRequest] = None,
+    x_admin_token: Optional[str] = Header(None)
+):
+    """
+    Load, warm and activate a new model version without a restart
+    
+    In-flight requests finish on the version they started with. Under app.serve
+    this reloads only the worker answering the call; send SIGHUP to the master
+    to reload every worker.
+    
+    Args:
+        disease: "glaucoma" or "dr"
+        body: Optional weights_file (a file in backend/models) to load instead of the configured path
+    
+    Returns:
+        Previous and new version, and whether the previous version drained in time
+    """
+    _require_model_admin(x_admin_token)
+    model_path = None
+    if body and body.weights_file:
+        candidate = (MODELS_DIR / body.weights_file).resolve()
+        if candidate.parent != MODELS_DIR.resolve():
+            raise HTTPException(status_code=400, detail="weights_file must be a file name inside the models directory")
+        model_path = str(candidate)
+    try:
+        result = await model_registry.reload(disease, model_path)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ModelReloadError as e:
+        logger.error(str(e))
+        raise HTTPException(status_code=422, detail=str(e))
+    return dict(result, pid=os.getpid())
+
+
+@router.get("/metrics/dependencies")
+async def dependency_metrics():
+    """Circuit breaker, cache and prefetch state for external dependencies."""
+    return {
+        "gemini": {
+            "breaker": gemini_service.breaker.snapshot(),
+            "cache": gemini_service.cache.stats(),
+            "prefetch": commentary_prefetcher.stats(),
+        },
+        "report_cache": report_cache.stats(),
+        "doctor_links": firebase_service.doctor_links.stats() if firebase_service.doctor_links else None,
+    }
@@ -0,0 +1,387 @@
+"""
+Offline bulk analysis of archived fundus images.
+
+    python -m app.cli analyze /data/fundus --output results.jsonl --workers 4 --batch-size 16
+    python -m app.cli analyze /data/fundus --output results.parquet --gradcam-dir /data/cams
+
+Images are analyzed by the same GlaucomaPipeline / DRPipeline as the API,
+batched through each model in worker processes that each load the models once.
+Results stream to JSONL (one line per image) or Parquet (a directory of part
+files; needs pyarrow). The output doubles as the checkpoint: re-running the
+same command skips images already written without an error, so an interrupted
+run resumes where it stopped and failed images are retried (their new row
+follows the old one; the last row for a path is current). --restart starts over.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional, Set
+
+from PIL import Image
+
+logger = logging.getLogger("app.cli")
+
+DISEASES = ("glaucoma", "dr")
+GRADCAM_OUTPUTS = ("heatmap", "overlay")
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp"}
+
+# Per-disease result columns (prefixed with the disease name)
+_DISEASE_COLUMNS = ("result", "prediction", "class", "confidence", "probabilities", "model_version",
+                    "heatmap_path", "overlay_path")
+
+
+def discover(root: Path, recursive: bool = True) -> List[str]:
+    """Image files under root as sorted POSIX paths relative to it."""
+    pattern = "**/*" if recursive else "*"
+    return sorted(
+        path.relative_to(root).as_posix()
+        for path in root.glob(pattern)
+        if path.is_file() and path.suffix.lower() in IMAGE_SUFFIXES
+    )
+
+
+def _mark(done: Set[str], path: str, error: Optional[str]):
+    # Images that failed are analyzed again on resume; their new row supersedes the old one
+    if error is None:
+        done.add(path)
+    else:
+        done.discard(path)
+
+
+class JsonlWriter:
+    """Appends one JSON line per image, flushed and fsynced after every batch."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._file = None
+
+    def completed(self) -> Set[str]:
+        """Paths analyzed without error (latest row per path); a line cut short by a crash is dropped."""
+        if not self.path.exists():
+            return set()
+        done, good_bytes = set(), 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                    _mark(done, row["path"], row.get("error"))
+                except (ValueError, KeyError):
+                    break
+                good_bytes += len(line)
+        if good_bytes < self.path.stat().st_size:
+            with open(self.path, "r+b") as f:
+                f.truncate(good_bytes)
+        return done
+
+    def write(self, rows: List[dict]):
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+        for row in rows:
+            self._file.write(json.dumps(row) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ParquetWriter:
+    """
+    Buffers rows and writes them as numbered part files in an output directory.
+
+    A part is renamed into place only once complete, so the directory always
+    reads as a valid dataset; rows still buffered at a crash are redone on resume.
+    """
+
+    def __init__(self, path: Path, diseases: tuple, rows_per_file: int = 1000):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Parquet output needs pyarrow (pip install pyarrow); or write --format jsonl")
+        self.pa, self.pq = pa, pq
+        self.path = path
+        self.rows_per_file = rows_per_file
+        self.schema = self._schema(diseases)
+        self._buffer: List[dict] = []
+
+    def _schema(self, diseases: tuple):
+        pa = self.pa
+        types = {
+            "result": pa.string(), "prediction": pa.string(), "class": pa.string(),
+            "confidence": pa.float64(), "probabilities": pa.list_(pa.float64()), "model_version": pa.string(),
+            "heatmap_path": pa.string(), "overlay_path": pa.string(),
+        }
+        fields = [("path", pa.string()), ("width", pa.int64()), ("height", pa.int64())]
+        fields += [(f"{d}_{column}", types[column]) for d in diseases for column in _DISEASE_COLUMNS]
+        fields += [("error", pa.string())]
+        return pa.schema(fields)
+
+    def completed(self) -> Set[str]:
+        """Paths analyzed without error (latest row per path)."""
+        done = set()
+        for part in sorted(self.path.glob("part-*.parquet")):
+            table = self.pq.read_table(part, columns=["path", "error"])
+            for path, error in zip(table.column("path").to_pylist(), table.column("error").to_pylist()):
+                _mark(done, path, error)
+        return done
+
+    def write(self, rows: List[dict]):
+        self._buffer.extend(rows)
+        if len(self._buffer) >= self.rows_per_file:
+            self._flush()
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+        index = len(list(self.path.glob("part-*.parquet")))
+        part = self.path / f"part-{index:05d}.parquet"
+        tmp = part.with_suffix(".parquet.tmp")
+        self.pq.write_table(self.pa.Table.from_pylist(self._buffer, schema=self.schema), tmp)
+        tmp.replace(part)
+        self._buffer = []
+
+    def close(self):
+        self._flush()
+
+
+# Set in each worker process by _init_worker
+_WORKER: dict = {}
+
+
+def _init_worker(root: str, diseases: tuple, gradcam_outputs: tuple, gradcam_dir: Optional[str], threads: int):
+    """Load the pipelines once per worker process."""
+    import cv2
+    import torch
+
+    torch.set_num_threads(threads)
+    cv2.setNumThreads(threads)
+
+    from app.pipelines.dr_pipeline import DRPipeline
+    from app.pipelines.glaucoma_pipeline import GlaucomaPipeline
+
+    factories = {"glaucoma": GlaucomaPipeline, "dr": DRPipeline}
+    _WORKER.update(
+        root=Path(root),
+        pipelines={disease: factories[disease]() for disease in diseases},
+        gradcam_outputs=gradcam_outputs,
+        gradcam_dir=Path(gradcam_dir) if gradcam_dir else None,
+    )
+
+
+def _empty_row(path: str, diseases) -> dict:
+    row = {"path": path, "width": None, "height": None}
+    row.update({f"{d}_{column}": None for d in diseases for column in _DISEASE_COLUMNS})
+    row["error"] = None
+    return row
+
+
+def _save_gradcam(relpath: str, disease: str, kind: str, array) -> Optional[str]:
+    if array is None:
+        return None
+    # Full file name, so a.png and a.jpg in one folder don't overwrite each other's maps
+    out = _WORKER["gradcam_dir"] / Path(relpath).parent / f"{Path(relpath).name}_{disease}_{kind}.jpg"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    Image.fromarray(array).save(out, quality=90)
+    return str(out)
+
+
+def _fill(row: dict, disease: str, result: dict):
+    relpath = row["path"]
+    row.update({
+        f"{disease}_result": result["result_msg"],
+        f"{disease}_prediction": result["prediction"],
+        f"{disease}_class": result.get("predicted_class") or None,
+        f"{disease}_confidence": result["confidence"],
+        f"{disease}_probabilities": [float(p) for p in result.get("raw_output", [])],
+        f"{disease}_model_version": result.get("model_version"),
+    })
+    if _WORKER["gradcam_dir"] is not None:
+        row[f"{disease}_heatmap_path"] = _save_gradcam(relpath, disease, "heatmap", result.get("gradcam_heatmap"))
+        row[f"{disease}_overlay_path"] = _save_gradcam(relpath, disease, "overlay", result.get("gradcam_overlay"))
+
+
+def _analyze_batch(relpaths: List[str]) -> List[dict]:
+    """Decode a batch, run each disease's pipeline on it in one forward pass and build the rows."""
+    pipelines = _WORKER["pipelines"]
+    rows, images = [], []
+    for relpath in relpaths:
+        row = _empty_row(relpath, pipelines)
+        try:
+            image = Image.open(_WORKER["root"] / relpath)
+            image = image.convert("RGB") if image.mode != "RGB" else image
+            image.load()
+            row["width"], row["height"] = image.size
+            images.append((row, image))
+        except Exception as e:
+            row["error"] = f"decode: {e}"
+        rows.append(row)
+
+    outputs = _WORKER["gradcam_outputs"]
+    for disease, pipeline in pipelines.items():
+        if not images:
+            break
+        try:
+            results = pipeline.process_batch([image for _, image in images], outputs)
+            for (row, _), result in zip(images, results):
+                _fill(row, disease, result)
+        except Exception:
+            # Isolate the failing image(s) instead of losing the whole batch
+            for row, image in images:
+                try:
+                    _fill(row, disease, pipeline.process_batch([image], outputs)[0])
+                except Exception as e:
+                    row["error"] = f"{disease}: {e}"
+    return rows
+
+
+class Progress:
+    """Logs throughput and ETA at most every `interval` seconds."""
+
+    def __init__(self, total: int, interval: float):
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.errors = 0
+        self.started = time.perf_counter()
+        self.first_batch_seconds: Optional[float] = None
+        self._last = self.started
+
+    def update(self, rows: List[dict]):
+        if self.first_batch_seconds is None:
+            # Includes worker start-up and model loading
+            self.first_batch_seconds = time.perf_counter() - self.started
+        self.done += len(rows)
+        self.errors += sum(1 for row in rows if row["error"])
+        now = time.perf_counter()
+        if now - self._last >= self.interval or self.done == self.total:
+            self._last = now
+            rate = self.rate()
+            eta = (self.total - self.done) / rate if rate else float("inf")
+            logger.info(
+                "%s/%s images (%.1f%%), %.2f images/s, %s errors, ETA %.0fs",
+                self.done, self.total, 100.0 * self.done / max(self.total, 1), rate, self.errors, eta,
+            )
+
+    def rate(self) -> float:
+        elapsed = time.perf_counter() - self.started
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+
+def _parse_choices(value: Optional[str], allowed: tuple, flag: str) -> tuple:
+    if value is None:
+        return allowed
+    items = {item.strip().lower() for item in value.split(",") if item.strip()}
+    unknown = items - set(allowed)
+    if unknown:
+        raise SystemExit(f"{flag}: unknown {', '.join(sorted(unknown))} (expected any of: {', '.join(allowed)})")
+    return tuple(item for item in allowed if item in items)
+
+
+def analyze(args) -> int:
+    root = Path(args.directory)
+    if not root.is_dir():
+        raise SystemExit(f"{root} is not a directory")
+    diseases = _parse_choices(args.diseases, DISEASES, "--diseases")
+    if not diseases:
+        raise SystemExit("--diseases: select at least one disease")
+    # Grad-CAM is only computed when its images are written
+    gradcam_outputs = _parse_choices(args.gradcam, GRADCAM_OUTPUTS, "--gradcam") if args.gradcam_dir else ()
+
+    output = Path(args.output)
+    fmt = args.format or ("parquet" if output.suffix == ".parquet" else "jsonl")
+    if args.restart and output.exists():
+        shutil.rmtree(output) if output.is_dir() else output.unlink()
+    writer = ParquetWriter(output, diseases, args.rows_per_file) if fmt == "parquet" else JsonlWriter(output)
+
+    done = writer.completed()
+    todo = [path for path in discover(root, not args.no_recursive) if path not in done]
+    if args.limit:
+        todo = todo[:args.limit]
+    logger.info(
+        "%s images to analyze in %s (%s already done in %s); diseases=%s, gradcam=%s",
+        len(todo), root, len(done), output, ",".join(diseases), ",".join(gradcam_outputs) or "off",
+    )
+    if not todo:
+        return 0
+
+    batches = [todo[i:i + args.batch_size] for i in range(0, len(todo), args.batch_size)]
+    workers = max(1, min(args.workers, len(batches)))
+    threads = args.threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+    initargs = (str(root), diseases, gradcam_outputs, args.gradcam_dir, threads)
+    progress = Progress(len(todo), args.progress_seconds)
+
+    pool = None
+    try:
+        if workers == 1:
+            _init_worker(*initargs)
+            results = map(_analyze_batch, batches)
+        else:
+            context = multiprocessing.get_context("fork" if hasattr(os, "fork") else "spawn")
+            pool = context.Pool(workers, initializer=_init_worker, initargs=initargs)
+            results = pool.imap_unordered(_analyze_batch, batches)
+        for rows in results:
+            writer.write(rows)
+            progress.update(rows)
+    except KeyboardInterrupt:
+        logger.warning("Interrupted after %s images; run the same command again to resume", progress.done)
+        if pool is not None:
+            pool.terminate()
+        return 130
+    finally:
+        writer.close()
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    elapsed = time.perf_counter() - progress.started
+    print(
+        f"Analyzed {progress.done} images ({progress.errors} errors) in {elapsed:.1f}s "
+        f"(first batch after {progress.first_batch_seconds:.1f}s): "
+        f"{progress.rate():.2f} images/s with {workers} workers x {threads} threads, batch size {args.batch_size}"
+    )
+    return 1 if progress.errors == progress.done else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="DiagnoVision offline tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    bulk = commands.add_parser("analyze", help="Analyze every image in a directory")
+    bulk.add_argument("directory", help="Directory of fundus images (searched recursively)")
+    bulk.add_argument("--output", "-o", default="analysis_results.jsonl",
+                      help="JSONL file or Parquet directory (default: analysis_results.jsonl)")
+    bulk.add_argument("--format", choices=("jsonl", "parquet"), help="Default: from the --output suffix")
+    bulk.add_argument("--diseases", help="Comma-separated subset of glaucoma,dr (default: both)")
+    bulk.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1), help="Worker processes")
+    bulk.add_argument("--threads-per-worker", type=int, default=0,
+                      help="Torch / OpenCV threads per worker (default: CPUs / workers)")
+    bulk.add_argument("--batch-size", type=int, default=16, help="Images per forward pass")
+    bulk.add_argument("--gradcam-dir", help="Write Grad-CAM JPEGs here (mirrors the input layout)")
+    bulk.add_argument("--gradcam", help="Comma-separated subset of heatmap,overlay (default: both)")
+    bulk.add_argument("--rows-per-file", type=int, default=1000, help="Rows per Parquet part file")
+    bulk.add_argument("--restart", action="store_true", help="Discard existing output instead of resuming")
+    bulk.add_argument("--no-recursive", action="store_true", help="Only the top level of the directory")
+    bulk.add_argument("--limit", type=int, default=0, help="Analyze at most this many new images")
+    bulk.add_argument("--progress-seconds", type=float, default=10.0, help="Progress log interval")
+    bulk.add_argument("--log-level", default="info")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(process)d %(name)s %(levelname)s %(message)s")
+    if args.batch_size < 1 or args.workers < 1:
+        parser.error("--batch-size and --workers must be at least 1")
+    return analyze(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
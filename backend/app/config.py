@@ -27,9 +27,27 @@ class Settings:
     
     # Firebase Configuration (Firestore only; scan PDFs use Supabase Storage)
     FIREBASE_SERVICE_ACCOUNT_KEY_PATH = _resolve_firebase_key_path()
+    # Cached patient -> active doctor links for notification fan-out
+    DOCTOR_LINK_CACHE_TTL_SECONDS = float(os.getenv("DOCTOR_LINK_CACHE_TTL_SECONDS", 60))
+    DOCTOR_LINK_CACHE_MAX_ENTRIES = int(os.getenv("DOCTOR_LINK_CACHE_MAX_ENTRIES", 10000))
+    # Invalidate cached links from a Firestore snapshot listener on patient_doctor
+    DOCTOR_LINK_LISTENER = os.getenv("DOCTOR_LINK_LISTENER", "false").lower() in ("1", "true", "yes")
+    # Notification fan-out: writes per Firestore batch (max 500) and concurrent batch commits
+    FIRESTORE_BATCH_SIZE = int(os.getenv("FIRESTORE_BATCH_SIZE", 450))
+    FIRESTORE_WRITE_CONCURRENCY = int(os.getenv("FIRESTORE_WRITE_CONCURRENCY", 4))
+    # Buffered result writes: scans per Firestore batch and max wait before a flush
+    RESULT_WRITE_BATCH_SCANS = int(os.getenv("RESULT_WRITE_BATCH_SCANS", 100))
+    RESULT_WRITE_FLUSH_SECONDS = float(os.getenv("RESULT_WRITE_FLUSH_SECONDS", 0.25))
     # Supabase Storage bucket for scan PDF reports (default: same bucket as retinal images)
     SUPABASE_SCAN_REPORTS_BUCKET = os.getenv("SUPABASE_SCAN_REPORTS_BUCKET", "images")
 
+    # Storage backend: "supabase" (default) or "local" (filesystem + SQLite, for offline perf runs)
+    STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "supabase").strip().lower()
+    LOCAL_STORAGE_DIR = os.getenv("LOCAL_STORAGE_DIR") or str(BACKEND_DIR / "local_storage")
+    # Simulated per-operation latency for the local backend (milliseconds)
+    LOCAL_STORAGE_LATENCY_MS = float(os.getenv("LOCAL_STORAGE_LATENCY_MS", 0))
+    LOCAL_STORAGE_LATENCY_JITTER_MS = float(os.getenv("LOCAL_STORAGE_LATENCY_JITTER_MS", 0))
+
     # Gemini Configuration (used for doctor-focused report explanation in PDF)
     GEMINI_API_KEY = os.getenv("GEMINI_API_KEY") or os.getenv("Gemini_API_KEY")
     GEMINI_MODEL = (
@@ -37,7 +55,97 @@ class Settings:
         or os.getenv("GEMINI_MODEL_NAME")
         or "gemini-2.5-flash"
     )
+    GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", 20))
+    GEMINI_MAX_CONNECTIONS = int(os.getenv("GEMINI_MAX_CONNECTIONS", 10))
+    # Commentary cache (keyed on normalized messages + bucketed confidence, persisted in SQLite)
+    GEMINI_CACHE_PATH = os.getenv("GEMINI_CACHE_PATH") or str(BACKEND_DIR / "cache" / "gemini_commentary.sqlite3")
+    GEMINI_CACHE_TTL_SECONDS = float(os.getenv("GEMINI_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+    GEMINI_CACHE_MAX_ENTRIES = int(os.getenv("GEMINI_CACHE_MAX_ENTRIES", 5000))
+    GEMINI_CONFIDENCE_BUCKET = float(os.getenv("GEMINI_CONFIDENCE_BUCKET", 0.05))
+    # Circuit breaker around Gemini (rolling error / slow-call windows)
+    GEMINI_BREAKER_WINDOW_SECONDS = float(os.getenv("GEMINI_BREAKER_WINDOW_SECONDS", 60))
+    GEMINI_BREAKER_MIN_CALLS = int(os.getenv("GEMINI_BREAKER_MIN_CALLS", 5))
+    GEMINI_BREAKER_ERROR_RATE = float(os.getenv("GEMINI_BREAKER_ERROR_RATE", 0.5))
+    GEMINI_BREAKER_SLOW_CALL_SECONDS = float(os.getenv("GEMINI_BREAKER_SLOW_CALL_SECONDS", 8))
+    GEMINI_BREAKER_SLOW_CALL_RATE = float(os.getenv("GEMINI_BREAKER_SLOW_CALL_RATE", 0.5))
+    GEMINI_BREAKER_OPEN_SECONDS = float(os.getenv("GEMINI_BREAKER_OPEN_SECONDS", 30))
+    # End-to-end latency budget for /api/scan-report-notify; Gemini gets what is left
+    # after reserving time for PDF rendering, upload and doctor fan-out
+    REPORT_NOTIFY_BUDGET_SECONDS = float(os.getenv("REPORT_NOTIFY_BUDGET_SECONDS", 10))
+    REPORT_NOTIFY_RESERVE_SECONDS = float(os.getenv("REPORT_NOTIFY_RESERVE_SECONDS", 3))
+    # Speculative commentary generation from /api/analyze (off unless enabled here or per request)
+    GEMINI_PREFETCH_ENABLED = os.getenv("GEMINI_PREFETCH_ENABLED", "false").lower() in ("1", "true", "yes")
+    GEMINI_PREFETCH_MAX_INFLIGHT = int(os.getenv("GEMINI_PREFETCH_MAX_INFLIGHT", 8))
+    GEMINI_PREFETCH_TTL_SECONDS = float(os.getenv("GEMINI_PREFETCH_TTL_SECONDS", 600))
     
+    # Scan report PDF rendering (process pool; 0 renders in a thread instead)
+    PDF_RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS", 2))
+    PDF_RENDER_START_METHOD = os.getenv("PDF_RENDER_START_METHOD", "spawn")
+    # Print resolution for report images; larger images are downsampled once to this DPI
+    PDF_IMAGE_DPI = float(os.getenv("PDF_IMAGE_DPI", 200))
+
+    # Built scan report PDFs keyed by image_id + inputs hash (re-notify skips rebuild/upload)
+    REPORT_CACHE_PATH = os.getenv("REPORT_CACHE_PATH") or str(BACKEND_DIR / "cache" / "scan_reports.sqlite3")
+    REPORT_CACHE_TTL_SECONDS = float(os.getenv("REPORT_CACHE_TTL_SECONDS", 30 * 24 * 3600))
+    REPORT_CACHE_MAX_ENTRIES = int(os.getenv("REPORT_CACHE_MAX_ENTRIES", 20000))
+
+    # /api/analyze responses replayed for retries carrying the same Idempotency-Key
+    # (entries hold the base64 images, so keep the count modest)
+    IDEMPOTENCY_CACHE_PATH = os.getenv("IDEMPOTENCY_CACHE_PATH") or str(BACKEND_DIR / "cache" / "idempotency.sqlite3")
+    IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", 24 * 3600))
+    IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", 500))
+
+    # Asynchronous analysis jobs (/api/jobs): SQLite queue shared by all worker processes,
+    # uploaded images kept on disk until the job expires. JOB_WORKERS runners per process
+    # (0 = only accept jobs here); each analysis still takes an admission slot in JOB_PRIORITY
+    JOBS_DB_PATH = os.getenv("JOBS_DB_PATH") or str(BACKEND_DIR / "cache" / "jobs.sqlite3")
+    JOBS_DIR = os.getenv("JOBS_DIR") or str(BACKEND_DIR / "cache" / "jobs")
+    JOB_WORKERS = int(os.getenv("JOB_WORKERS", 1))
+    JOB_PRIORITY = os.getenv("JOB_PRIORITY", "bulk")
+    JOB_MAX_IMAGES = int(os.getenv("JOB_MAX_IMAGES", 50))
+    JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", 500))
+    JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", 1.0))
+    JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", 120))
+    JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+    JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", 7 * 24 * 3600))
+    # Save each job image's verdicts to Firestore (buffered result batches), as the frontend does for /api/analyze
+    JOB_SAVE_RESULTS = os.getenv("JOB_SAVE_RESULTS", "true").lower() in ("1", "true", "yes")
+
+    # Upload ingestion limits: encoded size, decoded pixel count (checked from the header
+    # before decoding), read chunk size and in-memory spool size before spilling to disk
+    INGEST_MAX_BYTES = int(os.getenv("INGEST_MAX_BYTES", 25 * 1024 * 1024))
+    INGEST_MAX_PIXELS = int(os.getenv("INGEST_MAX_PIXELS", 50_000_000))
+    INGEST_CHUNK_BYTES = int(os.getenv("INGEST_CHUNK_BYTES", 1024 * 1024))
+    INGEST_SPOOL_MAX_BYTES = int(os.getenv("INGEST_SPOOL_MAX_BYTES", 2 * 1024 * 1024))
+
+    # Admission control for /api/analyze: concurrent pipeline runs, waiting requests and
+    # max queue wait before a 429; 0 concurrency disables the limit
+    ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", 2))
+    ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", 16))
+    ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", 30))
+    # Lane for requests without a priority: "high", "normal" or "bulk"
+    ADMISSION_DEFAULT_PRIORITY = os.getenv("ADMISSION_DEFAULT_PRIORITY", "normal")
+
+    # On-demand request profiling (cProfile + torch.profiler dumps); header trigger is
+    # disabled unless an admin token is set
+    PROFILING_ADMIN_TOKEN = os.getenv("PROFILING_ADMIN_TOKEN", "")
+    PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", 0))
+    PROFILING_DIR = os.getenv("PROFILING_DIR") or str(BACKEND_DIR / "profiles")
+
+    # Preforking server (python -m app.serve): worker processes sharing the preloaded
+    # models copy-on-write, and torch intra-op threads per worker
+    SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", 2))
+    SERVE_THREADS_PER_WORKER = int(os.getenv("SERVE_THREADS_PER_WORKER", 1))
+
+    # Load models and clients in the background after startup (/ready turns 200 when the
+    # models are in); false builds everything on first use instead
+    STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "true").lower() in ("1", "true", "yes")
+
+    # Model hot reload (POST /api/admin/models/{disease}/reload, or SIGHUP): admin
+    # endpoints are disabled unless a token is set; max wait for the old version to drain
+    MODEL_ADMIN_TOKEN = os.getenv("MODEL_ADMIN_TOKEN", "")
+    MODEL_DRAIN_TIMEOUT_SECONDS = float(os.getenv("MODEL_DRAIN_TIMEOUT_SECONDS", 60))
+
     # API Configuration
     API_PORT = int(os.getenv("API_PORT", 8000))
     API_HOST = os.getenv("API_HOST", "0.0.0.0")
@@ -49,10 +157,12 @@ class Settings:
     @classmethod
     def validate(cls):
         """Validate that all required environment variables are set"""
-        required_vars = [
-            "SUPABASE_URL",
-            "SUPABASE_SERVICE_KEY"
-        ]
+        required_vars = []
+        if cls.STORAGE_BACKEND == "supabase":
+            required_vars += [
+                "SUPABASE_URL",
+                "SUPABASE_SERVICE_KEY"
+            ]
         missing = [var for var in required_vars if not os.getenv(var)]
         if missing:
             raise ValueError(f"Missing required environment variables: {', '.join(missing)}")
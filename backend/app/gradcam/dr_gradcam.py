@@ -3,10 +3,11 @@ import torch
 import torch.nn.functional as F
 import cv2
 import logging
-from PIL import Image
-import io
 from captum.attr import LayerGradCam
 
+from app.metrics import track_stage
+from app.preprocessing.ingest import ImageSource, image_size, rgb_array
+
 logger = logging.getLogger(__name__)
 
 class DRGradCAM:
@@ -37,31 +38,30 @@ class DRGradCAM:
         img = np.clip(img, 0, 1)
         return img
     
-    def generate_gradcam(self, preprocessed_image: torch.Tensor, original_image_bytes: bytes, predicted_class_idx: int = None):
+    def generate_gradcam(self, preprocessed_image: torch.Tensor, original_image: ImageSource, predicted_class_idx: int = None, overlay: bool = True):
         """
         Generate GradCAM heatmap and overlay (matching notebook implementation)
         
         Args:
             preprocessed_image: Preprocessed image tensor (1, 3, 300, 300)
-            original_image_bytes: Original image bytes for overlay
+            original_image: Original image (bytes, IngestedImage or PIL) for overlay
             predicted_class_idx: Class index to generate GradCAM for (0=No DR, 1=Mild/Mod, 2=Severe, 3=Proliferative)
                                  If None, uses model's prediction
+            overlay: Also build the overlay (skipped when the caller only needs the heatmap)
         
         Returns:
             Dictionary with:
             - heatmap_only: Colored heatmap only (H, W, 3) in RGB format
-            - overlay: Original image + heatmap overlay (H, W, 3) in RGB format
+            - overlay: Original image + heatmap overlay (H, W, 3) in RGB format (None if overlay=False)
         """
         try:
             if self.model is None or self.lgc is None:
                 # Placeholder - return dummy images
                 logger.warning("Model not loaded, returning placeholder GradCAM")
-                original_img = Image.open(io.BytesIO(original_image_bytes))
-                original_img = original_img.convert('RGB')
-                original_array = np.array(original_img)
+                original_array = rgb_array(original_image)
                 return {
                     "heatmap_only": original_array,
-                    "overlay": original_array
+                    "overlay": original_array if overlay else None
                 }
             
             # Ensure image is on correct device and has batch dimension
@@ -82,41 +82,60 @@ class DRGradCAM:
             
             # Generate GradCAM attribution (matching notebook)
             self.model.eval()
-            attribution = self.lgc.attribute(preprocessed_image, target=predicted_class_idx)
+            with track_stage("gradcam_attribution", "dr"):
+                attribution = self.lgc.attribute(preprocessed_image, target=predicted_class_idx)
+            
+            return self.render_heatmap(attribution, original_image, overlay=overlay)
             
+        except Exception as e:
+            logger.error(f"Error generating DR GradCAM: {str(e)}")
+            raise
+
+    def render_heatmap(self, attribution: torch.Tensor, original_image: ImageSource, overlay: bool = True):
+        """
+        Turn a GradCAM attribution into the colored heatmap and overlay
+        
+        Args:
+            attribution: LayerGradCam attribution for one image
+            original_image: Original image (bytes, IngestedImage or PIL) for overlay
+            overlay: Also blend the overlay; when False the original is only used for its size
+        
+        Returns:
+            Dictionary with heatmap_only and overlay (H, W, 3) RGB arrays (overlay None if not requested)
+        """
+        with track_stage("gradcam_render", "dr"):
             # Process heatmap (matching notebook)
             heatmap = attribution.squeeze().cpu().detach().numpy()
             heatmap = np.maximum(heatmap, 0)  # Use only positive contributions
             heatmap = heatmap - np.min(heatmap)
             heatmap = heatmap / (np.max(heatmap) + 1e-10)  # Normalize to 0-1
-            
+        
             # Ensure heatmap is 2D (300, 300)
             if len(heatmap.shape) > 2:
                 # If multi-channel, take max across channels
                 heatmap = np.max(heatmap, axis=0)
-            
-            # Load original image for overlay
-            original_img = Image.open(io.BytesIO(original_image_bytes))
-            original_img = original_img.convert('RGB')
-            original_array = np.array(original_img)
-            original_h, original_w = original_array.shape[:2]
-            
-            # Resize heatmap to match original image size (matching notebook)
-            heatmap_resized = cv2.resize(heatmap, (original_w, original_h))
-            heatmap_uint8 = np.uint8(255 * heatmap_resized)  # Convert to 0-255
-            
+        
+            # Original image for overlay (shared, not copied, when the upload was decoded once)
+            original_array = rgb_array(original_image) if overlay else None
+            original_w, original_h = image_size(original_image if original_array is None else original_array)
+        
+            # Resize heatmap to match original image size (matching notebook); stays float32 and
+            # is scaled in place so no second full-resolution float buffer is allocated
+            heatmap_resized = cv2.resize(heatmap.astype(np.float32, copy=False), (original_w, original_h))
+            np.multiply(heatmap_resized, 255, out=heatmap_resized)
+            heatmap_uint8 = heatmap_resized.astype(np.uint8)  # Convert to 0-255
+            del heatmap_resized
+        
             # Apply JET colormap (matching notebook) - This is the colored heatmap
             heatmap_jet = cv2.applyColorMap(heatmap_uint8, cv2.COLORMAP_JET)
-            heatmap_jet = cv2.cvtColor(heatmap_jet, cv2.COLOR_BGR2RGB)  # Convert BGR to RGB
-            
+            del heatmap_uint8
+            cv2.cvtColor(heatmap_jet, cv2.COLOR_BGR2RGB, dst=heatmap_jet)  # Convert BGR to RGB in place
+        
             # Create overlay (matching notebook: 60% original, 40% heatmap)
-            overlay = cv2.addWeighted(original_array, 0.6, heatmap_jet, 0.4, 0)
-            
-            return {
-                "heatmap_only": heatmap_jet.astype(np.uint8),
-                "overlay": overlay.astype(np.uint8)
-            }
-            
-        except Exception as e:
-            logger.error(f"Error generating DR GradCAM: {str(e)}")
-            raise
+            overlay_array = cv2.addWeighted(original_array, 0.6, heatmap_jet, 0.4, 0) if overlay else None
+        
+        # Both are already uint8; returned without copies
+        return {
+            "heatmap_only": heatmap_jet,
+            "overlay": overlay_array
+        }
@@ -1,7 +1,28 @@
-from fastapi import FastAPI
+# Imported first so the startup report times the imports below
+from app.startup import startup_report, warm_up
+
+import asyncio
+import signal
+import time
+
+from fastapi import FastAPI, Response
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.config import settings
+from app.api import routes
 from app.api.routes import router
+from app.services.gemini_service import gemini_service
+from app.services.commentary_prefetch import commentary_prefetcher
+from app.services.pdf_renderer import pdf_render_service
+from app.services.firebase_service import firebase_service
+from app.services.report_cache import report_cache
+from app.services.idempotency import analysis_idempotency
+from app.services.jobs import job_runner
+from app.services.admission import analysis_admission
+from app.services.model_registry import model_registry
+from app.metrics import register_stats_source, render_latest
+from app.profiling import ProfilingMiddleware
+from app.preprocessing.ingest import UploadLimitMiddleware
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -10,6 +31,16 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Refuse oversized uploads from Content-Length before the multipart body is spooled
+# (added first so CORS headers still wrap its 413s)
+app.add_middleware(
+    UploadLimitMiddleware,
+    limits={
+        "/api/analyze": settings.INGEST_MAX_BYTES,
+        "/api/jobs": settings.INGEST_MAX_BYTES * settings.JOB_MAX_IMAGES,
+    },
+)
+
 # CORS middleware to allow frontend requests
 app.add_middleware(
     CORSMiddleware,
@@ -27,9 +58,83 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Opt-in request profiling (admin header or sampling rate)
+app.add_middleware(ProfilingMiddleware)
+
 # Include API routes
 app.include_router(router, prefix="/api", tags=["analysis"])
 
+# Scrape-time stats for caches, the Gemini circuit breaker and queues
+register_stats_source("gemini_breaker", gemini_service.breaker.snapshot)
+register_stats_source("gemini_cache", gemini_service.cache.stats)
+register_stats_source("gemini_prefetch", commentary_prefetcher.stats)
+register_stats_source("report_cache", report_cache.stats)
+register_stats_source("analysis_idempotency", analysis_idempotency.stats)
+register_stats_source("analysis_jobs", job_runner.stats)
+register_stats_source("analysis_admission", analysis_admission.stats)
+# (Firestore helpers only once Firebase is initialized; a scrape never triggers it)
+register_stats_source(
+    "doctor_links",
+    lambda: firebase_service.doctor_links.stats()
+    if firebase_service.initialized and firebase_service.doctor_links else {},
+)
+register_stats_source(
+    "result_writer",
+    lambda: {"pending": firebase_service.result_writer.pending()}
+    if firebase_service.initialized and firebase_service.result_writer else {},
+)
+register_stats_source("model_registry", model_registry.stats)
+register_stats_source("startup", startup_report.stats)
+
+# Hot reloads triggered by SIGHUP (kept referenced until done)
+_reload_tasks = set()
+
+def _reload_models():
+    task = asyncio.ensure_future(model_registry.reload_all())
+    _reload_tasks.add(task)
+    task.add_done_callback(_reload_tasks.discard)
+
+startup_report.record("app_import", time.time() - startup_report.started_at)
+
+def _warm_pdf_renderer():
+    from app.services.scan_pdf import warm_report_assets
+    warm_report_assets()
+
+# Built in this order by the background warm-up; each is also built on first use
+WARM_UP_COMPONENTS = [
+    ("glaucoma_model", lambda: model_registry.active("glaucoma")),
+    ("dr_model", lambda: model_registry.active("dr")),
+    ("firebase", lambda: firebase_service.initialize()),
+    ("storage", lambda: routes.supabase_service.storage),
+    ("pdf_renderer", _warm_pdf_renderer),
+]
+
+@app.on_event("startup")
+async def startup():
+    # kill -HUP hot-reloads both models from their configured weight files
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, _reload_models)
+    except (AttributeError, NotImplementedError, RuntimeError, ValueError):
+        # No SIGHUP on Windows; not allowed outside the main thread (e.g. TestClient)
+        pass
+    # Accept health checks right away; models and clients load in the background
+    if settings.STARTUP_WARMUP:
+        task = asyncio.ensure_future(warm_up(startup_report, WARM_UP_COMPONENTS))
+        _reload_tasks.add(task)
+        task.add_done_callback(_reload_tasks.discard)
+    # Pull queued /api/jobs work (including jobs left unfinished by a previous run)
+    job_runner.start(routes.supabase_service)
+
+@app.on_event("shutdown")
+async def shutdown():
+    await job_runner.stop()
+    commentary_prefetcher.cancel_all()
+    pdf_render_service.shutdown()
+    # Commit results still buffered for a batched Firestore write
+    if firebase_service.initialized and firebase_service.result_writer is not None:
+        await firebase_service.result_writer.flush()
+    await gemini_service.aclose()
+
 @app.get("/")
 async def root():
     return {
@@ -38,10 +143,27 @@ async def root():
         "status": "running"
     }
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus text-format metrics"""
+    body, content_type = render_latest()
+    return Response(content=body, media_type=content_type)
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/ready")
+async def readiness_check():
+    """200 once both models are loaded (503 while warming up), with startup time per component"""
+    report = startup_report.as_dict()
+    # Without the warm-up everything is built on first use, so there is nothing to wait for
+    ready = report["ready"] or not settings.STARTUP_WARMUP
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content=dict(report, status="ready" if ready else "warming_up", models=model_registry.versions()),
+    )
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host=settings.API_HOST, port=settings.API_PORT)
@@ -0,0 +1,232 @@
+"""Prometheus metrics: per-stage latency histograms, in-flight gauges and scrape-time stats."""
+import functools
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+STAGE_SECONDS = Histogram(
+    "diagnovision_stage_seconds",
+    "Time spent in each processing stage",
+    ["stage", "disease"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    "diagnovision_request_seconds",
+    "End-to-end handler latency",
+    ["endpoint"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUESTS_TOTAL = Counter(
+    "diagnovision_requests_total",
+    "Handled requests by outcome",
+    ["endpoint", "outcome"],
+)
+INFLIGHT = Gauge(
+    "diagnovision_inflight_requests",
+    "Requests currently being handled",
+    ["endpoint"],
+    multiprocess_mode="livesum",
+)
+BACKGROUND_TASKS = Gauge(
+    "diagnovision_background_tasks",
+    "Background tasks currently running (e.g. storage uploads)",
+    ["task"],
+    multiprocess_mode="livesum",
+)
+MODEL_LOAD_SECONDS = Gauge(
+    "diagnovision_model_load_seconds",
+    "Duration of the last model load",
+    ["disease"],
+    multiprocess_mode="max",
+)
+MODEL_INFO = Gauge(
+    "diagnovision_model_info",
+    "1 for the active model version per disease, 0 for replaced versions",
+    ["disease", "version"],
+    multiprocess_mode="max",
+)
+
+REQUEST_PEAK_BYTES = Histogram(
+    "diagnovision_request_peak_bytes",
+    "Peak bytes of large per-request buffers (decoded images, arrays, encoded images)",
+    ["endpoint"],
+    buckets=tuple(mb * 1024 * 1024 for mb in (4, 8, 16, 32, 64, 128, 256, 512, 1024)),
+)
+
+# name -> callable returning a flat dict of numeric stats, read at scrape time
+_stats_sources: dict = {}
+
+
+def track_stage(stage: str, disease: str = "all"):
+    """Context manager timing one stage into diagnovision_stage_seconds."""
+    return STAGE_SECONDS.labels(stage, disease).time()
+
+
+@contextmanager
+def track_request(endpoint: str):
+    """Time a handler, count its outcome and maintain the in-flight gauge."""
+    inflight = INFLIGHT.labels(endpoint)
+    inflight.inc()
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        inflight.dec()
+        REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - started)
+        REQUESTS_TOTAL.labels(endpoint, outcome).inc()
+
+
+def instrument_endpoint(endpoint: str):
+    """Decorator applying track_request to an async route handler."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with track_request(endpoint):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def track_background(task: str):
+    gauge = BACKGROUND_TASKS.labels(task)
+    gauge.inc()
+    try:
+        yield
+    finally:
+        gauge.dec()
+
+
+def _nbytes(obj) -> int:
+    if obj is None:
+        return 0
+    if isinstance(obj, int):
+        return obj
+    if isinstance(obj, (bytes, bytearray, str)):
+        return len(obj)
+    nbytes = getattr(obj, "nbytes", None)  # numpy arrays (and torch tensors >= 2.1)
+    if isinstance(nbytes, int):
+        return nbytes
+    if hasattr(obj, "element_size") and hasattr(obj, "nelement"):
+        return obj.element_size() * obj.nelement()
+    return 0
+
+
+class MemoryLedger:
+    """
+    Accounts the large buffers one request holds (byte counts, arrays, tensors)
+    at stage boundaries and records the peak in diagnovision_request_peak_bytes.
+
+    This is a ledger, not an allocator hook: it only sees what the handler
+    reports via hold()/drop(), which is what dominates per-request memory.
+    """
+
+    def __init__(self):
+        self.current = 0
+        self.peak = 0
+
+    def hold(self, *objs):
+        self.current += sum(_nbytes(o) for o in objs)
+        self.peak = max(self.peak, self.current)
+
+    def drop(self, *objs):
+        self.current = max(0, self.current - sum(_nbytes(o) for o in objs))
+
+    def observe(self, endpoint: str):
+        if self.peak:
+            REQUEST_PEAK_BYTES.labels(endpoint).observe(self.peak)
+
+
+def _process_memory() -> dict:
+    stats = {}
+    try:
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        stats["peak_rss_bytes"] = peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            stats["rss_bytes"] = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    return stats
+
+
+def register_stats_source(name: str, source: Callable[[], dict]):
+    """
+    Expose a component's stats() dict as diagnovision_component_stat{component,stat}.
+
+    Sources are only called when /metrics is scraped, so caches, breakers and
+    queues pay nothing on the request path. Non-numeric values are skipped;
+    booleans are exported as 0/1.
+    """
+    _stats_sources[name] = source
+
+
+class _StatsCollector:
+    def collect(self):
+        family = GaugeMetricFamily(
+            "diagnovision_component_stat",
+            "Scrape-time stats of caches, circuit breakers and queues",
+            labels=["component", "stat"],
+        )
+        for name, source in list(_stats_sources.items()):
+            try:
+                stats = source() or {}
+            except Exception as e:
+                logger.debug("Stats source %s failed: %s", name, e)
+                continue
+            for key, value in stats.items():
+                if isinstance(value, bool):
+                    value = int(value)
+                if isinstance(value, (int, float)):
+                    family.add_metric([name, key], float(value))
+        yield family
+
+
+_stats_collector = _StatsCollector()
+REGISTRY.register(_stats_collector)
+register_stats_source("process", _process_memory)
+
+
+def render_latest() -> tuple:
+    """
+    Return (body, content_type) in Prometheus text exposition format.
+
+    Under app.serve with several workers (PROMETHEUS_MULTIPROC_DIR set), the
+    histograms, counters and gauges are aggregated across all workers; the
+    component stats are those of the worker answering the scrape.
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(_stats_collector)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,77 @@
+"""
+Convert pickled .pth state dicts to memory-mappable .safetensors files.
+
+    python -m app.models.convert_weights              # both configured models
+    python -m app.models.convert_weights models/x.pth
+
+The .safetensors file is written next to the .pth and preferred by the model
+loaders from then on; the .pth is left in place.
+"""
+import argparse
+import sys
+from pathlib import Path
+
+import torch
+from safetensors.torch import load_file, save_file
+
+from app.config import settings
+from app.models.weights import safetensors_path
+
+
+def convert(pth_path: Path, overwrite: bool = False) -> Path:
+    """
+    Write <name>.safetensors next to a .pth state dict and verify the round trip.
+
+    Returns:
+        Path of the .safetensors file
+    """
+    out = safetensors_path(pth_path)
+    if out.exists() and not overwrite:
+        raise FileExistsError(f"{out} exists (use --overwrite)")
+
+    state_dict = torch.load(pth_path, map_location="cpu", weights_only=True)
+    if not isinstance(state_dict, dict) or not all(isinstance(v, torch.Tensor) for v in state_dict.values()):
+        raise ValueError(f"{pth_path} does not contain a plain state dict of tensors")
+
+    # safetensors stores each tensor once, contiguous and unshared
+    tensors = {name: tensor.detach().clone().contiguous() for name, tensor in state_dict.items()}
+    tmp = out.with_suffix(out.suffix + ".tmp")
+    save_file(tensors, str(tmp), metadata={"format": "pt", "source": Path(pth_path).name})
+
+    reloaded = load_file(str(tmp))
+    for name, tensor in tensors.items():
+        if name not in reloaded or not torch.equal(reloaded[name], tensor):
+            tmp.unlink()
+            raise ValueError(f"Round trip mismatch for {name} in {pth_path}")
+    tmp.replace(out)
+    return out
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Convert .pth model weights to .safetensors")
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        help="State dict files (default: GLAUCOMA_MODEL_PATH and DR_MODEL_PATH)",
+    )
+    parser.add_argument("--overwrite", action="store_true", help="Replace existing .safetensors files")
+    args = parser.parse_args(argv)
+
+    paths = [Path(p) for p in args.paths] or [Path(settings.GLAUCOMA_MODEL_PATH), Path(settings.DR_MODEL_PATH)]
+    failed = 0
+    for path in paths:
+        if not path.exists():
+            print(f"skip {path}: not found")
+            continue
+        try:
+            out = convert(path, overwrite=args.overwrite)
+        except (FileExistsError, ValueError, RuntimeError) as e:
+            print(f"fail {path}: {e}")
+            failed += 1
+            continue
+        print(f"ok   {path} -> {out} ({out.stat().st_size / 1e6:.1f} MB)")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
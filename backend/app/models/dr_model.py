@@ -2,8 +2,11 @@ import torch
 import torch.nn as nn
 from torchvision import models
 import numpy as np
-from pathlib import Path
 import logging
+import time
+
+from app.metrics import MODEL_LOAD_SECONDS
+from app.models.weights import load_into, resolve_weights_path, weights_version
 
 logger = logging.getLogger(__name__)
 
@@ -13,29 +16,41 @@ class DRModel:
     def __init__(self, model_path: str):
         self.model_path = model_path
         self.model = None
+        self.version = "placeholder"
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self.class_names = ['No DR', 'Mild/Mod', 'Severe', 'Proliferative']
         self.num_classes = 4
         self.load_model()
     
+    def build_architecture(self) -> nn.Module:
+        """
+        Build EfficientNet-B3 with the 4-class head (randomly initialised)
+        
+        Returns:
+            Model in training mode on CPU, before loading trained weights
+        """
+        model = models.efficientnet_b3(weights=None)
+        
+        # Replace final classifier for 4 classes
+        num_features = model.classifier[1].in_features
+        model.classifier[1] = nn.Linear(num_features, self.num_classes)
+        return model
+    
     def load_model(self):
         """Load the DR detection model (EfficientNet-B3)"""
+        started = time.perf_counter()
         try:
-            if Path(self.model_path).exists():
-                # Load pre-trained EfficientNet-B3
-                model = models.efficientnet_b3(weights=None)  # We load our own weights
-                
-                # Replace final classifier for 4 classes
-                num_features = model.classifier[1].in_features
-                model.classifier[1] = nn.Linear(num_features, self.num_classes)
-                
-                # Load trained weights
-                model.load_state_dict(torch.load(self.model_path, map_location=self.device))
-                model.eval()  # Set to evaluation mode
+            weights_path = resolve_weights_path(self.model_path)
+            if weights_path is not None:
+                # Trained weights are memory-mapped and assigned onto an un-initialised
+                # architecture (the state dict covers every layer, including the backbone)
+                model = load_into(self.build_architecture, weights_path)
                 model = model.to(self.device)
                 
                 self.model = model
-                logger.info(f"DR model loaded from {self.model_path} on device: {self.device}")
+                self.version = weights_version(weights_path)
+                MODEL_LOAD_SECONDS.labels("dr").set(time.perf_counter() - started)
+                logger.info(f"DR model {self.version} loaded from {weights_path} on device: {self.device}")
             else:
                 logger.warning(f"Model file not found at {self.model_path}. Using placeholder.")
                 self.model = None
@@ -53,47 +68,64 @@ class DRModel:
         Returns:
             Prediction result and confidence
         """
+        # Ensure image has batch dimension
+        if len(preprocessed_image.shape) == 3:
+            preprocessed_image = preprocessed_image.unsqueeze(0)
+        return self.predict_batch(preprocessed_image)[0]
+    
+    def predict_batch(self, batch: torch.Tensor) -> list:
+        """
+        Run inference on a batch of preprocessed images in one forward pass
+        
+        Args:
+            batch: Preprocessed image tensors (N, 3, 300, 300)
+        
+        Returns:
+            One prediction dict per image, as returned by predict()
+        """
         if self.model is None:
             # Placeholder prediction for development
             logger.warning("Using placeholder prediction - model not loaded")
-            return {
-                "prediction": "No signs detected",
-                "confidence": 0.90,
-                "predicted_class": "No DR",
-                "raw_output": [0.90, 0.05, 0.03, 0.02]  # [No DR, Mild/Mod, Severe, Proliferative]
-            }
+            return [
+                {
+                    "prediction": "No signs detected",
+                    "confidence": 0.90,
+                    "predicted_class": "No DR",
+                    "raw_output": [0.90, 0.05, 0.03, 0.02]  # [No DR, Mild/Mod, Severe, Proliferative]
+                }
+                for _ in range(len(batch))
+            ]
         
         try:
-            # Ensure image is on correct device and has batch dimension
-            if len(preprocessed_image.shape) == 3:
-                preprocessed_image = preprocessed_image.unsqueeze(0)
-            
-            preprocessed_image = preprocessed_image.to(self.device)
+            # Ensure images are on correct device
+            batch = batch.to(self.device)
             
             # Run prediction
             with torch.no_grad():
-                outputs = self.model(preprocessed_image)
+                outputs = self.model(batch)
                 probabilities = torch.nn.functional.softmax(outputs, dim=1)
             
-            # Get prediction
-            probs = probabilities[0].cpu().numpy()
-            pred_idx = int(np.argmax(probs))  # Convert numpy.int64 to Python int for Captum
-            confidence = float(probs[pred_idx])
-            pred_class = self.class_names[pred_idx]
-            
-            # Determine result message
-            if pred_class == 'No DR' and confidence > 0.5:
-                result = "No signs detected"
-            else:
-                result = "Signs detected"
-            
-            return {
-                "prediction": result,
-                "confidence": confidence,
-                "predicted_class": pred_class,
-                "predicted_class_idx": pred_idx,
-                "raw_output": probs.tolist()  # [No DR, Mild/Mod, Severe, Proliferative]
-            }
+            return [self._prediction(probs) for probs in probabilities.cpu().numpy()]
         except Exception as e:
             logger.error(f"Error during DR prediction: {str(e)}")
             raise
+    
+    def _prediction(self, probs: np.ndarray) -> dict:
+        # Get prediction
+        pred_idx = int(np.argmax(probs))  # Convert numpy.int64 to Python int for Captum
+        confidence = float(probs[pred_idx])
+        pred_class = self.class_names[pred_idx]
+        
+        # Determine result message
+        if pred_class == 'No DR' and confidence > 0.5:
+            result = "No signs detected"
+        else:
+            result = "Signs detected"
+        
+        return {
+            "prediction": result,
+            "confidence": confidence,
+            "predicted_class": pred_class,
+            "predicted_class_idx": pred_idx,
+            "raw_output": probs.tolist()  # [No DR, Mild/Mod, Severe, Proliferative]
+        }
@@ -2,8 +2,11 @@ import torch
 import torch.nn as nn
 from torchvision import models
 import numpy as np
-from pathlib import Path
 import logging
+import time
+
+from app.metrics import MODEL_LOAD_SECONDS
+from app.models.weights import load_into, resolve_weights_path, weights_version
 
 logger = logging.getLogger(__name__)
 
@@ -13,32 +16,47 @@ class GlaucomaModel:
     def __init__(self, model_path: str):
         self.model_path = model_path
         self.model = None
+        self.version = "placeholder"
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self.class_names = ['glaucoma', 'normal']
         self.load_model()
     
+    def build_architecture(self, weights=None) -> nn.Module:
+        """
+        Build MobileNetV2 with the 2-class head (randomly initialised unless weights given)
+        
+        Args:
+            weights: Optional torchvision weights for the backbone
+        
+        Returns:
+            Model in training mode on CPU, before loading trained weights
+        """
+        model = models.mobilenet_v2(weights=weights)
+        
+        # Freeze all layers
+        for param in model.parameters():
+            param.requires_grad = False
+        
+        # Replace final classifier for 2 classes (glaucoma, normal)
+        num_features = model.classifier[1].in_features
+        model.classifier[1] = nn.Linear(num_features, len(self.class_names))
+        return model
+    
     def load_model(self):
         """Load the Glaucoma detection model (PyTorch MobileNetV2)"""
+        started = time.perf_counter()
         try:
-            if Path(self.model_path).exists():
-                # Load pre-trained MobileNetV2
-                model = models.mobilenet_v2(weights=models.MobileNet_V2_Weights.DEFAULT)
-                
-                # Freeze all layers
-                for param in model.parameters():
-                    param.requires_grad = False
-                
-                # Replace final classifier for 2 classes (glaucoma, normal)
-                num_features = model.classifier[1].in_features
-                model.classifier[1] = nn.Linear(num_features, len(self.class_names))
-                
-                # Load trained weights
-                model.load_state_dict(torch.load(self.model_path, map_location=self.device))
-                model.eval()  # Set to evaluation mode
+            weights_path = resolve_weights_path(self.model_path)
+            if weights_path is not None:
+                # Trained weights are memory-mapped and assigned onto an un-initialised
+                # architecture (the state dict covers every layer, including the backbone)
+                model = load_into(self.build_architecture, weights_path)
                 model = model.to(self.device)
                 
                 self.model = model
-                logger.info(f"Glaucoma model loaded from {self.model_path} on device: {self.device}")
+                self.version = weights_version(weights_path)
+                MODEL_LOAD_SECONDS.labels("glaucoma").set(time.perf_counter() - started)
+                logger.info(f"Glaucoma model {self.version} loaded from {weights_path} on device: {self.device}")
             else:
                 logger.warning(f"Model file not found at {self.model_path}. Using placeholder.")
                 self.model = None
@@ -56,45 +74,62 @@ class GlaucomaModel:
         Returns:
             Prediction result and confidence
         """
+        # Ensure image has batch dimension
+        if len(preprocessed_image.shape) == 3:
+            preprocessed_image = preprocessed_image.unsqueeze(0)
+        return self.predict_batch(preprocessed_image)[0]
+    
+    def predict_batch(self, batch: torch.Tensor) -> list:
+        """
+        Run inference on a batch of preprocessed images in one forward pass
+        
+        Args:
+            batch: Preprocessed image tensors (N, 3, 224, 224)
+        
+        Returns:
+            One prediction dict per image, as returned by predict()
+        """
         if self.model is None:
             # Placeholder prediction for development
             logger.warning("Using placeholder prediction - model not loaded")
-            return {
-                "prediction": "No signs detected",
-                "confidence": 0.85,
-                "raw_output": [0.15, 0.85]  # [glaucoma, normal]
-            }
+            return [
+                {
+                    "prediction": "No signs detected",
+                    "confidence": 0.85,
+                    "raw_output": [0.15, 0.85]  # [glaucoma, normal]
+                }
+                for _ in range(len(batch))
+            ]
         
         try:
-            # Ensure image is on correct device and has batch dimension
-            if len(preprocessed_image.shape) == 3:
-                preprocessed_image = preprocessed_image.unsqueeze(0)
-            
-            preprocessed_image = preprocessed_image.to(self.device)
+            # Ensure images are on correct device
+            batch = batch.to(self.device)
             
             # Run prediction
             with torch.no_grad():
-                outputs = self.model(preprocessed_image)
+                outputs = self.model(batch)
                 probabilities = torch.nn.functional.softmax(outputs, dim=1)
             
-            # Get prediction
-            probs = probabilities[0].cpu().numpy()
-            pred_idx = np.argmax(probs)
-            confidence = float(probs[pred_idx])
-            pred_class = self.class_names[pred_idx]
-            
-            # Determine result message
-            if pred_class == 'glaucoma' and confidence > 0.5:
-                result = "Signs detected"
-            else:
-                result = "No signs detected"
-            
-            return {
-                "prediction": result,
-                "confidence": confidence,
-                "predicted_class": pred_class,
-                "raw_output": probs.tolist()  # [glaucoma_prob, normal_prob]
-            }
+            return [self._prediction(probs) for probs in probabilities.cpu().numpy()]
         except Exception as e:
             logger.error(f"Error during Glaucoma prediction: {str(e)}")
             raise
+    
+    def _prediction(self, probs: np.ndarray) -> dict:
+        # Get prediction
+        pred_idx = np.argmax(probs)
+        confidence = float(probs[pred_idx])
+        pred_class = self.class_names[pred_idx]
+        
+        # Determine result message
+        if pred_class == 'glaucoma' and confidence > 0.5:
+            result = "Signs detected"
+        else:
+            result = "No signs detected"
+        
+        return {
+            "prediction": result,
+            "confidence": confidence,
+            "predicted_class": pred_class,
+            "raw_output": probs.tolist()  # [glaucoma_prob, normal_prob]
+        }
@@ -0,0 +1,99 @@
+"""Model weight files: memory-mapped loading of safetensors / .pth state dicts."""
+import hashlib
+import logging
+from pathlib import Path
+from typing import Dict, Optional
+
+import torch
+from safetensors.torch import load_file
+
+logger = logging.getLogger(__name__)
+
+SAFETENSORS_SUFFIX = ".safetensors"
+
+
+def safetensors_path(model_path: str) -> Path:
+    """Sibling .safetensors file for a .pth path (e.g. models/x.pth -> models/x.safetensors)."""
+    return Path(model_path).with_suffix(SAFETENSORS_SUFFIX)
+
+
+def resolve_weights_path(model_path: str) -> Optional[Path]:
+    """
+    Pick the weight file to load for a configured model path.
+
+    A converted .safetensors next to the .pth wins unless the .pth is newer
+    (replaced after conversion), in which case the .pth is loaded so a
+    replaced file is never shadowed by stale converted weights.
+
+    Returns:
+        Path to load, or None when neither file exists
+    """
+    converted = safetensors_path(model_path)
+    path = Path(model_path)
+    if converted.exists():
+        if path.exists() and path != converted and path.stat().st_mtime > converted.stat().st_mtime:
+            logger.warning(f"{path} is newer than {converted}; loading the .pth (re-run convert_weights)")
+            return path
+        return converted
+    return path if path.exists() else None
+
+
+def weights_version(path: Path) -> str:
+    """
+    Content-derived version of a weight file, e.g. "efficientnet_b3_final_aptos@3f2a9c1b07de".
+
+    The digest covers the file bytes, so replacing the file changes the version
+    and reloading an unchanged file keeps it.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return f"{Path(path).stem}@{digest.hexdigest()[:12]}"
+
+
+def load_state_dict(path: Path) -> Dict[str, torch.Tensor]:
+    """
+    Load a state dict without copying the weights into private memory.
+
+    safetensors files and zip-format .pth files are memory-mapped, so tensors
+    are backed by the page cache and shared by every process that maps the same
+    file. Legacy (pre-zip) .pth files cannot be mapped and are read normally.
+    Pickles are loaded with weights_only=True; nothing but tensors is unpickled.
+
+    Args:
+        path: .safetensors or .pth file
+
+    Returns:
+        State dict of CPU tensors
+    """
+    path = Path(path)
+    if path.suffix == SAFETENSORS_SUFFIX:
+        return load_file(str(path), device="cpu")
+    try:
+        return torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+    except RuntimeError as e:
+        if "mmap" not in str(e):
+            raise
+        logger.warning(f"{path} is not in zip format and cannot be memory-mapped; run app.models.convert_weights")
+        return torch.load(path, map_location="cpu", weights_only=True)
+
+
+def load_into(model_factory, path: Path) -> torch.nn.Module:
+    """
+    Build an architecture on the meta device and attach the mapped weights.
+
+    Skips random initialisation entirely: parameters and buffers are assigned
+    straight from the state dict (strict, so every key must be present).
+
+    Args:
+        model_factory: Callable returning the un-initialised architecture
+        path: Weight file from resolve_weights_path()
+
+    Returns:
+        Model in eval mode on CPU
+    """
+    with torch.device("meta"):
+        model = model_factory()
+    model.load_state_dict(load_state_dict(path), assign=True)
+    return model.eval()
@@ -1,63 +1,116 @@
+import asyncio
 import logging
+import threading
+from typing import Collection, Optional, Sequence
+import torch
 from app.models.glaucoma_model import GlaucomaModel
 from app.preprocessing.glaucoma_preprocess import GlaucomaPreprocessor
 from app.gradcam.glaucoma_gradcam import GlaucomaGradCAM
 from app.config import settings
+from app.metrics import track_stage
+from app.profiling import profile_stage
+from app.preprocessing.ingest import ImageSource
 
 logger = logging.getLogger(__name__)
 
 class GlaucomaPipeline:
     """Complete pipeline for Glaucoma detection"""
     
-    def __init__(self):
-        self.model = GlaucomaModel(settings.GLAUCOMA_MODEL_PATH)
+    def __init__(self, model_path: Optional[str] = None):
+        self.model = GlaucomaModel(model_path or settings.GLAUCOMA_MODEL_PATH)
         self.preprocessor = GlaucomaPreprocessor()
+        # Grad-CAM hooks the shared model, so inference on it runs one image at a time
+        self._lock = threading.Lock()
         self.gradcam = GlaucomaGradCAM(self.model.model)
     
-    async def process(self, image_bytes: bytes, patient_id: str):
+    async def process(self, image_source: ImageSource, patient_id: str, outputs: Optional[Collection[str]] = None):
         """
         Complete Glaucoma analysis pipeline
         
         Args:
-            image_bytes: Raw image bytes
+            image_source: Raw image bytes or an IngestedImage spool
             patient_id: Patient ID for logging
+            outputs: Requested outputs ("heatmap", "overlay"); None means all. Grad-CAM is
+                     skipped entirely when neither is requested
         
         Returns:
-            Dictionary with result message, confidence, and GradCAM image
+            Dictionary with result message, confidence, and GradCAM images (None when not requested)
         """
+        # Torch, Grad-CAM and cv2 work runs in a worker thread so the event loop stays responsive
+        return await asyncio.to_thread(self._process, image_source, patient_id, outputs)
+    
+    def _process(self, image_source: ImageSource, patient_id: str, outputs: Optional[Collection[str]]) -> dict:
         try:
             logger.info(f"Starting Glaucoma pipeline for patient {patient_id}")
             
             # Step 1: Preprocess image (matching training notebook)
-            preprocessed_image = self.preprocessor.preprocess(image_bytes)
+            preprocessed_image = self.preprocessor.preprocess(image_source)
             logger.debug("Image preprocessed for Glaucoma model")
             
-            # Step 2: Run model inference
-            prediction = self.model.predict(preprocessed_image)
-            logger.debug(f"Glaucoma prediction: {prediction['prediction']} (confidence: {prediction['confidence']:.2f})")
-            
-            # Step 3: Generate GradCAM with heatmap and overlay (use predicted class index)
-            # Class 0 = glaucoma, Class 1 = normal
-            predicted_class_idx = 0 if prediction.get("predicted_class") == "glaucoma" else 1
-            gradcam_results = self.gradcam.generate_gradcam(preprocessed_image, image_bytes, predicted_class_idx)
-            logger.debug("GradCAM generated for Glaucoma")
-            
-            # Format result message
-            result_msg = self._format_result_message(prediction)
-            
-            return {
-                "result_msg": result_msg,
-                "confidence": prediction["confidence"],
-                "prediction": prediction["prediction"],
-                "gradcam_heatmap": gradcam_results["heatmap_only"],
-                "gradcam_overlay": gradcam_results["overlay"],
-                "raw_output": prediction.get("raw_output", [])
-            }
+            with self._lock:
+                # Step 2: Run model inference
+                with track_stage("forward", "glaucoma"), profile_stage("glaucoma_forward"):
+                    prediction = self.model.predict(preprocessed_image)
+                logger.debug(f"Glaucoma prediction: {prediction['prediction']} (confidence: {prediction['confidence']:.2f})")
+                
+                return self._complete(preprocessed_image, image_source, prediction, outputs)
             
         except Exception as e:
             logger.error(f"Error in Glaucoma pipeline: {str(e)}")
             raise
     
+    def process_batch(self, image_sources: Sequence[ImageSource], outputs: Optional[Collection[str]] = None) -> list:
+        """
+        Glaucoma analysis of several images with one batched forward pass (offline bulk runs)
+        
+        Args:
+            image_sources: Images (bytes, IngestedImage or PIL) to analyze together
+            outputs: Requested outputs, as for process(); Grad-CAM still runs per image
+        
+        Returns:
+            One result dictionary per image, as returned by process()
+        """
+        preprocessed = [self.preprocessor.preprocess(source) for source in image_sources]
+        with self._lock:
+            with track_stage("forward", "glaucoma"):
+                predictions = self.model.predict_batch(torch.stack(preprocessed))
+            return [
+                self._complete(image, source, prediction, outputs)
+                for image, source, prediction in zip(preprocessed, image_sources, predictions)
+            ]
+    
+    def _complete(self, preprocessed_image, image_source: ImageSource, prediction: dict,
+                  outputs: Optional[Collection[str]]) -> dict:
+        """Grad-CAM (when requested) and the result dictionary for one prediction"""
+        # Step 3: Generate GradCAM with heatmap and overlay (use predicted class index)
+        # Class 0 = glaucoma, Class 1 = normal
+        predicted_class_idx = 0 if prediction.get("predicted_class") == "glaucoma" else 1
+        want_heatmap = outputs is None or "heatmap" in outputs
+        want_overlay = outputs is None or "overlay" in outputs
+        gradcam_results = {"heatmap_only": None, "overlay": None}
+        if want_heatmap or want_overlay:
+            with profile_stage("glaucoma_gradcam"):
+                gradcam_results = self.gradcam.generate_gradcam(
+                    preprocessed_image, image_source, predicted_class_idx, overlay=want_overlay
+                )
+            if not want_heatmap:
+                gradcam_results["heatmap_only"] = None
+            logger.debug("GradCAM generated for Glaucoma")
+        
+        # Format result message
+        result_msg = self._format_result_message(prediction)
+        
+        return {
+            "result_msg": result_msg,
+            "confidence": prediction["confidence"],
+            "prediction": prediction["prediction"],
+            "predicted_class": prediction.get("predicted_class", ""),
+            "gradcam_heatmap": gradcam_results["heatmap_only"],
+            "gradcam_overlay": gradcam_results["overlay"],
+            "raw_output": prediction.get("raw_output", []),
+            "model_version": self.model.version,
+        }
+    
     def _format_result_message(self, prediction: dict) -> str:
         """Format prediction result into human-readable message"""
         confidence = prediction["confidence"]
@@ -67,4 +120,3 @@ class GlaucomaPipeline:
             return f"Signs of Glaucoma detected (confidence: {confidence:.1%})"
         else:
             return f"No signs of Glaucoma detected (confidence: {confidence:.1%})"
-
@@ -4,7 +4,9 @@ import torch
 from torchvision import transforms
 import cv2
 import logging
-import io
+
+from app.metrics import track_stage
+from app.preprocessing.ingest import ImageSource, open_image
 
 logger = logging.getLogger(__name__)
 
@@ -40,23 +42,26 @@ class DRPreprocessor:
             transforms.Normalize(mean=self.imagenet_mean, std=self.imagenet_std)
         ])
     
-    def preprocess(self, image_bytes: bytes) -> torch.Tensor:
+    def preprocess(self, image_source: ImageSource) -> torch.Tensor:
         """
         Preprocess image for DR model (matching training notebook)
         
         Args:
-            image_bytes: Raw image bytes
+            image_source: Raw image bytes, an IngestedImage spool or a PIL image
         
         Returns:
             Preprocessed image tensor (3, 300, 300) ready for model input
         """
         try:
-            # Convert bytes to PIL Image
-            image = Image.open(io.BytesIO(image_bytes))
-            image = image.convert('RGB')
+            # Decode to PIL Image (an ingested upload is decoded once and shared by both pipelines)
+            with track_stage("decode", "dr"):
+                image = open_image(image_source)
+                if image.mode != 'RGB':
+                    image = image.convert('RGB')
             
             # Apply transforms (resize, Ben Graham, to tensor, normalize)
-            image_tensor = self.transform(image)
+            with track_stage("preprocess", "dr"):
+                image_tensor = self.transform(image)
             
             return image_tensor
             
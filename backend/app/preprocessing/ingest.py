@@ -0,0 +1,255 @@
+"""Upload ingestion: chunked streaming with byte / pixel limits, hashing and disk spooling."""
+from __future__ import annotations
+
+import hashlib
+import io
+import logging
+import tempfile
+import threading
+from typing import TYPE_CHECKING, Optional, Union
+
+from starlette.responses import JSONResponse
+
+from app.config import settings
+
+# Pillow and numpy load on the first upload / model load rather than with the app
+if TYPE_CHECKING:
+    import numpy as np
+    from PIL import Image
+
+# Allowance for multipart boundaries and the other form fields on top of the image bytes
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+class IngestError(Exception):
+    """Upload rejected during ingestion; status_code is the HTTP status to return."""
+
+    status_code = 400
+
+
+class UploadTooLarge(IngestError):
+    status_code = 413
+
+
+class ImageTooLarge(IngestError):
+    status_code = 413
+
+
+class InvalidImage(IngestError):
+    status_code = 400
+
+
+class IngestedImage:
+    """
+    An uploaded image spooled to memory (small) or a temporary file (large).
+
+    Decoders read the spool directly through open(); read_bytes() is only
+    for consumers that genuinely need the encoded bytes (base64, storage).
+    """
+
+    def __init__(self, spool, size: int, sha256: str, width: int, height: int, image_format: Optional[str]):
+        self.spool = spool
+        self.size = size
+        self.sha256 = sha256
+        self.width = width
+        self.height = height
+        self.format = image_format
+        self._decoded: Optional[Image.Image] = None
+        self._rgb_array: Optional[np.ndarray] = None
+        # Both pipelines decode from their own worker threads
+        self._decode_lock = threading.RLock()
+
+    def open(self) -> Image.Image:
+        """Lazily decoding PIL image reading from the spool."""
+        from PIL import Image
+
+        self.spool.seek(0)
+        return Image.open(self.spool)
+
+    def decode(self) -> Image.Image:
+        """Decode to RGB once; both pipelines share the result until release_decoded()."""
+        with self._decode_lock:
+            if self._decoded is None:
+                image = self.open()
+                if image.mode != "RGB":
+                    image = image.convert("RGB")
+                else:
+                    image.load()
+                self._decoded = image
+            return self._decoded
+
+    def rgb_array(self) -> np.ndarray:
+        """Read-only (H, W, 3) uint8 view of the decoded image, shared by the Grad-CAM overlays."""
+        import numpy as np
+
+        with self._decode_lock:
+            if self._rgb_array is None:
+                self._rgb_array = np.asarray(self.decode())
+            return self._rgb_array
+
+    def decoded_nbytes(self) -> int:
+        total = 0
+        if self._decoded is not None:
+            # PIL keeps RGB pixels 4 bytes wide
+            total += self.width * self.height * 4
+        if self._rgb_array is not None:
+            total += self._rgb_array.nbytes
+        return total
+
+    def release_decoded(self):
+        self._decoded = None
+        self._rgb_array = None
+
+    def read_bytes(self) -> bytes:
+        self.spool.seek(0)
+        return self.spool.read()
+
+    def close(self):
+        self.release_decoded()
+        self.spool.close()
+
+
+ImageSource = Union[bytes, bytearray, memoryview, IngestedImage, "Image.Image", "np.ndarray"]
+
+
+def open_image(source: ImageSource) -> Image.Image:
+    """Open an image from raw bytes, an IngestedImage (decoded once) or an already decoded PIL image."""
+    from PIL import Image
+
+    if isinstance(source, Image.Image):
+        return source
+    if isinstance(source, IngestedImage):
+        return source.decode()
+    return Image.open(io.BytesIO(source))
+
+
+def rgb_array(source: ImageSource) -> np.ndarray:
+    """(H, W, 3) uint8 RGB array for a source, without copying when it is already decoded."""
+    import numpy as np
+
+    if isinstance(source, np.ndarray):
+        return source
+    if isinstance(source, IngestedImage):
+        return source.rgb_array()
+    image = open_image(source)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return np.asarray(image)
+
+
+def image_size(source: ImageSource) -> tuple:
+    """(width, height) of a source without decoding pixels when it can be avoided."""
+    import numpy as np
+
+    if isinstance(source, np.ndarray):
+        return source.shape[1], source.shape[0]
+    if isinstance(source, IngestedImage):
+        return source.width, source.height
+    return open_image(source).size
+
+
+def _probe(spool, max_pixels: int) -> tuple:
+    """Read only the image header and enforce the pixel limit before any decode."""
+    from PIL import Image
+
+    spool.seek(0)
+    try:
+        with Image.open(spool) as img:
+            width, height = img.size
+            image_format = img.format
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e))
+    except Exception:
+        raise InvalidImage("Unsupported or corrupt image file")
+    if width * height > max_pixels:
+        raise ImageTooLarge(
+            f"Image is {width}x{height} ({width * height / 1e6:.1f} MP); limit is {max_pixels / 1e6:.1f} MP"
+        )
+    return width, height, image_format
+
+
+async def ingest_upload(
+    upload,
+    max_bytes: Optional[int] = None,
+    max_pixels: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+) -> IngestedImage:
+    """
+    Stream an UploadFile into a spool in chunks.
+
+    Rejects the upload as soon as it exceeds max_bytes, hashes it (sha256) as
+    chunks arrive and checks the pixel count from the header before anything
+    is decoded. Files above INGEST_SPOOL_MAX_BYTES are kept on disk.
+
+    Starlette has already parsed (and spooled) the whole multipart body by the
+    time this runs, so max_bytes bounds what is kept, not what is received;
+    UploadLimitMiddleware rejects oversized bodies up front from their
+    Content-Length (a chunked body without one is only caught here).
+
+    Raises:
+        UploadTooLarge, ImageTooLarge, InvalidImage
+    """
+    max_bytes = settings.INGEST_MAX_BYTES if max_bytes is None else max_bytes
+    max_pixels = settings.INGEST_MAX_PIXELS if max_pixels is None else max_pixels
+    chunk_size = settings.INGEST_CHUNK_BYTES if chunk_size is None else chunk_size
+
+    declared = getattr(upload, "size", None)
+    if declared is not None and declared > max_bytes:
+        raise UploadTooLarge(f"Upload is {declared} bytes; limit is {max_bytes} bytes")
+
+    spool = tempfile.SpooledTemporaryFile(max_size=settings.INGEST_SPOOL_MAX_BYTES)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        while True:
+            chunk = await upload.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge(f"Upload exceeds the {max_bytes} byte limit")
+            digest.update(chunk)
+            spool.write(chunk)
+        if size == 0:
+            raise InvalidImage("Empty upload")
+        width, height, image_format = _probe(spool, max_pixels)
+    except Exception:
+        spool.close()
+        raise
+    finally:
+        await upload.close()
+
+    logger.debug("Ingested %s bytes (%sx%s %s, sha256 %s)", size, width, height, image_format, digest.hexdigest()[:12])
+    return IngestedImage(spool, size, digest.hexdigest(), width, height, image_format)
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware answering 413 to uploads whose Content-Length exceeds the
+    path's limit, before the multipart body is read.
+
+    limits maps request paths to the most image bytes they accept.
+    """
+
+    def __init__(self, app, limits: dict):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope.get("path")) if scope["type"] == "http" else None
+        if limit is not None:
+            headers = dict(scope.get("headers", []))
+            try:
+                length = int(headers.get(b"content-length", b""))
+            except ValueError:
+                length = None
+            if length is not None and length > limit + MULTIPART_OVERHEAD_BYTES:
+                logger.warning("Rejected %s upload of %s bytes (limit %s)", scope["path"], length, limit)
+                response = JSONResponse(
+                    status_code=413, content={"detail": f"Upload is {length} bytes; limit is {limit} bytes"}
+                )
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
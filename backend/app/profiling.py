@@ -0,0 +1,147 @@
+"""Opt-in per-request profiling: cProfile + torch.profiler dumps for one API call."""
+import asyncio
+import cProfile
+import contextvars
+import hmac
+import logging
+import random
+import re
+import threading
+import time
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "x-profile-request"
+PROFILED_PATHS = ("/api/analyze", "/api/scan-report-notify")
+_UNSAFE_NAME_CHARS = re.compile(r"[^A-Za-z0-9_-]")
+
+# Profile of the request being handled in this context (None when not profiling)
+_current: contextvars.ContextVar = contextvars.ContextVar("request_profile", default=None)
+# cProfile can only be active once per interpreter; profile one request at a time
+_profile_lock = threading.Lock()
+
+
+class RequestProfile:
+    """cProfile over the whole handler plus torch.profiler for model / Grad-CAM ops."""
+
+    def __init__(self, endpoint: str, trigger: str):
+        self.endpoint = endpoint
+        self.trigger = trigger
+        self.image_id: Optional[str] = None
+        self.started_at = time.strftime("%Y%m%dT%H%M%S")
+        self._cprofile = cProfile.Profile()
+        self._torch_profile = None
+
+    def start(self):
+        try:
+            import torch
+            from torch.profiler import ProfilerActivity, profile
+
+            activities = [ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(ProfilerActivity.CUDA)
+            self._torch_profile = profile(activities=activities, record_shapes=True)
+            self._torch_profile.__enter__()
+        except Exception as e:
+            logger.warning("torch.profiler unavailable, recording cProfile only: %s", e)
+            self._torch_profile = None
+        self._cprofile.enable()
+
+    def stop(self):
+        self._cprofile.disable()
+        if self._torch_profile is not None:
+            self._torch_profile.__exit__(None, None, None)
+
+    def dump(self, directory: Optional[str] = None) -> list:
+        """Write <stamp>_<endpoint>_<image_id>.pstats / .trace.json; returns the paths."""
+        out_dir = Path(directory or settings.PROFILING_DIR)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        # image_id may come from the client (scan-report-notify): keep it to a safe file name
+        image_id = _UNSAFE_NAME_CHARS.sub("_", self.image_id or "")[:64] or "unknown"
+        stem = f"{self.started_at}_{self.endpoint}_{image_id}"
+        pstats_path = (out_dir / f"{stem}.pstats").resolve()
+        if pstats_path.parent != out_dir.resolve():
+            raise ValueError(f"Invalid profile file name: {stem}")
+        paths = []
+        self._cprofile.dump_stats(str(pstats_path))
+        paths.append(str(pstats_path))
+        if self._torch_profile is not None:
+            trace_path = pstats_path.with_name(f"{stem}.trace.json")
+            try:
+                self._torch_profile.export_chrome_trace(str(trace_path))
+                paths.append(str(trace_path))
+            except Exception as e:
+                logger.warning("Failed to export torch trace for %s: %s", stem, e)
+        return paths
+
+
+def annotate(image_id: Optional[str]):
+    """Attach the image_id to the active profile so the dump files can be found."""
+    profile = _current.get()
+    if profile is not None and image_id:
+        profile.image_id = image_id
+
+
+def profile_stage(name: str):
+    """Label a model / Grad-CAM stage in the torch trace (no-op when not profiling)."""
+    if _current.get() is None:
+        return nullcontext()
+    from torch.profiler import record_function
+
+    return record_function(name)
+
+
+def _trigger(headers: dict) -> Optional[str]:
+    token = settings.PROFILING_ADMIN_TOKEN
+    header_value = headers.get(PROFILE_HEADER)
+    if token and header_value and hmac.compare_digest(header_value, token):
+        return "header"
+    if settings.PROFILING_SAMPLE_RATE > 0 and random.random() < settings.PROFILING_SAMPLE_RATE:
+        return "sample"
+    return None
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling selected API calls.
+
+    A request is profiled when it carries X-Profile-Request matching
+    settings.PROFILING_ADMIN_TOKEN, or is picked by PROFILING_SAMPLE_RATE.
+    Only one request is profiled at a time; cProfile sees every coroutine on
+    the event loop thread while it runs, so profile on a quiet instance.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path") not in PROFILED_PATHS:
+            await self.app(scope, receive, send)
+            return
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        trigger = _trigger(headers)
+        if trigger is None or not _profile_lock.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["path"].rsplit("/", 1)[-1].replace("-", "_"), trigger)
+        token = _current.set(profile)
+        try:
+            profile.start()
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                profile.stop()
+        finally:
+            _current.reset(token)
+            _profile_lock.release()
+        try:
+            paths = await asyncio.to_thread(profile.dump)
+            logger.info("Profiled %s (%s): %s", profile.endpoint, trigger, ", ".join(paths))
+        except Exception as e:
+            logger.error("Failed to write profile for %s: %s", profile.endpoint, e)
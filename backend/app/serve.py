@@ -0,0 +1,231 @@
+"""
+Preforking server: load both models once in a master process, then fork workers.
+
+    python -m app.serve --workers 4 --threads-per-worker 1
+
+Workers inherit the model weights copy-on-write instead of each loading its own
+copy, so adding a worker costs roughly its per-request memory, not another set
+of models. Everything that holds threads, sockets or connections (Supabase,
+Firestore, the Gemini httpx client, the PDF render pool, SQLite handles) is
+created in the workers when app.main is imported there, never in the master.
+Requires os.fork (Linux / macOS).
+
+kill -HUP <master pid> rolls out replaced weight files: every worker hot-reloads
+(see app.services.model_registry) and the master reloads its copy for workers
+forked later.
+"""
+import argparse
+import gc
+import logging
+import os
+import random
+import shutil
+import signal
+import sys
+import tempfile
+import time
+
+logger = logging.getLogger("app.serve")
+
+# Modules that open clients or thread pools on import; none may be loaded before fork
+_POST_FORK_MODULES = ("app.main", "app.api.routes", "app.services.supabase_service", "app.services.firebase_service")
+
+# A worker dying sooner than this after start is treated as a crash loop
+_MIN_WORKER_UPTIME_SECONDS = 5.0
+
+# How often the master's supervision loop checks for exited workers and reload requests
+_SUPERVISE_INTERVAL_SECONDS = 0.5
+
+
+def _configure_metrics_dir(workers: int):
+    """Point prometheus_client at a shared directory so /metrics sums over workers."""
+    if workers <= 1 or os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        return None
+    path = tempfile.mkdtemp(prefix="diagnovision-metrics-")
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = path
+    return path
+
+
+def _preload_models():
+    """Load both pipelines (model weights + Grad-CAM wrappers) into the master."""
+    import torch
+
+    # Keep the master single-threaded so no OpenMP pool exists at fork time
+    torch.set_num_threads(1)
+
+    from app.services.model_registry import model_registry
+
+    started = time.perf_counter()
+    model_registry.preload()
+    logger.info("Preloaded models %s in %.2fs", model_registry.versions(), time.perf_counter() - started)
+
+    loaded = [name for name in _POST_FORK_MODULES if name in sys.modules]
+    if loaded:
+        raise RuntimeError(f"Modules with connections were imported before fork: {', '.join(loaded)}")
+
+
+def _reinit_worker(threads_per_worker: int):
+    """Per-worker state that must not be inherited from the master."""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    # app.main installs the model reload handler once the event loop runs
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    gc.enable()
+
+    # Forked workers would otherwise share the master's RNG state
+    random.seed()
+    import numpy as np
+
+    np.random.seed(int.from_bytes(os.urandom(4), "little"))
+
+    import cv2
+    import torch
+
+    torch.set_num_threads(threads_per_worker)
+    try:
+        torch.set_num_interop_threads(threads_per_worker)
+    except RuntimeError:
+        # Only settable before the first inter-op work in this process
+        pass
+    cv2.setNumThreads(threads_per_worker)
+
+
+def _run_worker(config, sock, threads_per_worker: int):
+    import uvicorn
+
+    _reinit_worker(threads_per_worker)
+    logger.info("Worker %s serving", os.getpid())
+    # The app is imported here, so services and clients are created per worker
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class Master:
+    """Forks and supervises workers; respawns any that die until asked to stop."""
+
+    def __init__(self, config, sock, workers: int, threads_per_worker: int):
+        self.config = config
+        self.sock = sock
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker
+        self.children = {}  # pid -> start time
+        self.stopping = False
+        self.reload_requested = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _run_worker(self.config, self.sock, self.threads_per_worker)
+            except Exception:
+                logger.exception("Worker %s failed", os.getpid())
+                code = 1
+            finally:
+                logging.shutdown()
+                os._exit(code)
+        self.children[pid] = time.monotonic()
+        logger.info("Started worker %s", pid)
+
+    def _handle_signal(self, signum, frame):
+        if not self.stopping:
+            logger.info("Received %s, stopping %s workers", signal.Signals(signum).name, len(self.children))
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _handle_reload(self, signum, frame):
+        # Only pass the signal on and note it; run() reloads the master's copy outside the handler
+        self.reload_requested = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGHUP)
+            except ProcessLookupError:
+                pass
+
+    def _reload(self):
+        """Reload the master's models so workers forked from here on start with the new versions."""
+        self.reload_requested = False
+        logger.info("Received SIGHUP, reloading models in the master and %s workers", len(self.children))
+        from app.services.model_registry import model_registry
+
+        model_registry.preload(refresh=True)
+        gc.freeze()
+        logger.info("Master now holds models %s", model_registry.versions())
+
+    def _reap(self, pid: int, status: int):
+        started = self.children.pop(pid, None)
+        if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+            from prometheus_client import multiprocess
+
+            multiprocess.mark_process_dead(pid)
+        if self.stopping or started is None:
+            return
+        logger.warning("Worker %s exited (status %s), restarting", pid, status)
+        if time.monotonic() - started < _MIN_WORKER_UPTIME_SECONDS:
+            time.sleep(1.0)
+        self.spawn()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGINT, self._handle_signal)
+        signal.signal(signal.SIGHUP, self._handle_reload)
+        for _ in range(self.workers):
+            self.spawn()
+        while self.children:
+            # A SIGHUP during a reload is coalesced into one more reload
+            if self.reload_requested and not self.stopping:
+                self._reload()
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                time.sleep(_SUPERVISE_INTERVAL_SECONDS)
+                continue
+            self._reap(pid, status)
+        logger.info("All workers stopped")
+
+
+def main(argv=None):
+    from app.config import settings
+
+    parser = argparse.ArgumentParser(description="Serve DiagnoVision with preloaded, copy-on-write shared models")
+    parser.add_argument("--host", default=settings.API_HOST)
+    parser.add_argument("--port", type=int, default=settings.API_PORT)
+    parser.add_argument("--workers", type=int, default=settings.SERVE_WORKERS)
+    parser.add_argument("--threads-per-worker", type=int, default=settings.SERVE_THREADS_PER_WORKER)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(process)d %(name)s %(levelname)s %(message)s")
+    if not hasattr(os, "fork"):
+        parser.error("preforking needs os.fork; on this platform run `python -m app.main` instead")
+    if args.workers < 1 or args.threads_per_worker < 1:
+        parser.error("--workers and --threads-per-worker must be at least 1")
+
+    metrics_dir = _configure_metrics_dir(args.workers)
+
+    # Objects created before the fork are moved out of the collector's reach, so
+    # a worker's GC passes don't write to (and un-share) the master's pages
+    gc.disable()
+    _preload_models()
+    gc.freeze()
+
+    import uvicorn
+
+    config = uvicorn.Config("app.main:app", host=args.host, port=args.port, log_level=args.log_level)
+    sock = config.bind_socket()
+    logger.info("Listening on %s:%s with %s workers", args.host, args.port, args.workers)
+    try:
+        Master(config, sock, args.workers, args.threads_per_worker).run()
+    finally:
+        sock.close()
+        if metrics_dir:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
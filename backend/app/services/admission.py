@@ -0,0 +1,172 @@
+"""Admission control for model inference: bounded concurrency, priority lanes and 429 backpressure."""
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Lower value = served first. "high" is for doctor-initiated re-analysis,
+# "bulk" for screening uploads that can wait.
+PRIORITIES = {"high": 0, "normal": 1, "bulk": 2}
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted; retry_after is in whole seconds."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"{reason} (retry after {retry_after}s)")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Limits how many requests run the model pipelines at once.
+
+    Up to max_concurrency requests run; up to max_queue more wait in priority
+    lanes (FIFO within a lane). A waiter gives up after queue_timeout seconds.
+    When the queue is full, a higher-priority arrival preempts the newest
+    waiter of the lowest lane below it; otherwise the arrival is rejected.
+    Retry-After is estimated from an EWMA of recent service times.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: Optional[int] = None,
+        max_queue: Optional[int] = None,
+        queue_timeout: Optional[float] = None,
+        ewma_alpha: float = 0.2,
+    ):
+        self.name = name
+        self.max_concurrency = settings.ADMISSION_MAX_CONCURRENCY if max_concurrency is None else max_concurrency
+        self.max_queue = settings.ADMISSION_MAX_QUEUE if max_queue is None else max_queue
+        self.queue_timeout = settings.ADMISSION_QUEUE_TIMEOUT_SECONDS if queue_timeout is None else queue_timeout
+        self.ewma_alpha = ewma_alpha
+        self.ewma_service_seconds = 1.0
+        self._active = 0
+        self._lanes = {lane: deque() for lane in sorted(PRIORITIES, key=PRIORITIES.get)}
+        self.admitted = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self.preempted = 0
+
+    @staticmethod
+    def resolve_priority(priority: Optional[str]) -> str:
+        """Normalize a client-supplied priority; raises ValueError for unknown lanes."""
+        lane = (priority or settings.ADMISSION_DEFAULT_PRIORITY).strip().lower()
+        if lane not in PRIORITIES:
+            raise ValueError(f"Unknown priority '{priority}' (expected one of: {', '.join(PRIORITIES)})")
+        return lane
+
+    def _queued(self) -> int:
+        return sum(len(q) for q in self._lanes.values())
+
+    def retry_after(self) -> int:
+        if self.max_concurrency <= 0:
+            return 1
+        backlog = self._active + self._queued()
+        return max(1, math.ceil(backlog * self.ewma_service_seconds / self.max_concurrency))
+
+    def _discard(self, lane: str, future: asyncio.Future):
+        try:
+            self._lanes[lane].remove(future)
+        except ValueError:
+            pass
+
+    def _preempt_below(self, lane: str) -> bool:
+        """Reject the newest waiter of the lowest lane below `lane` to make room."""
+        for victim_lane in reversed(self._lanes):
+            if PRIORITIES[victim_lane] <= PRIORITIES[lane]:
+                return False
+            waiters = self._lanes[victim_lane]
+            while waiters:
+                victim = waiters.pop()
+                if not victim.done():
+                    victim.set_exception(AdmissionRejected("preempted", self.retry_after()))
+                    self.preempted += 1
+                    return True
+        return False
+
+    async def acquire(self, priority: str = "normal") -> float:
+        """
+        Wait for a slot in the given lane.
+
+        Returns the admission timestamp to pass to release(). Raises
+        AdmissionRejected when the queue is full, the queue deadline passes
+        or a higher-priority request takes this waiter's place.
+        """
+        if self.max_concurrency <= 0:
+            return time.monotonic()
+        if self._active < self.max_concurrency and not self._queued():
+            self._active += 1
+            self.admitted += 1
+            return time.monotonic()
+        if self._queued() >= self.max_queue and not self._preempt_below(priority):
+            self.rejected_full += 1
+            raise AdmissionRejected("queue_full", self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        self._lanes[priority].append(future)
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            # A slot handed over just as the deadline passed is passed on, not leaked
+            self._abandon(priority, future)
+            self.rejected_timeout += 1
+            raise AdmissionRejected("queue_timeout", self.retry_after())
+        except asyncio.CancelledError:
+            # Client went away: hand back a slot we were given, or leave the queue
+            self._abandon(priority, future)
+            raise
+        self.admitted += 1
+        return time.monotonic()
+
+    def _abandon(self, priority: str, future: asyncio.Future):
+        if future.done() and not future.cancelled() and future.exception() is None:
+            self._release_slot()
+        else:
+            self._discard(priority, future)
+
+    def _release_slot(self):
+        for waiters in self._lanes.values():
+            while waiters:
+                waiter = waiters.popleft()
+                if not waiter.done():
+                    # The slot passes straight to the waiter; _active is unchanged
+                    waiter.set_result(None)
+                    return
+        self._active -= 1
+
+    def release(self, admitted_at: float):
+        """Free the slot taken by acquire() and update the service-time estimate."""
+        if self.max_concurrency <= 0:
+            return
+        elapsed = time.monotonic() - admitted_at
+        self.ewma_service_seconds += self.ewma_alpha * (elapsed - self.ewma_service_seconds)
+        self._release_slot()
+
+    def stats(self) -> dict:
+        stats = {
+            "active": self._active,
+            "queued": self._queued(),
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected_full": self.rejected_full,
+            "rejected_timeout": self.rejected_timeout,
+            "preempted": self.preempted,
+            "ewma_service_seconds": round(self.ewma_service_seconds, 4),
+        }
+        for lane, waiters in self._lanes.items():
+            stats[f"queued_{lane}"] = len(waiters)
+        return stats
+
+
+# Guards /api/analyze (both model pipelines + Grad-CAM + heatmap encoding)
+analysis_admission = AdmissionController("analyze")
@@ -0,0 +1,242 @@
+"""Analysis of one ingested image: selected diseases and outputs, encoding and the storage hand-off."""
+import asyncio
+import base64
+import logging
+import uuid
+from typing import Optional
+
+from app import profiling
+from app.config import settings
+from app.metrics import MemoryLedger, track_background, track_stage
+from app.preprocessing.ingest import IngestedImage
+from app.services.commentary_prefetch import commentary_prefetcher
+from app.services.model_registry import model_registry
+
+logger = logging.getLogger(__name__)
+
+DISEASES = ("glaucoma", "dr")
+# "verdict" is always returned; the others are computed only when requested
+OUTPUTS = ("verdict", "heatmap", "overlay", "original")
+
+
+def _parse_list(value: Optional[str], allowed: tuple, field: str) -> tuple:
+    if value is None or not value.strip():
+        return allowed
+    items = {item.strip().lower() for item in value.split(",") if item.strip()}
+    unknown = items - set(allowed)
+    if unknown:
+        raise ValueError(f"Unknown {field}: {', '.join(sorted(unknown))} (expected any of: {', '.join(allowed)})")
+    return tuple(item for item in allowed if item in items)
+
+
+class AnalysisOptions:
+    """
+    What one analysis computes and keeps.
+
+    diseases: which pipelines run; outputs: which images are produced
+    (heatmap / overlay per disease, original echo); persist: whether the
+    computed images are uploaded to storage.
+    """
+
+    def __init__(self, diseases: tuple = DISEASES, outputs: tuple = OUTPUTS, persist: bool = True):
+        self.diseases = tuple(d for d in DISEASES if d in diseases)
+        self.outputs = tuple(o for o in OUTPUTS if o in outputs or o == "verdict")
+        self.persist = persist
+
+    @classmethod
+    def parse(cls, diseases: Optional[str] = None, outputs: Optional[str] = None,
+              persist: Optional[bool] = None) -> "AnalysisOptions":
+        """Build options from comma-separated form values; raises ValueError for unknown names."""
+        selected = _parse_list(diseases, DISEASES, "diseases")
+        if not selected:
+            raise ValueError("At least one disease must be selected")
+        return cls(selected, _parse_list(outputs, OUTPUTS, "outputs"), True if persist is None else persist)
+
+    def wants(self, output: str) -> bool:
+        return output in self.outputs
+
+    def as_dict(self) -> dict:
+        return {"diseases": list(self.diseases), "outputs": list(self.outputs), "persist": self.persist}
+
+
+def _data_uri(jpeg_bytes: Optional[bytes]) -> Optional[str]:
+    if not jpeg_bytes:
+        return None
+    return "data:image/jpeg;base64," + base64.b64encode(jpeg_bytes).decode("ascii")
+
+
+def _encode_gradcam(result: dict, disease: str, ledger: MemoryLedger, storage) -> Optional[dict]:
+    """JPEG-encode a pipeline's GradCAM arrays and remove the arrays from its result."""
+    heatmap = result.pop("gradcam_heatmap", None)
+    overlay = result.pop("gradcam_overlay", None)
+    if heatmap is None and overlay is None:
+        return None
+    with track_stage("heatmap_encode", disease):
+        encoded = {
+            "heatmap_only": storage._heatmap_to_bytes(heatmap) if heatmap is not None else None,
+            "overlay": storage._heatmap_to_bytes(overlay) if overlay is not None else None,
+        }
+    ledger.hold(encoded["heatmap_only"], encoded["overlay"])
+    ledger.drop(heatmap, overlay)
+    return encoded
+
+
+def _encode_gradcams(results: dict, ledger: MemoryLedger, storage) -> dict:
+    return {
+        disease: _encode_gradcam(result, disease, ledger, storage) if result else None
+        for disease, result in results.items()
+    }
+
+
+async def _upload_in_background(storage, **kwargs):
+    with track_background("storage_upload"), track_stage("storage_upload"):
+        await storage.upload_images_async(**kwargs)
+
+
+def _verdict(result: Optional[dict]) -> Optional[dict]:
+    if result is None:
+        return None
+    return {
+        "result_msg": result["result_msg"],
+        "confidence": result["confidence"],
+        "prediction": result.get("prediction", ""),
+        "raw_output": result.get("raw_output", []),
+        "model_version": result.get("model_version"),
+    }
+
+
+async def analyze(
+    ingested: IngestedImage,
+    patient_id: str,
+    options: AnalysisOptions,
+    storage,
+    ledger: Optional[MemoryLedger] = None,
+    prefetch_commentary: Optional[bool] = None,
+    await_upload: bool = False,
+) -> dict:
+    """
+    Run the selected pipelines on an ingested image and build the /api/analyze response.
+
+    Args:
+        ingested: Spooled upload (decoded once, shared by both pipelines)
+        patient_id: Patient user ID from Firebase
+        options: Diseases, outputs and persistence to apply
+        storage: SupabaseService used for JPEG encoding and the background upload
+        ledger: Per-request memory accounting
+        prefetch_commentary: Start Gemini doctor commentary in the background
+                             (defaults to settings.GEMINI_PREFETCH_ENABLED; needs both diseases)
+        await_upload: Upload before returning and fill in the URLs (background jobs);
+                      by default the upload runs in the background
+
+    Returns:
+        Response content; unselected diseases and unrequested images are None
+    """
+    ledger = ledger or MemoryLedger()
+    logger.info(
+        f"Starting analysis for patient {patient_id} "
+        f"({ingested.width}x{ingested.height}, {ingested.size} bytes, sha256 {ingested.sha256[:12]}, "
+        f"diseases={','.join(options.diseases)}, outputs={','.join(options.outputs)}, persist={options.persist})"
+    )
+
+    # Run the selected pipelines in parallel (each in a worker thread) using asyncio.gather();
+    # the upload is decoded once and shared by the preprocessors and the Grad-CAM overlays. Leases pin the active
+    # model versions so a hot reload can't swap them mid-request.
+    await model_registry.ensure_loaded(*options.diseases)
+    results = dict.fromkeys(DISEASES)
+    with model_registry.lease_many(options.diseases) as pipelines:
+        outcomes = await asyncio.gather(
+            *(pipelines[d].process(ingested, patient_id, options.outputs) for d in options.diseases)
+        )
+    results.update(zip(options.diseases, outcomes))
+    glaucoma_result, dr_result = results["glaucoma"], results["dr"]
+    ledger.hold(
+        ingested.decoded_nbytes(),
+        *(r.get(k) for r in outcomes for k in ("gradcam_heatmap", "gradcam_overlay")),
+    )
+    # The full-resolution decode is not needed past the Grad-CAM overlays
+    ledger.drop(ingested.decoded_nbytes())
+    ingested.release_decoded()
+
+    # Generate image_id for Supabase
+    image_id = str(uuid.uuid4())
+    profiling.annotate(image_id)
+
+    # Both verdicts are known: speculatively start the doctor commentary for the PDF report
+    if prefetch_commentary is None:
+        prefetch_commentary = settings.GEMINI_PREFETCH_ENABLED
+    if prefetch_commentary and glaucoma_result and dr_result:
+        commentary_prefetcher.schedule(
+            image_id,
+            glaucoma_msg=glaucoma_result["result_msg"],
+            dr_msg=dr_result["result_msg"],
+            glaucoma_confidence=glaucoma_result["confidence"],
+            dr_confidence=dr_result["confidence"],
+        )
+
+    # Encode GradCAM arrays ('heatmap_only' and 'overlay') to JPEG once and release the
+    # arrays; only encoded bytes are kept for the response and the background upload
+    gradcam_jpegs = await asyncio.to_thread(_encode_gradcams, results, ledger, storage)
+
+    # Encoded original is only needed for the echo and the storage upload
+    image_bytes = None
+    if options.persist or options.wants("original"):
+        image_bytes = ingested.read_bytes()
+        ledger.hold(image_bytes)
+
+    # Convert images to base64 data URIs for immediate display
+    original_uri = None
+    if options.wants("original"):
+        with track_stage("base64"):
+            original_uri = _data_uri(image_bytes)
+    uris = {}
+    for disease in DISEASES:
+        jpegs = gradcam_jpegs[disease] or {}
+        with track_stage("base64", disease):
+            uris[disease] = (_data_uri(jpegs.get("heatmap_only")), _data_uri(jpegs.get("overlay")))
+    ledger.hold(original_uri, *uris["glaucoma"], *uris["dr"])
+    glaucoma_heatmap_uri, glaucoma_overlay_uri = uris["glaucoma"]
+    dr_heatmap_uri, dr_overlay_uri = uris["dr"]
+
+    # Upload to Supabase in background (non-blocking); the task only holds encoded bytes
+    urls = {}
+    if options.persist:
+        upload = dict(
+            image_id=image_id,
+            original_image=image_bytes,
+            glaucoma_gradcam=gradcam_jpegs["glaucoma"],
+            dr_gradcam=gradcam_jpegs["dr"],
+            patient_id=patient_id
+        )
+        if await_upload:
+            with track_stage("storage_upload"):
+                urls = await storage.upload_images_async(**upload)
+        else:
+            asyncio.create_task(_upload_in_background(storage, **upload))
+    overlay_url = urls.get("glaucoma_overlay") or urls.get("dr_overlay")
+
+    return {
+        "success": True,
+        "patient_id": patient_id,
+        "image_id": image_id,
+        "options": options.as_dict(),
+        "glaucoma": _verdict(glaucoma_result),
+        "dr": _verdict(dr_result),
+        # Base64 images for immediate display
+        "image_base64": original_uri,
+        # Glaucoma images
+        "glaucoma_heatmap_base64": glaucoma_heatmap_uri,
+        "glaucoma_overlay_base64": glaucoma_overlay_uri,
+        # DR images
+        "dr_heatmap_base64": dr_heatmap_uri,
+        "dr_overlay_base64": dr_overlay_uri,
+        # Backward compatibility: Glaucoma images, or DR if Glaucoma not available
+        "heatmap_base64": glaucoma_heatmap_uri or dr_heatmap_uri,
+        "overlay_base64": glaucoma_overlay_uri or dr_overlay_uri,
+        # URLs will be available after async upload completes (for history)
+        # These will be null initially but that's OK - history page will fetch from Supabase
+        "image_url": urls.get("original"),
+        "heatmap_url": urls.get("glaucoma_heatmap") or urls.get("dr_heatmap"),
+        "overlay_url": overlay_url,
+        "gradcam_url": overlay_url,  # For backward compatibility
+        "artifacts": urls,
+    }
@@ -0,0 +1,174 @@
+"""Rolling-window circuit breaker for external dependencies (Gemini)."""
+import logging
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker driven by rolling error-rate and slow-call-rate windows.
+
+    closed    -> calls pass; opens when, over the last window_seconds with at
+                 least min_calls calls, the error rate or slow-call rate
+                 reaches its threshold
+    open      -> calls are rejected immediately for open_seconds
+    half_open -> up to half_open_max_calls probe calls pass; a success closes
+                 the circuit, a failure re-opens it. A probe that never reports
+                 back (cancelled caller) frees its slot via release_probe(), or
+                 expires after open_seconds
+
+    allow() returns a permit (PROBE or CALL) that the caller hands back to
+    record() / release_probe(), so only calls that took a probe slot release
+    one or decide the half-open state; a call admitted while closed that ends
+    after the circuit opened does not count.
+    """
+
+    CALL = "call"
+    PROBE = "probe"
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    STATE_CODES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(
+        self,
+        name: str,
+        window_seconds: float = 60.0,
+        min_calls: int = 5,
+        error_rate_threshold: float = 0.5,
+        slow_call_seconds: float = 10.0,
+        slow_call_rate_threshold: float = 0.5,
+        open_seconds: float = 30.0,
+        half_open_max_calls: int = 1,
+    ):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_rate_threshold = error_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+
+        self._lock = threading.Lock()
+        self._calls = deque()  # (timestamp, ok, latency_seconds)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probes = deque()  # start times of half-open probes in flight
+        self.opened_total = 0
+        self.rejected_total = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._refresh_locked(time.monotonic())
+            return self._state
+
+    def _refresh_locked(self, now: float):
+        if self._state == self.OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = self.HALF_OPEN
+            self._probes.clear()
+            logger.info("Circuit %s half-open: probing dependency", self.name)
+
+    def _trim_locked(self, now: float):
+        cutoff = now - self.window_seconds
+        while self._calls and self._calls[0][0] < cutoff:
+            self._calls.popleft()
+
+    def _open_locked(self, now: float, reason: str):
+        self._state = self.OPEN
+        self._opened_at = now
+        self._probes.clear()
+        self.opened_total += 1
+        logger.warning("Circuit %s opened (%s) for %.0fs", self.name, reason, self.open_seconds)
+
+    def allow(self) -> Optional[str]:
+        """
+        Return a permit (CALL or PROBE) if a call may proceed, else None.
+
+        Callers must then pass the permit to record() with the outcome, or to
+        release_probe() if the call ends without one.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refresh_locked(now)
+            if self._state == self.CLOSED:
+                return self.CALL
+            if self._state == self.HALF_OPEN:
+                while self._probes and now - self._probes[0] >= self.open_seconds:
+                    self._probes.popleft()
+                    logger.warning("Circuit %s: probe never reported back; freeing its slot", self.name)
+                if len(self._probes) < self.half_open_max_calls:
+                    self._probes.append(now)
+                    return self.PROBE
+            self.rejected_total += 1
+            return None
+
+    def record(self, ok: bool, latency: float, permit: str):
+        with self._lock:
+            now = time.monotonic()
+            if self._state == self.HALF_OPEN:
+                if permit != self.PROBE:
+                    return  # admitted before the circuit opened; only probes decide
+                if self._probes:
+                    self._probes.popleft()
+                if ok and latency < self.slow_call_seconds:
+                    self._state = self.CLOSED
+                    self._calls.clear()
+                    logger.info("Circuit %s closed: dependency recovered", self.name)
+                else:
+                    self._open_locked(now, "probe failed")
+                return
+            if self._state == self.OPEN:
+                return
+
+            self._calls.append((now, ok, latency))
+            self._trim_locked(now)
+            total = len(self._calls)
+            if total < self.min_calls:
+                return
+            errors = sum(1 for _, call_ok, _ in self._calls if not call_ok)
+            slow = sum(1 for _, _, lat in self._calls if lat >= self.slow_call_seconds)
+            if errors / total >= self.error_rate_threshold:
+                self._open_locked(now, f"error rate {errors}/{total}")
+            elif slow / total >= self.slow_call_rate_threshold:
+                self._open_locked(now, f"slow calls {slow}/{total}")
+
+    def release_probe(self, permit: str):
+        """Hand back a permit for a call that ended without an outcome (cancelled, caller's deadline)."""
+        with self._lock:
+            if permit == self.PROBE and self._state == self.HALF_OPEN and self._probes:
+                self._probes.popleft()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            self._refresh_locked(now)
+            self._trim_locked(now)
+            total = len(self._calls)
+            errors = sum(1 for _, ok, _ in self._calls if not ok)
+            slow = sum(1 for _, _, lat in self._calls if lat >= self.slow_call_seconds)
+            latencies = sorted(lat for _, _, lat in self._calls)
+            return {
+                "name": self.name,
+                "state": self._state,
+                "state_code": self.STATE_CODES[self._state],
+                "window_calls": total,
+                "window_error_rate": (errors / total) if total else 0.0,
+                "window_slow_call_rate": (slow / total) if total else 0.0,
+                "window_p95_latency_seconds": _percentile(latencies, 0.95),
+                "opened_total": self.opened_total,
+                "rejected_total": self.rejected_total,
+            }
+
+
+def _percentile(sorted_values: list, q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    idx = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[idx]
@@ -0,0 +1,73 @@
+"""Persistent LRU/TTL cache for Gemini doctor commentary."""
+import json
+import math
+import re
+from typing import Optional
+
+from app.config import settings
+from app.services.persistent_cache import PersistentCache
+
+_CONFIDENCE_SUFFIX = re.compile(r"\s*\(confidence:\s*[^)]*\)\s*$", flags=re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_message(msg: Optional[str]) -> str:
+    """Strip the trailing '(confidence: ..)' and normalize case/whitespace."""
+    text = _CONFIDENCE_SUFFIX.sub("", (msg or "").strip())
+    return _WHITESPACE.sub(" ", text).strip().lower()
+
+
+def bucket_confidence(confidence: Optional[float], step: Optional[float] = None) -> Optional[float]:
+    """Round confidence down to the configured bucket (e.g. 0.873 -> 0.85 with step 0.05)."""
+    if confidence is None:
+        return None
+    step = settings.GEMINI_CONFIDENCE_BUCKET if step is None else step
+    if step <= 0:
+        return round(float(confidence), 3)
+    bucket = math.floor(float(confidence) / step + 1e-9) * step
+    return round(min(max(bucket, 0.0), 1.0), 4)
+
+
+def confidence_text(confidence: Optional[float], step: Optional[float] = None) -> str:
+    """Human-readable confidence matching the cache bucket (e.g. '85%-90%')."""
+    if confidence is None:
+        return "N/A"
+    step = settings.GEMINI_CONFIDENCE_BUCKET if step is None else step
+    if step <= 0:
+        return f"{confidence:.1%}"
+    low = bucket_confidence(confidence, step)
+    high = min(low + step, 1.0)
+    return f"{low:.0%}-{high:.0%}"
+
+
+class CommentaryCache(PersistentCache):
+    """Gemini commentary keyed on normalized result messages and bucketed confidences."""
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl_seconds: Optional[float] = None,
+        max_entries: Optional[int] = None,
+    ):
+        super().__init__(
+            path=path if path is not None else settings.GEMINI_CACHE_PATH,
+            ttl_seconds=settings.GEMINI_CACHE_TTL_SECONDS if ttl_seconds is None else ttl_seconds,
+            max_entries=settings.GEMINI_CACHE_MAX_ENTRIES if max_entries is None else max_entries,
+            table="commentary",
+        )
+
+    @staticmethod
+    def make_key(
+        glaucoma_msg: str,
+        dr_msg: str,
+        glaucoma_confidence: Optional[float],
+        dr_confidence: Optional[float],
+    ) -> str:
+        return json.dumps(
+            [
+                normalize_message(glaucoma_msg),
+                bucket_confidence(glaucoma_confidence),
+                normalize_message(dr_msg),
+                bucket_confidence(dr_confidence),
+            ]
+        )
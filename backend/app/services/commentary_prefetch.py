@@ -0,0 +1,160 @@
+"""Speculative Gemini commentary generation started right after /api/analyze."""
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from app.config import settings
+from app.services.gemini_service import gemini_service
+
+logger = logging.getLogger(__name__)
+
+
+class _Prefetch:
+    __slots__ = ("key", "task", "created_at", "expiry_handle")
+
+    def __init__(self, key: str, task: asyncio.Task):
+        self.key = key
+        self.task = task
+        self.created_at = time.monotonic()
+        self.expiry_handle = None
+
+
+class CommentaryPrefetcher:
+    """
+    Holds speculative commentary tasks keyed by image_id.
+
+    analyze_image schedules generation as soon as both verdicts are known;
+    scan-report-notify takes the result for the same image_id. At most
+    max_inflight tasks run at once (extra requests are simply not prefetched),
+    and anything not taken within ttl_seconds is cancelled and dropped.
+
+    Tasks are per process. Under app.serve with several workers the notify
+    call may land on a worker other than the one that ran /analyze; it then
+    finds the commentary through the SQLite mirror of the commentary cache
+    (GEMINI_CACHE_PATH) once the prefetch has finished, but cannot join a
+    prefetch still running in another worker.
+    """
+
+    def __init__(self, max_inflight: Optional[int] = None, ttl_seconds: Optional[float] = None):
+        self.max_inflight = settings.GEMINI_PREFETCH_MAX_INFLIGHT if max_inflight is None else max_inflight
+        self.ttl_seconds = settings.GEMINI_PREFETCH_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self._entries: dict = {}
+        self.scheduled = 0
+        self.used = 0
+        self.expired = 0
+        self.rejected = 0
+        self.shared_hits = 0
+
+    def inflight(self) -> int:
+        return sum(1 for e in self._entries.values() if not e.task.done())
+
+    def schedule(
+        self,
+        image_id: str,
+        glaucoma_msg: str,
+        dr_msg: str,
+        glaucoma_confidence: Optional[float],
+        dr_confidence: Optional[float],
+    ) -> bool:
+        """Start commentary generation for image_id in the background. Returns False if skipped."""
+        if not gemini_service.enabled or image_id in self._entries:
+            return False
+        if self.inflight() >= self.max_inflight:
+            self.rejected += 1
+            logger.debug("Commentary prefetch skipped for %s: %s tasks in flight", image_id, self.max_inflight)
+            return False
+
+        key = gemini_service.cache.make_key(glaucoma_msg, dr_msg, glaucoma_confidence, dr_confidence)
+        task = asyncio.create_task(
+            gemini_service.build_doctor_explanation_async(
+                glaucoma_msg=glaucoma_msg,
+                dr_msg=dr_msg,
+                glaucoma_confidence=glaucoma_confidence,
+                dr_confidence=dr_confidence,
+            )
+        )
+        entry = _Prefetch(key, task)
+        entry.expiry_handle = asyncio.get_running_loop().call_later(
+            self.ttl_seconds, self._expire, image_id, entry
+        )
+        self._entries[image_id] = entry
+        self.scheduled += 1
+        return True
+
+    def _expire(self, image_id: str, entry: _Prefetch):
+        if self._entries.get(image_id) is not entry:
+            return
+        del self._entries[image_id]
+        if not entry.task.done():
+            entry.task.cancel()
+        self.expired += 1
+        logger.debug("Commentary prefetch for %s expired unused", image_id)
+
+    async def take(
+        self,
+        image_id: str,
+        glaucoma_msg: str,
+        dr_msg: str,
+        glaucoma_confidence: Optional[float],
+        dr_confidence: Optional[float],
+        timeout: Optional[float] = None,
+    ) -> Optional[dict]:
+        """
+        Return the prefetched commentary for image_id (awaiting it for at most
+        timeout seconds if still running), or None when nothing was prefetched,
+        the report inputs differ or the wait timed out.
+
+        Without a local entry, commentary another process finished for the
+        same inputs is read from the shared commentary cache instead.
+        """
+        key = gemini_service.cache.make_key(glaucoma_msg, dr_msg, glaucoma_confidence, dr_confidence)
+        entry = self._entries.pop(image_id, None)
+        if entry is None:
+            # Prefetched by another worker (or before a restart): its result is only in the shared cache
+            data = gemini_service.cache.get_shared(key)
+            if data is not None:
+                self.shared_hits += 1
+            return data
+        if entry.expiry_handle is not None:
+            entry.expiry_handle.cancel()
+        if key != entry.key:
+            logger.debug("Commentary prefetch for %s does not match report inputs", image_id)
+            return None
+        try:
+            # shield: a timed-out wait leaves the task running so it still fills the cache
+            data = await asyncio.wait_for(asyncio.shield(entry.task), timeout)
+        except asyncio.TimeoutError:
+            logger.debug("Prefetched commentary for %s not ready within budget", image_id)
+            return None
+        except asyncio.CancelledError:
+            if entry.task.cancelled():
+                return None
+            raise
+        except Exception as e:
+            logger.warning("Prefetched commentary failed for %s: %s", image_id, e)
+            return None
+        self.used += 1
+        return data
+
+    def cancel_all(self):
+        for entry in self._entries.values():
+            if entry.expiry_handle is not None:
+                entry.expiry_handle.cancel()
+            if not entry.task.done():
+                entry.task.cancel()
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._entries),
+            "inflight": self.inflight(),
+            "scheduled": self.scheduled,
+            "used": self.used,
+            "expired": self.expired,
+            "rejected": self.rejected,
+            "shared_hits": self.shared_hits,
+        }
+
+
+commentary_prefetcher = CommentaryPrefetcher()
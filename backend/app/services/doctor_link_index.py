@@ -0,0 +1,168 @@
+"""In-process index of active doctor IDs per patient (patient_doctor collection)."""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Firestore limits "in" filters to 30 values per query
+FIRESTORE_IN_LIMIT = 30
+
+
+class DoctorLinkIndex:
+    """
+    Caches active doctor IDs per patient for notification fan-out.
+
+    Entries expire after ttl_seconds and the least recently used are evicted
+    beyond max_entries. With listen=True a Firestore snapshot listener on
+    patient_doctor also invalidates a patient's entry as soon as one of their
+    links changes, so the TTL only acts as a safety net. A fetch that overlaps
+    an invalidation of the same patient is returned but not cached.
+    """
+
+    def __init__(
+        self,
+        db,
+        ttl_seconds: Optional[float] = None,
+        listen: Optional[bool] = None,
+        max_entries: Optional[int] = None,
+    ):
+        self.db = db
+        self.ttl_seconds = settings.DOCTOR_LINK_CACHE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self.max_entries = settings.DOCTOR_LINK_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # patient_id -> (doctor_ids, fetched_at)
+        # Invalidation sequence numbers: the latest per patient (bounded like _entries), and
+        # a floor standing in for forgotten ones (and for invalidate-all)
+        self._invalidations = 0
+        self._invalidated: "OrderedDict[str, int]" = OrderedDict()
+        self._invalidated_floor = 0
+        self._watch = None
+        self.hits = 0
+        self.misses = 0
+        if settings.DOCTOR_LINK_LISTENER if listen is None else listen:
+            self.start_listener()
+
+    @staticmethod
+    def _active_doctor_id(data: dict) -> Optional[str]:
+        if data.get("status") == "active" and data.get("doctorId"):
+            return data["doctorId"]
+        return None
+
+    def _cached(self, patient_id: str, now: float) -> Optional[list]:
+        entry = self._entries.get(patient_id)
+        if entry is None or now - entry[1] > self.ttl_seconds:
+            return None
+        self._entries.move_to_end(patient_id)
+        return entry[0]
+
+    def get_active_doctor_ids(self, patient_id: str) -> list:
+        """Active doctor IDs for one patient (deduplicated, query order preserved)."""
+        return self.get_active_doctor_ids_bulk([patient_id])[patient_id]
+
+    def get_active_doctor_ids_bulk(self, patient_ids: Iterable[str]) -> dict:
+        """
+        Resolve active doctor IDs for many patients at once (batch screening).
+
+        Cache misses are fetched with "in" queries of up to 30 patients each
+        instead of one query per patient.
+        """
+        patient_ids = list(dict.fromkeys(patient_ids))
+        now = time.monotonic()
+        result = {}
+        missing = []
+        with self._lock:
+            fetch_seq = self._invalidations
+            for pid in patient_ids:
+                cached = self._cached(pid, now)
+                if cached is None:
+                    missing.append(pid)
+                else:
+                    result[pid] = list(cached)
+            self.hits += len(patient_ids) - len(missing)
+            self.misses += len(missing)
+
+        for start in range(0, len(missing), FIRESTORE_IN_LIMIT):
+            chunk = missing[start : start + FIRESTORE_IN_LIMIT]
+            fetched = {pid: [] for pid in chunk}
+            if len(chunk) == 1:
+                query = self.db.collection("patient_doctor").where("patientId", "==", chunk[0])
+            else:
+                query = self.db.collection("patient_doctor").where("patientId", "in", chunk)
+            for doc_snap in query.stream():
+                d = doc_snap.to_dict() or {}
+                doctor_id = self._active_doctor_id(d)
+                if doctor_id and d.get("patientId") in fetched:
+                    fetched[d["patientId"]].append(doctor_id)
+            with self._lock:
+                for pid, doctor_ids in fetched.items():
+                    doctor_ids = list(dict.fromkeys(doctor_ids))
+                    result[pid] = list(doctor_ids)
+                    # Links changed while the query ran; the answer may predate the change
+                    if self._invalidated.get(pid, self._invalidated_floor) > fetch_seq:
+                        continue
+                    self._entries[pid] = (doctor_ids, now)
+                    self._entries.move_to_end(pid)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return result
+
+    def invalidate(self, patient_id: Optional[str] = None):
+        with self._lock:
+            self._invalidations += 1
+            if patient_id is None:
+                self._entries.clear()
+                self._invalidated.clear()
+                self._invalidated_floor = self._invalidations
+                return
+            self._entries.pop(patient_id, None)
+            self._invalidated[patient_id] = self._invalidations
+            self._invalidated.move_to_end(patient_id)
+            while len(self._invalidated) > self.max_entries:
+                _, seq = self._invalidated.popitem(last=False)
+                self._invalidated_floor = max(self._invalidated_floor, seq)
+
+    def start_listener(self):
+        """Invalidate entries from a patient_doctor snapshot listener."""
+        if self._watch is not None:
+            return
+        try:
+            self._watch = self.db.collection("patient_doctor").on_snapshot(self._on_snapshot)
+            logger.info("patient_doctor snapshot listener started")
+        except Exception as e:
+            logger.warning("patient_doctor snapshot listener unavailable, using TTL only: %s", e)
+            self._watch = None
+
+    def stop_listener(self):
+        if self._watch is not None:
+            try:
+                self._watch.unsubscribe()
+            except Exception as e:
+                logger.debug("Failed to stop patient_doctor listener: %s", e)
+            self._watch = None
+
+    def _on_snapshot(self, col_snapshot, changes, read_time):
+        for change in changes:
+            try:
+                d = change.document.to_dict() or {}
+            except Exception:
+                d = {}
+            if d.get("patientId"):
+                self.invalidate(d["patientId"])
+            else:
+                # Deleted/unknown document: we cannot tell which patient it was for
+                self.invalidate()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits / total) if total else 0.0,
+            "listener": self._watch is not None,
+        }
@@ -1,41 +1,100 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
+import asyncio
 import logging
 import os
-from datetime import datetime
+import threading
 
 from app.config import settings
+from app.services.doctor_link_index import DoctorLinkIndex
+from app.services.notification_writer import NotificationWriter
+from app.services.result_writer import ResultWriter
 
 logger = logging.getLogger(__name__)
 
 
 class FirebaseService:
-    """Service for Firebase Firestore (no Firebase Storage — scan PDFs use Supabase)."""
+    """
+    Service for Firebase Firestore (no Firebase Storage — scan PDFs use Supabase).
+
+    firebase_admin is imported and the app initialized on first use of db or a
+    helper (or by the startup warm-up), not when this module is imported.
+    """
 
     def __init__(self):
-        self.db = None
-        try:
-            if not firebase_admin._apps:
-                firebase_key_path = settings.FIREBASE_SERVICE_ACCOUNT_KEY_PATH
-                if firebase_key_path and os.path.exists(firebase_key_path):
-                    cred = credentials.Certificate(firebase_key_path)
-                    firebase_admin.initialize_app(cred)
-                    logger.info("Firebase Admin initialized successfully")
-                else:
-                    logger.warning(
-                        "Firebase service account key missing — Firestore disabled. "
-                        "Download JSON from Firebase Console → Project settings → Service accounts → "
-                        "Generate new private key, save as backend/firebase-service-account.json "
-                        "(or set FIREBASE_SERVICE_ACCOUNT_KEY_PATH). Path checked: %s",
-                        firebase_key_path or "(not set)",
-                    )
-            if firebase_admin._apps:
-                self.db = firestore.client()
-            else:
-                self.db = None
-        except Exception as e:
-            logger.warning(f"Firebase initialization warning: {str(e)}")
-            self.db = None
+        self._db = None
+        self._doctor_links = None
+        self._notification_writer = None
+        self._result_writer = None
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    def initialize(self):
+        """Initialize Firebase Admin and the Firestore helpers once."""
+        if self._initialized:
+            return
+        with self._init_lock:
+            if self._initialized:
+                return
+            db = None
+            try:
+                import firebase_admin
+                from firebase_admin import credentials, firestore
+
+                if not firebase_admin._apps:
+                    firebase_key_path = settings.FIREBASE_SERVICE_ACCOUNT_KEY_PATH
+                    if firebase_key_path and os.path.exists(firebase_key_path):
+                        cred = credentials.Certificate(firebase_key_path)
+                        firebase_admin.initialize_app(cred)
+                        logger.info("Firebase Admin initialized successfully")
+                    else:
+                        logger.warning(
+                            "Firebase service account key missing — Firestore disabled. "
+                            "Download JSON from Firebase Console → Project settings → Service accounts → "
+                            "Generate new private key, save as backend/firebase-service-account.json "
+                            "(or set FIREBASE_SERVICE_ACCOUNT_KEY_PATH). Path checked: %s",
+                            firebase_key_path or "(not set)",
+                        )
+                if firebase_admin._apps:
+                    db = firestore.client()
+            except Exception as e:
+                logger.warning(f"Firebase initialization warning: {str(e)}")
+                db = None
+
+            self.use_db(db)
+
+    def use_db(self, db):
+        """Attach a Firestore client (or a compatible stand-in) and rebuild the helpers using it."""
+        self._db = db
+        # Cached patient -> active doctor IDs for scan report fan-out
+        self._doctor_links = DoctorLinkIndex(db) if db is not None else None
+        # Chunked, concurrent notification batches (Firestore caps batches at 500 writes)
+        self._notification_writer = NotificationWriter(db) if db is not None else None
+        # Atomic per-scan result batches, with buffered flushes for bulk analysis
+        self._result_writer = ResultWriter(db) if db is not None else None
+        self._initialized = True
+
+    @property
+    def initialized(self) -> bool:
+        return self._initialized
+
+    @property
+    def db(self):
+        self.initialize()
+        return self._db
+
+    @property
+    def doctor_links(self):
+        self.initialize()
+        return self._doctor_links
+
+    @property
+    def notification_writer(self):
+        self.initialize()
+        return self._notification_writer
+
+    @property
+    def result_writer(self):
+        self.initialize()
+        return self._result_writer
 
     async def store_results(
         self,
@@ -60,27 +119,10 @@ class FirebaseService:
                 logger.warning("Firebase not initialized - skipping result storage")
                 return
 
-            current_date = datetime.now().isoformat()
-
-            # Store Glaucoma result
-            glaucoma_ref = self.db.collection('glucoma_result').document()
-            glaucoma_ref.set({
-                'patientId': patient_id,
-                'result_msg': glaucoma_result['result_msg'],
-                'imageId': image_id,
-                'doctor_feedback': '',
-                'date': current_date
-            })
-
-            # Store DR result
-            dr_ref = self.db.collection('dr_result').document()
-            dr_ref.set({
-                'patientId': patient_id,
-                'result_msg': dr_result['result_msg'],
-                'imageId': image_id,
-                'doctor_feedback': '',
-                'date': current_date
-            })
+            # Both documents in one atomic batch, committed off the event loop
+            await asyncio.to_thread(
+                self.result_writer.write_scan, patient_id, glaucoma_result, dr_result, image_id
+            )
 
             logger.info(f"Results stored in Firebase for patient {patient_id}, image {image_id}")
 
@@ -88,6 +130,82 @@ class FirebaseService:
             logger.error(f"Error storing results in Firebase: {str(e)}")
             raise
 
+    async def store_results_buffered(
+        self,
+        patient_id: str,
+        glaucoma_result: dict,
+        dr_result: dict,
+        image_id: str
+    ) -> bool:
+        """
+        Queue results for a batched flush (batch/bulk analysis paths).
+
+        Returns once this scan's batch is committed; returns False if Firestore
+        is not initialized. Commit errors are raised to the caller.
+        """
+        if self.db is None:
+            logger.warning("Firebase not initialized - skipping result storage")
+            return False
+        return await self.result_writer.submit(patient_id, glaucoma_result, dr_result, image_id)
+
+    @staticmethod
+    def _scan_report_notification(
+        doctor_id: str,
+        patient_id: str,
+        image_id: str,
+        patient_display_name: str,
+        pdf_url: str,
+        glaucoma_msg: str,
+        dr_msg: str,
+    ) -> dict:
+        from firebase_admin import firestore
+
+        message_body = (
+            f"{patient_display_name or 'A patient'} completed an eye scan. "
+            f"DR: {dr_msg[:100]}{'…' if len(dr_msg) > 100 else ''} "
+            "Open the PDF to view images and full results."
+        )
+        return {
+            "user_id": doctor_id,
+            "type": "info",
+            "title": "New eye scan report",
+            "message": message_body,
+            "read": False,
+            "createdAt": firestore.SERVER_TIMESTAMP,
+            "data": {
+                "kind": "scan_report",
+                "pdf_url": pdf_url,
+                "patient_id": patient_id,
+                "image_id": image_id,
+                "patient_name": patient_display_name or "",
+                "summary_glaucoma": glaucoma_msg,
+                "summary_dr": dr_msg,
+            },
+        }
+
+    def _scan_report_precheck(self, result: dict, pdf_url: str) -> bool:
+        if self.db is None:
+            result["skipped"] = "firestore_not_initialized"
+            logger.warning("Scan report notify skipped: Firestore not initialized")
+            return False
+        if not pdf_url:
+            result["skipped"] = "missing_pdf_url"
+            return False
+        return True
+
+    @staticmethod
+    def _apply_write_report(result: dict, report: dict, patient_id: str, image_id: str) -> dict:
+        result["ok"] = report["failed"] == 0
+        result["doctors_notified"] = report["written"]
+        result["failed"] = report["failed"]
+        if report["failed_batches"]:
+            result["failed_batches"] = report["failed_batches"]
+        logger.info(
+            "Notified %s doctors for patient %s scan %s (%s failed)",
+            report["written"], patient_id, image_id, report["failed"],
+        )
+        return result
+
     def notify_associated_doctors_scan_report(
         self,
         patient_id: str,
@@ -100,30 +218,50 @@ class FirebaseService:
         """
         Create a Firestore notification for each active patient_doctor link.
         pdf_url should point to the file in Supabase Storage (or any HTTPS URL).
+        Blocking; request handlers use notify_associated_doctors_scan_report_async.
         """
         result = {"ok": False, "doctors_notified": 0, "skipped": None, "pdf_url": pdf_url}
+        if not self._scan_report_precheck(result, pdf_url):
+            return result
 
-        if self.db is None:
-            result["skipped"] = "firestore_not_initialized"
-            logger.warning("Scan report notify skipped: Firestore not initialized")
+        try:
+            doctor_ids = self.doctor_links.get_active_doctor_ids(patient_id)
+        except Exception as e:
+            logger.error("Failed to query patient_doctor: %s", e)
+            result["skipped"] = f"firestore_query_failed: {e}"
             return result
 
-        if not pdf_url:
-            result["skipped"] = "missing_pdf_url"
+        if not doctor_ids:
+            result["ok"] = True
+            result["skipped"] = "no_active_doctors"
+            logger.info("No active doctors for patient %s — PDF URL not sent via notification", patient_id)
             return result
 
-        try:
-            rels = (
-                self.db.collection("patient_doctor")
-                .where("patientId", "==", patient_id)
-                .stream()
+        docs = [
+            self._scan_report_notification(
+                doctor_id, patient_id, image_id, patient_display_name, pdf_url, glaucoma_msg, dr_msg
             )
-            doctor_ids = []
-            for doc_snap in rels:
-                d = doc_snap.to_dict() or {}
-                if d.get("status") == "active" and d.get("doctorId"):
-                    doctor_ids.append(d["doctorId"])
-            doctor_ids = list(dict.fromkeys(doctor_ids))
+            for doctor_id in doctor_ids
+        ]
+        report = self.notification_writer.write_sync(docs)
+        return self._apply_write_report(result, report, patient_id, image_id)
+
+    async def notify_associated_doctors_scan_report_async(
+        self,
+        patient_id: str,
+        image_id: str,
+        patient_display_name: str,
+        pdf_url: str,
+        glaucoma_msg: str,
+        dr_msg: str,
+    ) -> dict:
+        """Same as notify_associated_doctors_scan_report, with all Firestore I/O off the event loop."""
+        result = {"ok": False, "doctors_notified": 0, "skipped": None, "pdf_url": pdf_url}
+        if not self._scan_report_precheck(result, pdf_url):
+            return result
+
+        try:
+            doctor_ids = await asyncio.to_thread(self.doctor_links.get_active_doctor_ids, patient_id)
         except Exception as e:
             logger.error("Failed to query patient_doctor: %s", e)
             result["skipped"] = f"firestore_query_failed: {e}"
@@ -132,45 +270,17 @@ class FirebaseService:
         if not doctor_ids:
             result["ok"] = True
             result["skipped"] = "no_active_doctors"
-            result["doctors_notified"] = 0
             logger.info("No active doctors for patient %s — PDF URL not sent via notification", patient_id)
             return result
 
-        message_body = (
-            f"{patient_display_name or 'A patient'} completed an eye scan. "
-            f"DR: {dr_msg[:100]}{'…' if len(dr_msg) > 100 else ''} "
-            "Open the PDF to view images and full results."
-        )
-
-        batch = self.db.batch()
-        notif_col = self.db.collection("notifications")
-        for doctor_id in doctor_ids:
-            ref = notif_col.document()
-            batch.set(
-                ref,
-                {
-                    "user_id": doctor_id,
-                    "type": "info",
-                    "title": "New eye scan report",
-                    "message": message_body,
-                    "read": False,
-                    "createdAt": firestore.SERVER_TIMESTAMP,
-                    "data": {
-                        "kind": "scan_report",
-                        "pdf_url": pdf_url,
-                        "patient_id": patient_id,
-                        "image_id": image_id,
-                        "patient_name": patient_display_name or "",
-                        "summary_glaucoma": glaucoma_msg,
-                        "summary_dr": dr_msg,
-                    },
-                },
+        docs = [
+            self._scan_report_notification(
+                doctor_id, patient_id, image_id, patient_display_name, pdf_url, glaucoma_msg, dr_msg
             )
-        batch.commit()
-        result["ok"] = True
-        result["doctors_notified"] = len(doctor_ids)
-        logger.info("Notified %s doctors for patient %s scan %s", len(doctor_ids), patient_id, image_id)
-        return result
+            for doctor_id in doctor_ids
+        ]
+        report = await self.notification_writer.write(docs)
+        return self._apply_write_report(result, report, patient_id, image_id)
 
 
 firebase_service = FirebaseService()
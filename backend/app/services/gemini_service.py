@@ -1,13 +1,21 @@
+import asyncio
 import json
 import logging
-from typing import Optional
-
-import httpx
+import time
+from typing import TYPE_CHECKING, Optional
 
 from app.config import settings
+from app.services.circuit_breaker import CircuitBreaker
+from app.services.commentary_cache import CommentaryCache, confidence_text
+
+if TYPE_CHECKING:
+    import httpx
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_DISCLAIMER = "This is AI-generated support text for clinicians and is not a diagnosis."
+
+
 class GeminiService:
     """Generate concise clinician-facing commentary for scan reports."""
 
@@ -15,6 +23,22 @@ class GeminiService:
         self.enabled = bool(settings.GEMINI_API_KEY)
         self.model_name = settings.GEMINI_MODEL
         self.api_key = settings.GEMINI_API_KEY
+        self.timeout = settings.GEMINI_TIMEOUT_SECONDS
+        self.cache = CommentaryCache()
+        self.breaker = CircuitBreaker(
+            "gemini",
+            window_seconds=settings.GEMINI_BREAKER_WINDOW_SECONDS,
+            min_calls=settings.GEMINI_BREAKER_MIN_CALLS,
+            error_rate_threshold=settings.GEMINI_BREAKER_ERROR_RATE,
+            slow_call_seconds=settings.GEMINI_BREAKER_SLOW_CALL_SECONDS,
+            slow_call_rate_threshold=settings.GEMINI_BREAKER_SLOW_CALL_RATE,
+            open_seconds=settings.GEMINI_BREAKER_OPEN_SECONDS,
+        )
+        # Persistent connection pools (created lazily, reused across reports)
+        self._client: Optional["httpx.Client"] = None
+        self._async_client: Optional["httpx.AsyncClient"] = None
+        # Concurrent identical requests share one Gemini call
+        self._inflight: dict = {}
         if not self.enabled:
             logger.info("Gemini disabled: GEMINI_API_KEY missing")
 
@@ -23,21 +47,58 @@ class GeminiService:
         return {
             "clinical_summary": f"Chat model did not work for this report ({reason}).",
             "action_points": [],
-            "disclaimer": "This is AI-generated support text for clinicians and is not a diagnosis.",
+            "disclaimer": DEFAULT_DISCLAIMER,
+            "fallback_reason": reason,
         }
 
-    def build_doctor_explanation(
-        self,
+    def _limits(self) -> "httpx.Limits":
+        import httpx
+
+        return httpx.Limits(
+            max_connections=settings.GEMINI_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.GEMINI_MAX_CONNECTIONS,
+        )
+
+    def _get_client(self) -> "httpx.Client":
+        # httpx is imported with the first client, not with the app
+        import httpx
+
+        if self._client is None:
+            self._client = httpx.Client(timeout=self.timeout, limits=self._limits())
+        return self._client
+
+    def _get_async_client(self) -> "httpx.AsyncClient":
+        import httpx
+
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(timeout=self.timeout, limits=self._limits())
+        return self._async_client
+
+    async def aclose(self):
+        """Close pooled HTTP clients (called on app shutdown)."""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    def _url(self) -> str:
+        return (
+            f"https://generativelanguage.googleapis.com/v1beta/models/"
+            f"{self.model_name}:generateContent?key={self.api_key}"
+        )
+
+    @staticmethod
+    def _payload(
         glaucoma_msg: str,
         dr_msg: str,
         glaucoma_confidence: Optional[float],
         dr_confidence: Optional[float],
-    ) -> Optional[dict]:
-        gc = f"{glaucoma_confidence:.1%}" if glaucoma_confidence is not None else "N/A"
-        dc = f"{dr_confidence:.1%}" if dr_confidence is not None else "N/A"
-
-        if not self.enabled or not self.api_key:
-            return self._failed_result("missing_api_key")
+    ) -> dict:
+        # Confidence is sent at cache-bucket resolution so a cached answer fits every hit
+        gc = confidence_text(glaucoma_confidence)
+        dc = confidence_text(dr_confidence)
 
         prompt = f"""
 You are assisting an ophthalmologist.
@@ -53,57 +114,161 @@ Return valid JSON only with keys:
 - action_points (array of 3-5 short bullets with next-step suggestions)
 - disclaimer (must clearly state this is AI-generated support text and not a diagnosis)
 """
-        try:
-            url = (
-                f"https://generativelanguage.googleapis.com/v1beta/models/"
-                f"{self.model_name}:generateContent?key={self.api_key}"
+        return {
+            "contents": [
+                {"parts": [{"text": prompt}]}
+            ],
+            "generationConfig": {
+                "temperature": 0.2,
+            },
+        }
+
+    def _parse_response(self, resp: "httpx.Response") -> tuple:
+        """Return (data, cacheable) for a Gemini HTTP response."""
+        if resp.status_code >= 400:
+            logger.warning("Gemini API HTTP %s: %s", resp.status_code, resp.text[:500])
+            return self._failed_result(f"http_{resp.status_code}"), False
+
+        body = resp.json()
+        candidates = body.get("candidates") or []
+        text = ""
+        if candidates:
+            parts = (
+                candidates[0]
+                .get("content", {})
+                .get("parts", [])
             )
-            payload = {
-                "contents": [
-                    {"parts": [{"text": prompt}]}
-                ],
-                "generationConfig": {
-                    "temperature": 0.2,
-                },
-            }
-            with httpx.Client(timeout=20.0) as client:
-                resp = client.post(url, json=payload)
-            if resp.status_code >= 400:
-                logger.warning("Gemini API HTTP %s: %s", resp.status_code, resp.text[:500])
-                return self._failed_result(f"http_{resp.status_code}")
-
-            body = resp.json()
-            candidates = body.get("candidates") or []
-            text = ""
-            if candidates:
-                parts = (
-                    candidates[0]
-                    .get("content", {})
-                    .get("parts", [])
-                )
-                for p in parts:
-                    if isinstance(p, dict) and p.get("text"):
-                        text += str(p["text"])
-            text = text.strip()
-            if not text:
-                return self._failed_result("empty_response")
-
-            start = text.find("{")
-            end = text.rfind("}")
-            if start >= 0 and end > start:
-                text = text[start : end + 1]
-            data = json.loads(text)
-            if not isinstance(data, dict):
-                return self._failed_result("invalid_json")
-            if "disclaimer" not in data or not str(data.get("disclaimer", "")).strip():
-                data["disclaimer"] = (
-                    "This is AI-generated support text for clinicians and is not a diagnosis."
-                )
+            for p in parts:
+                if isinstance(p, dict) and p.get("text"):
+                    text += str(p["text"])
+        text = text.strip()
+        if not text:
+            return self._failed_result("empty_response"), False
+
+        start = text.find("{")
+        end = text.rfind("}")
+        if start >= 0 and end > start:
+            text = text[start : end + 1]
+        data = json.loads(text)
+        if not isinstance(data, dict):
+            return self._failed_result("invalid_json"), False
+        if "disclaimer" not in data or not str(data.get("disclaimer", "")).strip():
+            data["disclaimer"] = DEFAULT_DISCLAIMER
+        return data, True
+
+    def build_doctor_explanation(
+        self,
+        glaucoma_msg: str,
+        dr_msg: str,
+        glaucoma_confidence: Optional[float],
+        dr_confidence: Optional[float],
+    ) -> Optional[dict]:
+        """Blocking variant (kept for scripts); request handlers use build_doctor_explanation_async."""
+        if not self.enabled or not self.api_key:
+            return self._failed_result("missing_api_key")
+
+        key = self.cache.make_key(glaucoma_msg, dr_msg, glaucoma_confidence, dr_confidence)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        permit = self.breaker.allow()
+        if permit is None:
+            return self._failed_result("circuit_open")
+
+        started = time.monotonic()
+        ok = False
+        try:
+            payload = self._payload(glaucoma_msg, dr_msg, glaucoma_confidence, dr_confidence)
+            resp = self._get_client().post(self._url(), json=payload)
+            ok = resp.status_code < 400
+            data, cacheable = self._parse_response(resp)
+            if cacheable:
+                self.cache.set(key, data)
             return data
         except Exception as e:
             logger.warning("Gemini explanation generation failed: %s", e)
             return self._failed_result("request_failed")
+        finally:
+            self.breaker.record(ok, time.monotonic() - started, permit)
+
+    async def build_doctor_explanation_async(
+        self,
+        glaucoma_msg: str,
+        dr_msg: str,
+        glaucoma_confidence: Optional[float],
+        dr_confidence: Optional[float],
+        timeout: Optional[float] = None,
+    ) -> Optional[dict]:
+        """
+        Non-blocking commentary generation using the pooled async client and cache.
+
+        timeout is the caller's remaining latency budget in seconds (capped at
+        GEMINI_TIMEOUT_SECONDS). When the budget is spent or the circuit breaker
+        is open, the static fallback is returned without calling Gemini.
+        """
+        if not self.enabled or not self.api_key:
+            return self._failed_result("missing_api_key")
 
+        key = self.cache.make_key(glaucoma_msg, dr_msg, glaucoma_confidence, dr_confidence)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
 
-gemini_service = GeminiService()
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        if timeout <= 0:
+            return self._failed_result("latency_budget_exhausted")
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            try:
+                return dict(await asyncio.wait_for(asyncio.shield(pending), timeout))
+            except asyncio.TimeoutError:
+                return self._failed_result("deadline_exceeded")
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise  # this caller was cancelled, not the shared call
+                return self._failed_result("request_cancelled")
 
+        permit = self.breaker.allow()
+        if permit is None:
+            return self._failed_result("circuit_open")
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        started = time.monotonic()
+        ok = None  # stays None if the call ends for reasons that aren't the dependency's fault
+        try:
+            try:
+                payload = self._payload(glaucoma_msg, dr_msg, glaucoma_confidence, dr_confidence)
+                resp = await asyncio.wait_for(
+                    self._get_async_client().post(self._url(), json=payload, timeout=timeout),
+                    timeout,
+                )
+                ok = resp.status_code < 400
+                data, cacheable = self._parse_response(resp)
+                if cacheable:
+                    self.cache.set(key, data)
+            except asyncio.TimeoutError:
+                logger.warning("Gemini explanation exceeded its %.1fs deadline", timeout)
+                # Only a timeout at GEMINI_TIMEOUT_SECONDS is Gemini's; a shorter caller budget is neutral
+                ok = False if timeout >= self.timeout else None
+                data = self._failed_result("deadline_exceeded")
+            except Exception as e:
+                logger.warning("Gemini explanation generation failed: %s", e)
+                ok = False
+                data = self._failed_result("request_failed")
+            future.set_result(data)
+            return data
+        finally:
+            if ok is not None:
+                self.breaker.record(ok, time.monotonic() - started, permit)
+            else:
+                self.breaker.release_probe(permit)
+            if not future.done():
+                # The leading call was cancelled (e.g. an expired prefetch); callers sharing it fall back
+                future.set_result(self._failed_result("request_cancelled"))
+            self._inflight.pop(key, None)
+
+
+gemini_service = GeminiService()
@@ -0,0 +1,142 @@
+"""Idempotency-Key support: single-flight for concurrent duplicates and replay of completed responses."""
+import asyncio
+import hashlib
+import json
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from app.config import settings
+from app.services.persistent_cache import PersistentCache
+
+# Longer Idempotency-Key headers are rejected
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used for a request with a different payload."""
+
+
+class IdempotencyInterrupted(Exception):
+    """The original request for this key was cancelled before it completed; retry."""
+
+
+def request_fingerprint(*parts) -> str:
+    """SHA-256 over the JSON-encoded request parts (patient, options, upload digest)."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class IdempotencyStore(PersistentCache):
+    """
+    Runs each idempotency key's work at most once within the retention window.
+
+    A request whose key is in flight waits for that computation instead of
+    starting its own; a request whose key completed gets the stored response.
+    Only successful responses are stored, so failed attempts can be retried.
+    Stored responses drop their base64 images (*_base64 fields are null on
+    replay; the images are referenced by image_id / storage URLs), which keeps
+    an entry at a few KB. Reusing a key with a different payload is rejected.
+    Entries are per process (with a SQLite mirror that survives restarts).
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl_seconds: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        table: str = "idempotency",
+    ):
+        super().__init__(
+            path=path if path is not None else settings.IDEMPOTENCY_CACHE_PATH,
+            ttl_seconds=settings.IDEMPOTENCY_TTL_SECONDS if ttl_seconds is None else ttl_seconds,
+            max_entries=settings.IDEMPOTENCY_MAX_ENTRIES if max_entries is None else max_entries,
+            table=table,
+        )
+        self._inflight: Dict[str, Tuple[str, asyncio.Task]] = {}
+        self.executed = 0
+        self.replayed = 0
+        self.coalesced = 0
+        self.conflicts = 0
+
+    async def _execute(self, key: str, fingerprint: str, compute: Callable[[], Awaitable[dict]]) -> dict:
+        try:
+            response = await compute()
+            self.set(key, {"fingerprint": fingerprint, "response": _without_images(response)})
+            return response
+        finally:
+            self._inflight.pop(key, None)
+
+    async def run(
+        self,
+        key: str,
+        fingerprint: str,
+        compute: Callable[[], Awaitable[dict]],
+        release: Optional[Callable[[], None]] = None,
+    ) -> Tuple[dict, bool]:
+        """
+        Return (response, replayed) for key, computing it only if nobody has.
+
+        The computation outlives a caller that goes away (client disconnect), so
+        its result is still stored for the retry.
+
+        Args:
+            release: Frees the caller's inputs to compute; called when the
+                     computation started here finishes, otherwise before returning
+
+        Raises:
+            IdempotencyConflict: key seen with a different fingerprint
+            IdempotencyInterrupted: the in-flight original was cancelled
+        """
+        started = False
+        try:
+            stored = self.get(key)
+            if stored is not None:
+                if stored.get("fingerprint") != fingerprint:
+                    self.conflicts += 1
+                    raise IdempotencyConflict("Idempotency-Key was already used with a different request")
+                self.replayed += 1
+                return stored["response"], True
+
+            inflight = self._inflight.get(key)
+            if inflight is not None:
+                inflight_fingerprint, task = inflight
+                if inflight_fingerprint != fingerprint:
+                    self.conflicts += 1
+                    raise IdempotencyConflict("Idempotency-Key is in use by a different request")
+                self.coalesced += 1
+                try:
+                    # Shielded: a retry that gives up must not cancel the original computation
+                    return await asyncio.shield(task), True
+                except asyncio.CancelledError:
+                    if task.cancelled():
+                        raise IdempotencyInterrupted("The original request was interrupted; retry")
+                    raise
+
+            task = asyncio.ensure_future(self._execute(key, fingerprint, compute))
+            self._inflight[key] = (fingerprint, task)
+            self.executed += 1
+            started = True
+            if release is not None:
+                task.add_done_callback(lambda _: release())
+            # Shielded too: the original caller disconnecting must not cancel it for the retries
+            return await asyncio.shield(task), False
+        finally:
+            if release is not None and not started:
+                release()
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats.update(
+            inflight=len(self._inflight),
+            executed=self.executed,
+            replayed=self.replayed,
+            coalesced=self.coalesced,
+            conflicts=self.conflicts,
+        )
+        return stats
+
+
+def _without_images(response: dict) -> dict:
+    return {key: None if key.endswith("_base64") else value for key, value in response.items()}
+
+
+# Completed /api/analyze responses by (patient_id, Idempotency-Key)
+analysis_idempotency = IdempotencyStore()
@@ -0,0 +1,495 @@
+"""Asynchronous analysis jobs: SQLite-backed queue, on-disk inputs and in-process runners."""
+import asyncio
+import base64
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import List, Optional
+
+from app.config import settings
+from app.metrics import track_background
+from app.preprocessing.ingest import IngestedImage, ingest_upload
+from app.services.admission import AdmissionRejected, analysis_admission
+from app.services.analysis import AnalysisOptions, analyze
+from app.services.firebase_service import firebase_service
+
+logger = logging.getLogger(__name__)
+
+# Job states; per-image results are "pending", "done" or "error"
+QUEUED, RUNNING, COMPLETED, FAILED = "queued", "running", "completed", "failed"
+
+# Response images written next to the job when they are not persisted to storage
+_LOCAL_ARTIFACTS = {
+    "image_base64": "original",
+    "glaucoma_heatmap_base64": "glaucoma_heatmap",
+    "glaucoma_overlay_base64": "glaucoma_overlay",
+    "dr_heatmap_base64": "dr_heatmap",
+    "dr_overlay_base64": "dr_overlay",
+}
+ARTIFACT_NAME = re.compile(r"^\d+_[a-z_]+\.jpg$")
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS jobs ("
+    "id TEXT PRIMARY KEY, status TEXT NOT NULL, patient_id TEXT NOT NULL, options TEXT NOT NULL, "
+    "priority TEXT NOT NULL, images TEXT NOT NULL, results TEXT NOT NULL, error TEXT, "
+    "attempts INTEGER NOT NULL DEFAULT 0, worker TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL, "
+    "started_at REAL, finished_at REAL, heartbeat_at REAL)",
+    "CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)",
+)
+
+
+class LeaseLost(Exception):
+    """Another runner took over the job (this runner's heartbeat lapsed); stop working on it."""
+
+
+def _row_to_job(row: sqlite3.Row) -> dict:
+    job = dict(row)
+    for field in ("options", "images", "results"):
+        job[field] = json.loads(job[field])
+    return job
+
+
+class JobStore:
+    """
+    Job rows in SQLite (WAL) plus each job's uploaded images under jobs_dir.
+
+    Every process serving the API opens the same database, so a job submitted
+    to one worker may be run by another. Runners claim a job with a single
+    UPDATE and keep a heartbeat while they work on it; a running job whose
+    heartbeat is older than lease_seconds (its process died) is claimed again
+    and resumes at its first pending image. Updates by a runner only apply
+    while it still holds the claim (they return False otherwise).
+
+    Calls block on SQLite; async code runs them through asyncio.to_thread.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        jobs_dir: Optional[str] = None,
+        lease_seconds: Optional[float] = None,
+        max_attempts: Optional[int] = None,
+        retention_seconds: Optional[float] = None,
+    ):
+        self.path = path or settings.JOBS_DB_PATH
+        self.jobs_dir = Path(jobs_dir or settings.JOBS_DIR)
+        self.lease_seconds = settings.JOB_LEASE_SECONDS if lease_seconds is None else lease_seconds
+        self.max_attempts = settings.JOB_MAX_ATTEMPTS if max_attempts is None else max_attempts
+        self.retention_seconds = settings.JOB_RETENTION_SECONDS if retention_seconds is None else retention_seconds
+        # Reentrant: _execute() holds it while db opens the connection on first use
+        self._lock = threading.RLock()
+        self._db: Optional[sqlite3.Connection] = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        # Opened on first use so the app.serve master never holds the handle
+        if self._db is None:
+            with self._lock:
+                if self._db is None:
+                    Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+                    db = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+                    db.row_factory = sqlite3.Row
+                    db.execute("PRAGMA journal_mode=WAL")
+                    for statement in _SCHEMA:
+                        db.execute(statement)
+                    self._db = db
+        return self._db
+
+    def _execute(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return self.db.execute(sql, params).fetchall()
+
+    def _update(self, sql: str, params: tuple = ()) -> int:
+        with self._lock:
+            return self.db.execute(sql, params).rowcount
+
+    def job_dir(self, job_id: str) -> Path:
+        return self.jobs_dir / job_id
+
+    def create(self, job_id: str, patient_id: str, options: AnalysisOptions, priority: str, images: List[dict]) -> dict:
+        """Queue a job whose images were already written to job_dir(job_id)."""
+        now = time.time()
+        results = [
+            {"index": image["index"], "filename": image["filename"], "status": "pending", "error": None}
+            for image in images
+        ]
+        self._execute(
+            "INSERT INTO jobs (id, status, patient_id, options, priority, images, results, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, QUEUED, patient_id, json.dumps(options.as_dict()), priority,
+             json.dumps(images), json.dumps(results), now, now),
+        )
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        rows = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        return _row_to_job(rows[0]) if rows else None
+
+    def count(self, status: str) -> int:
+        return self._execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,))[0][0]
+
+    def claim(self, worker: str) -> Optional[dict]:
+        """Take the oldest queued job, or a running one whose runner stopped heartbeating."""
+        now = time.time()
+        rows = self._execute(
+            "UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, "
+            "started_at = COALESCE(started_at, ?), heartbeat_at = ?, updated_at = ? "
+            "WHERE id = (SELECT id FROM jobs WHERE status = ? OR (status = ? AND heartbeat_at < ?) "
+            "ORDER BY created_at LIMIT 1) RETURNING *",
+            (RUNNING, worker, now, now, now, QUEUED, RUNNING, now - self.lease_seconds),
+        )
+        return _row_to_job(rows[0]) if rows else None
+
+    def heartbeat(self, job_id: str, worker: str) -> bool:
+        """Extend worker's lease on the job; False if it no longer holds it."""
+        now = time.time()
+        return self._update(
+            "UPDATE jobs SET heartbeat_at = ?, updated_at = ? WHERE id = ? AND status = ? AND worker = ?",
+            (now, now, job_id, RUNNING, worker),
+        ) > 0
+
+    def save_results(self, job_id: str, worker: str, results: List[dict]) -> bool:
+        """Store per-image results so far (also the heartbeat); False if the lease was lost."""
+        now = time.time()
+        return self._update(
+            "UPDATE jobs SET results = ?, heartbeat_at = ?, updated_at = ? WHERE id = ? AND status = ? AND worker = ?",
+            (json.dumps(results), now, now, job_id, RUNNING, worker),
+        ) > 0
+
+    def finish(self, job_id: str, worker: str, status: str, error: Optional[str] = None) -> bool:
+        """Mark a job done and delete its input images (local artifacts are kept); False if the lease was lost."""
+        now = time.time()
+        finished = self._update(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ?, updated_at = ? "
+            "WHERE id = ? AND status = ? AND worker = ?",
+            (status, error, now, now, job_id, RUNNING, worker),
+        ) > 0
+        if finished:
+            for path in self.job_dir(job_id).glob("input_*"):
+                path.unlink(missing_ok=True)
+        return finished
+
+    def requeue(self, job_id: str, worker: str):
+        """Hand a claimed job back (runner shutting down) without counting the attempt."""
+        self._execute(
+            "UPDATE jobs SET status = ?, worker = NULL, attempts = MAX(attempts - 1, 0), updated_at = ? "
+            "WHERE id = ? AND status = ? AND worker = ?",
+            (QUEUED, time.time(), job_id, RUNNING, worker),
+        )
+
+    def purge_expired(self) -> int:
+        """Delete jobs (rows and files) finished longer than retention_seconds ago."""
+        cutoff = time.time() - self.retention_seconds
+        rows = self._execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ? RETURNING id", (COMPLETED, FAILED, cutoff)
+        )
+        for row in rows:
+            shutil.rmtree(self.job_dir(row["id"]), ignore_errors=True)
+        if rows:
+            logger.info(f"Purged {len(rows)} expired analysis jobs")
+        return len(rows)
+
+    def stats(self) -> dict:
+        """Job counts by status."""
+        counts = dict(self._execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"))
+        return {status: counts.get(status, 0) for status in (QUEUED, RUNNING, COMPLETED, FAILED)}
+
+
+def _store_artifacts(job_dir: Path, index: int, content: dict) -> dict:
+    """
+    Reduce an /api/analyze response to what a job keeps: verdicts plus artifact references.
+
+    Persisted images are referenced by their storage URL; otherwise the
+    requested images are written to the job directory.
+    """
+    result = {key: value for key, value in content.items() if not key.endswith("_base64")}
+    if result.get("artifacts"):
+        return result
+    artifacts = {}
+    for key, name in _LOCAL_ARTIFACTS.items():
+        uri = content.get(key)
+        if not uri:
+            continue
+        filename = f"{index}_{name}.jpg"
+        (job_dir / filename).write_bytes(base64.b64decode(uri.split(",", 1)[1]))
+        artifacts[name] = f"/api/jobs/{job_dir.name}/artifacts/{filename}"
+    result["artifacts"] = artifacts
+    return result
+
+
+def public_job(job: dict) -> dict:
+    """GET /api/jobs/{id} representation."""
+    results = job["results"]
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "patient_id": job["patient_id"],
+        "options": job["options"],
+        "priority": job["priority"],
+        "progress": {
+            "total": len(results),
+            "done": sum(r["status"] == "done" for r in results),
+            "failed": sum(r["status"] == "error" for r in results),
+            "pending": sum(r["status"] == "pending" for r in results),
+        },
+        "results": results,
+        "error": job["error"],
+        "attempts": job["attempts"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+    }
+
+
+class JobRunner:
+    """
+    Pulls jobs from the store and analyzes their images one at a time.
+
+    Each image goes through analysis admission in the job's priority lane, so
+    queued jobs fill spare inference capacity instead of competing with
+    interactive /api/analyze traffic; a rejected admission is retried after
+    the suggested delay rather than failing the image. The lease is renewed
+    every lease_seconds / 4 while an image is being analyzed; if another
+    runner has taken the job over, this one abandons it.
+    """
+
+    def __init__(self, store: JobStore, workers: Optional[int] = None, poll_seconds: Optional[float] = None):
+        self.store = store
+        self.workers = settings.JOB_WORKERS if workers is None else workers
+        self.poll_seconds = settings.JOB_POLL_SECONDS if poll_seconds is None else poll_seconds
+        self.heartbeat_seconds = max(store.lease_seconds / 4, 0.1)
+        self.storage = None
+        self._tasks: List[asyncio.Task] = []
+        self._claimed = {}  # worker -> job id
+        self._wakeup: Optional[asyncio.Event] = None
+        self._last_purge = 0.0
+        # Job counts by status, refreshed off the event loop by the runners (read by stats())
+        self._counts: dict = {}
+        self.images_done = 0
+        self.images_failed = 0
+        self.jobs_resumed = 0
+        self.leases_lost = 0
+
+    def start(self, storage):
+        """Start the runner tasks on the running event loop."""
+        if self._tasks or self.workers <= 0:
+            return
+        self.storage = storage
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._work(f"{os.getpid()}-{n}")) for n in range(self.workers)]
+        logger.info(f"Started {self.workers} analysis job runners")
+
+    async def stop(self):
+        """Cancel the runners; jobs they held go back to the queue for another process."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for worker, job_id in self._claimed.items():
+            await asyncio.to_thread(self.store.requeue, job_id, worker)
+        self._claimed.clear()
+
+    def notify(self):
+        """A job was submitted in this process; wake an idle runner now instead of at the next poll."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _work(self, worker: str):
+        while True:
+            try:
+                job = await asyncio.to_thread(self.store.claim, worker)
+            except sqlite3.Error as e:
+                logger.error(f"Claiming an analysis job failed: {e}")
+                job = None
+            if job is None:
+                await self._idle()
+                continue
+            self._claimed[worker] = job["id"]
+            try:
+                with track_background("analysis_job"):
+                    await self._run(job, worker)
+            except asyncio.CancelledError:
+                raise
+            except LeaseLost as e:
+                self.leases_lost += 1
+                logger.warning(str(e))
+            except Exception as e:
+                logger.error(f"Analysis job {job['id']} failed: {e}")
+                await asyncio.to_thread(self.store.finish, job["id"], worker, FAILED, str(e))
+            self._claimed.pop(worker, None)
+
+    async def _idle(self):
+        try:
+            self._counts = await asyncio.to_thread(self.store.stats)
+            if time.monotonic() - self._last_purge >= 600:
+                self._last_purge = time.monotonic()
+                await asyncio.to_thread(self.store.purge_expired)
+        except sqlite3.Error as e:
+            logger.warning(f"Analysis job housekeeping failed: {e}")
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), self.poll_seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _store_call(self, job_id: str, method, *args):
+        """Run a lease-checked store update off the loop; raises LeaseLost if it no longer applies."""
+        if not await asyncio.to_thread(method, *args):
+            raise LeaseLost(f"Analysis job {job_id} was taken over by another runner; abandoning it")
+
+    async def _leased(self, job_id: str, worker: str, awaitable):
+        """Await work on a job while renewing the lease; cancels the work if the lease is lost."""
+        work = asyncio.ensure_future(awaitable)
+        try:
+            while True:
+                done, _ = await asyncio.wait({work}, timeout=self.heartbeat_seconds)
+                if done:
+                    return work.result()
+                await self._store_call(job_id, self.store.heartbeat, job_id, worker)
+        finally:
+            if not work.done():
+                work.cancel()
+
+    async def _run(self, job: dict, worker: str):
+        job_id = job["id"]
+        if job["attempts"] > 1:
+            self.jobs_resumed += 1
+            logger.info(f"Resuming analysis job {job_id} (attempt {job['attempts']})")
+        if job["attempts"] > self.store.max_attempts:
+            await self._store_call(
+                job_id, self.store.finish, job_id, worker, FAILED, f"Gave up after {self.store.max_attempts} attempts"
+            )
+            return
+
+        options = AnalysisOptions(**job["options"])
+        results = job["results"]
+        job_dir = self.store.job_dir(job_id)
+        saves = []  # (result, pending buffered Firestore write)
+        for image, result in zip(job["images"], results):
+            if result["status"] != "pending":
+                continue
+            try:
+                content = await self._leased(job_id, worker, self._analyze(job, image, options))
+                stored = await asyncio.to_thread(_store_artifacts, job_dir, image["index"], content)
+                result.update(stored, status="done")
+                self.images_done += 1
+                if settings.JOB_SAVE_RESULTS:
+                    # Not awaited here: the writer batches these across images (and jobs)
+                    saves.append((result, asyncio.ensure_future(self._save_result(job["patient_id"], content))))
+            except (asyncio.CancelledError, LeaseLost):
+                raise
+            except Exception as e:
+                logger.warning(f"Analysis job {job_id} image {image['index']} failed: {e}")
+                result.update(status="error", error=str(e))
+                self.images_failed += 1
+            # Partial results are visible to GET /api/jobs/{id} as each image completes
+            await self._store_call(job_id, self.store.save_results, job_id, worker, results)
+
+        if saves:
+            for result, save in saves:
+                result["saved"] = await save
+            await self._store_call(job_id, self.store.save_results, job_id, worker, results)
+
+        failed = all(r["status"] == "error" for r in results)
+        status = FAILED if failed else COMPLETED
+        await self._store_call(job_id, self.store.finish, job_id, worker, status, "All images failed" if failed else None)
+        logger.info(f"Analysis job {job_id} {status} ({len(results)} images)")
+
+    async def _save_result(self, patient_id: str, content: dict) -> bool:
+        """Persist one image's verdicts through the buffered result writer; False if not saved."""
+        try:
+            await asyncio.to_thread(firebase_service.initialize)
+            return await firebase_service.store_results_buffered(
+                patient_id, content["glaucoma"], content["dr"], content["image_id"]
+            )
+        except Exception as e:
+            logger.warning(f"Saving results of image {content.get('image_id')} to Firestore failed: {e}")
+            return False
+
+    async def _admit(self, job: dict) -> float:
+        while True:
+            try:
+                return await analysis_admission.acquire(job["priority"])
+            except AdmissionRejected as e:
+                await asyncio.sleep(e.retry_after)
+
+    async def _analyze(self, job: dict, image: dict, options: AnalysisOptions) -> dict:
+        ingested = IngestedImage(
+            open(image["path"], "rb"), image["size"], image["sha256"], image["width"], image["height"], image["format"]
+        )
+        try:
+            admitted_at = await self._admit(job)
+            try:
+                return await analyze(
+                    ingested, job["patient_id"], options, self.storage,
+                    prefetch_commentary=False, await_upload=True,
+                )
+            finally:
+                analysis_admission.release(admitted_at)
+        finally:
+            ingested.close()
+
+    def stats(self) -> dict:
+        # Counts come from the runners' last refresh; a scrape never waits on SQLite
+        stats = dict(self._counts)
+        stats.update(
+            runners=len(self._tasks),
+            images_done=self.images_done,
+            images_failed=self.images_failed,
+            jobs_resumed=self.jobs_resumed,
+            leases_lost=self.leases_lost,
+        )
+        return stats
+
+
+def _save_spool(ingested: IngestedImage, path: Path):
+    ingested.spool.seek(0)
+    with open(path, "wb") as f:
+        shutil.copyfileobj(ingested.spool, f)
+
+
+async def submit(store: JobStore, uploads: list, patient_id: str, options: AnalysisOptions, priority: str) -> dict:
+    """
+    Ingest uploads into a new job directory and queue the job.
+
+    Each upload gets the same size / pixel checks as /api/analyze; if any is
+    rejected nothing is queued and the IngestError propagates.
+    """
+    job_id = str(uuid.uuid4())
+    job_dir = store.job_dir(job_id)
+    job_dir.mkdir(parents=True, exist_ok=True)
+    images = []
+    try:
+        for index, upload in enumerate(uploads):
+            filename = upload.filename or f"image_{index}"
+            ingested = await ingest_upload(upload)
+            try:
+                path = job_dir / f"input_{index}{Path(filename).suffix.lower()[:8]}"
+                await asyncio.to_thread(_save_spool, ingested, path)
+            finally:
+                ingested.close()
+            images.append({
+                "index": index,
+                "filename": filename,
+                "path": str(path),
+                "size": ingested.size,
+                "sha256": ingested.sha256,
+                "width": ingested.width,
+                "height": ingested.height,
+                "format": ingested.format,
+            })
+        return await asyncio.to_thread(store.create, job_id, patient_id, options, priority, images)
+    except Exception:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        raise
+
+
+job_store = JobStore()
+job_runner = JobRunner(job_store)
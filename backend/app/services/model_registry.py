@@ -0,0 +1,275 @@
+"""Versioned model registry: active pipeline per disease, background reload and draining."""
+import asyncio
+import importlib
+import logging
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from typing import Callable, Dict, Optional, Union
+
+from app.config import settings
+from app.metrics import MODEL_INFO
+
+logger = logging.getLogger(__name__)
+
+# "module:Class" paths, imported on first load so torch / torchvision / captum stay
+# out of the import of app.main
+PIPELINE_FACTORIES: Dict[str, Union[str, Callable]] = {
+    "glaucoma": "app.pipelines.glaucoma_pipeline:GlaucomaPipeline",
+    "dr": "app.pipelines.dr_pipeline:DRPipeline",
+}
+
+
+def _resolve_factory(factory: Union[str, Callable]) -> Callable:
+    if callable(factory):
+        return factory
+    module_name, _, attr = factory.partition(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+class ModelReloadError(Exception):
+    """A new model version could not be loaded or warmed; the active version is kept."""
+
+
+class ModelVersion:
+    """One loaded pipeline plus the requests currently using it."""
+
+    def __init__(self, disease: str, pipeline):
+        self.disease = disease
+        self.pipeline = pipeline
+        self.version = pipeline.model.version
+        self.loaded_at = time.time()
+        self.inflight = 0
+        self.retired = False
+        self.drained = asyncio.Event()
+
+    def describe(self) -> dict:
+        return {
+            "version": self.version,
+            "model_path": self.pipeline.model.model_path,
+            "loaded_at": self.loaded_at,
+            "inflight": self.inflight,
+        }
+
+
+def _warm_up(pipeline):
+    """One forward pass and Grad-CAM on a blank image so the first real request isn't cold."""
+    from PIL import Image
+
+    image = Image.new("RGB", (512, 512), (96, 48, 32))
+    preprocessed = pipeline.preprocessor.preprocess(image)
+    prediction = pipeline.model.predict(preprocessed)
+    class_idx = pipeline.model.class_names.index(prediction["predicted_class"]) if "predicted_class" in prediction else 0
+    pipeline.gradcam.generate_gradcam(preprocessed, image, class_idx)
+
+
+class ModelRegistry:
+    """
+    Tracks the active model version per disease.
+
+    Requests take a lease() on the active pipeline. reload() builds and warms
+    the new version in a worker thread, then swaps it in with a single
+    assignment on the event loop, so a request always runs start to finish on
+    one version. The old version is dropped once its last lease is returned.
+    """
+
+    def __init__(self, factories: Optional[Dict[str, Callable]] = None):
+        self.factories = factories or PIPELINE_FACTORIES
+        self._active: Dict[str, ModelVersion] = {}
+        self._draining: Dict[int, ModelVersion] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # Guards first loads, which may run in the warm-up thread and a request thread at once
+        self._load_lock = threading.Lock()
+        self.reloads = 0
+        self.reload_failures = 0
+
+    def _load(self, disease: str, model_path: Optional[str] = None) -> ModelVersion:
+        pipeline = _resolve_factory(self.factories[disease])(model_path)
+        return ModelVersion(disease, pipeline)
+
+    def preload(self, refresh: bool = False):
+        """
+        Load every disease's configured model now (startup / before forking workers).
+
+        With refresh=True, reload the configured files synchronously and replace
+        versions that loaded; only for processes serving no requests (the
+        app.serve master).
+        """
+        for disease in self.factories:
+            if not refresh or disease not in self._active:
+                self.active(disease)
+                continue
+            candidate = self._load(disease)
+            if candidate.pipeline.model.model is None:
+                logger.error(f"No usable {disease} weights at {candidate.pipeline.model.model_path}; keeping current")
+                continue
+            if candidate.version == self._active[disease].version:
+                logger.info(f"{disease} model {candidate.version} unchanged")
+                continue
+            self._activate(candidate, self._active[disease])
+
+    def active(self, disease: str) -> ModelVersion:
+        """Active version, loading the configured model on first use (blocking)."""
+        entry = self._active.get(disease)
+        if entry is None:
+            if disease not in self.factories:
+                raise KeyError(f"Unknown disease '{disease}'")
+            with self._load_lock:
+                entry = self._active.get(disease)
+                if entry is None:
+                    entry = self._load(disease)
+                    self._activate(entry)
+        return entry
+
+    def is_loaded(self, disease: str) -> bool:
+        return disease in self._active
+
+    async def ensure_loaded(self, *diseases: str):
+        """Load any of the given models not loaded yet, off the event loop."""
+        for disease in diseases:
+            if not self.is_loaded(disease):
+                await asyncio.to_thread(self.active, disease)
+
+    def _activate(self, entry: ModelVersion, previous: Optional[ModelVersion] = None):
+        self._active[entry.disease] = entry
+        if previous is not None and previous.version != entry.version:
+            MODEL_INFO.labels(entry.disease, previous.version).set(0)
+        MODEL_INFO.labels(entry.disease, entry.version).set(1)
+
+    def versions(self) -> Dict[str, str]:
+        """Active version per loaded disease."""
+        return {disease: entry.version for disease, entry in self._active.items()}
+
+    @contextmanager
+    def lease(self, disease: str):
+        """Pin the active pipeline for the duration of one request."""
+        entry = self.active(disease)
+        entry.inflight += 1
+        try:
+            yield entry.pipeline
+        finally:
+            entry.inflight -= 1
+            if entry.retired and entry.inflight == 0:
+                self._retire(entry)
+
+    @contextmanager
+    def lease_many(self, diseases):
+        """lease() several diseases at once; yields {disease: pipeline}."""
+        with ExitStack() as stack:
+            yield {disease: stack.enter_context(self.lease(disease)) for disease in diseases}
+
+    def _retire(self, entry: ModelVersion):
+        entry.drained.set()
+        if self._draining.pop(id(entry), None) is not None:
+            logger.info(f"{entry.disease} model {entry.version} drained and released")
+        entry.pipeline = None
+
+    async def reload(self, disease: str, model_path: Optional[str] = None) -> dict:
+        """
+        Load, warm and activate a new version of one disease's model.
+
+        Args:
+            disease: "glaucoma" or "dr"
+            model_path: Weight file to load (defaults to the configured path, so
+                        replacing that file and reloading rolls out new weights)
+
+        Returns:
+            Previous and new version, whether anything changed (the same file
+            contents are not reloaded) and whether the old one drained in time
+
+        Raises:
+            KeyError for an unknown disease, ModelReloadError if loading fails
+        """
+        if disease not in self.factories:
+            raise KeyError(f"Unknown disease '{disease}'")
+        lock = self._locks.setdefault(disease, asyncio.Lock())
+        async with lock:
+            started = time.perf_counter()
+            try:
+                candidate = await asyncio.to_thread(self._load, disease, model_path)
+            except Exception as e:
+                self.reload_failures += 1
+                raise ModelReloadError(f"Loading {disease} model failed: {e}") from e
+            if candidate.pipeline.model.model is None:
+                self.reload_failures += 1
+                raise ModelReloadError(f"No usable {disease} weights at {candidate.pipeline.model.model_path}")
+            current = self._active.get(disease)
+            if current is not None and current.version == candidate.version:
+                # Same file contents: keep the warm active version instead of swapping in a copy
+                logger.warning(f"{disease} model {candidate.version} is already active; nothing to reload")
+                return {
+                    "disease": disease,
+                    "previous_version": current.version,
+                    "version": current.version,
+                    "changed": False,
+                    "drained": True,
+                }
+            try:
+                await asyncio.to_thread(_warm_up, candidate.pipeline)
+            except Exception as e:
+                self.reload_failures += 1
+                raise ModelReloadError(f"Warm-up of {disease} model {candidate.version} failed: {e}") from e
+
+            # Swap between requests: new leases get the candidate from here on
+            previous = self._active.get(disease)
+            self._activate(candidate, previous)
+            self.reloads += 1
+            logger.info(
+                f"Activated {disease} model {candidate.version} in {time.perf_counter() - started:.2f}s "
+                f"(was {previous.version if previous else None})"
+            )
+
+            drained = True
+            if previous is not None:
+                previous.retired = True
+                if previous.inflight == 0:
+                    self._retire(previous)
+                else:
+                    self._draining[id(previous)] = previous
+                    try:
+                        await asyncio.wait_for(
+                            previous.drained.wait(), settings.MODEL_DRAIN_TIMEOUT_SECONDS
+                        )
+                    except asyncio.TimeoutError:
+                        # Still released by the last lease; we just stop waiting for it
+                        drained = False
+                        logger.warning(
+                            f"{disease} model {previous.version} still has {previous.inflight} requests in flight"
+                        )
+            return {
+                "disease": disease,
+                "previous_version": previous.version if previous else None,
+                "version": candidate.version,
+                "changed": True,
+                "drained": drained,
+            }
+
+    async def reload_all(self) -> list:
+        """Reload every disease from its configured path; failures are logged, not raised."""
+        results = []
+        for disease in self.factories:
+            try:
+                results.append(await self.reload(disease))
+            except ModelReloadError as e:
+                logger.error(str(e))
+                results.append({"disease": disease, "error": str(e)})
+        return results
+
+    def describe(self) -> dict:
+        return {
+            disease: dict(entry.describe(), draining=[
+                {"version": e.version, "inflight": e.inflight}
+                for e in self._draining.values() if e.disease == disease
+            ]) if entry else None
+            for disease, entry in ((d, self._active.get(d)) for d in self.factories)
+        }
+
+    def stats(self) -> dict:
+        stats = {"reloads": self.reloads, "reload_failures": self.reload_failures, "draining": len(self._draining)}
+        for disease, entry in self._active.items():
+            stats[f"{disease}_inflight"] = entry.inflight
+            stats[f"{disease}_loaded_at"] = entry.loaded_at
+        return stats
+
+
+model_registry = ModelRegistry()
@@ -0,0 +1,88 @@
+"""Chunked, concurrent Firestore writer for doctor notifications."""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Hard Firestore limit on writes per batch
+FIRESTORE_BATCH_LIMIT = 500
+
+
+class NotificationWriter:
+    """
+    Writes notification documents in batches below the Firestore limit.
+
+    Batches are committed concurrently on a small thread pool (never on the
+    event loop). Each batch is atomic, so a failure only affects that chunk;
+    the returned report lists which batches failed and for which users.
+    """
+
+    def __init__(self, db, batch_size: Optional[int] = None, max_concurrency: Optional[int] = None):
+        self.db = db
+        self.batch_size = min(
+            settings.FIRESTORE_BATCH_SIZE if batch_size is None else batch_size,
+            FIRESTORE_BATCH_LIMIT,
+        )
+        self.max_concurrency = settings.FIRESTORE_WRITE_CONCURRENCY if max_concurrency is None else max_concurrency
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, self.max_concurrency),
+            thread_name_prefix="firestore-notify",
+        )
+
+    def _chunks(self, docs: list) -> list:
+        return [docs[i : i + self.batch_size] for i in range(0, len(docs), self.batch_size)]
+
+    def _commit(self, docs: list):
+        batch = self.db.batch()
+        notif_col = self.db.collection("notifications")
+        for data in docs:
+            batch.set(notif_col.document(), data)
+        batch.commit()
+
+    @staticmethod
+    def _report(chunks: list, outcomes: list) -> dict:
+        report = {"written": 0, "failed": 0, "batches": len(chunks), "failed_batches": []}
+        for index, (chunk, outcome) in enumerate(zip(chunks, outcomes)):
+            if isinstance(outcome, BaseException):
+                report["failed"] += len(chunk)
+                report["failed_batches"].append(
+                    {
+                        "index": index,
+                        "size": len(chunk),
+                        "user_ids": list(dict.fromkeys(d.get("user_id") for d in chunk)),
+                        "error": str(outcome),
+                    }
+                )
+                logger.error("Notification batch %s (%s writes) failed: %s", index, len(chunk), outcome)
+            else:
+                report["written"] += len(chunk)
+        return report
+
+    async def write(self, docs: list) -> dict:
+        """Commit all notification documents; returns a written/failed report."""
+        chunks = self._chunks(docs)
+        loop = asyncio.get_running_loop()
+        outcomes = await asyncio.gather(
+            *[loop.run_in_executor(self._executor, self._commit, chunk) for chunk in chunks],
+            return_exceptions=True,
+        )
+        return self._report(chunks, outcomes)
+
+    def write_sync(self, docs: list) -> dict:
+        """Blocking variant of write() for synchronous callers."""
+        chunks = self._chunks(docs)
+        futures = [self._executor.submit(self._commit, chunk) for chunk in chunks]
+        outcomes = []
+        for future in futures:
+            try:
+                outcomes.append(future.result())
+            except Exception as e:
+                outcomes.append(e)
+        return self._report(chunks, outcomes)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,71 @@
+"""Off-event-loop PDF rendering for scan reports (process pool)."""
+import asyncio
+import functools
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class PDFRenderService:
+    """
+    Renders scan report PDFs in a process pool so ReportLab never blocks the API.
+
+    Each worker builds the report styles and logo asset once (pool initializer)
+    and reuses them for every report. With PDF_RENDER_WORKERS=0 rendering falls
+    back to a thread (still off the event loop, but sharing the GIL).
+    """
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = settings.PDF_RENDER_WORKERS if workers is None else workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _get_pool(self) -> Optional[ProcessPoolExecutor]:
+        if self.workers <= 0:
+            return None
+        if self._pool is None:
+            from app.services.scan_pdf import warm_report_assets
+
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context(settings.PDF_RENDER_START_METHOD),
+                initializer=warm_report_assets,
+            )
+            logger.info("PDF render pool started with %s workers", self.workers)
+        return self._pool
+
+    async def render(self, **kwargs) -> bytes:
+        """
+        Render a report; accepts the keyword arguments of build_scan_report_pdf.
+
+        ai_data must be resolved by the caller (workers never call Gemini);
+        None renders the "commentary unavailable" section.
+        """
+        # ReportLab is imported on first render (or by the startup warm-up), not with the app
+        from app.services.scan_pdf import build_scan_report_pdf
+
+        kwargs["ai_data"] = kwargs.get("ai_data") or {}
+        job = functools.partial(build_scan_report_pdf, **kwargs)
+        pool = self._get_pool()
+        if pool is None:
+            return await asyncio.to_thread(job)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(pool, job)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed); start a fresh pool for later reports
+            logger.error("PDF render pool broken; restarting it")
+            self.shutdown(wait=False)
+            raise
+
+    def shutdown(self, wait: bool = True):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+            self._pool = None
+
+
+pdf_render_service = PDFRenderService()
@@ -0,0 +1,150 @@
+"""Small in-memory LRU/TTL cache mirrored to SQLite (survives restarts)."""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PersistentCache:
+    """
+    JSON-value cache with LRU eviction (max_entries) and expiry (ttl_seconds).
+
+    Entries are kept in memory and mirrored to a SQLite table at `path` so a
+    restarted process starts warm. An empty path keeps the cache in memory only.
+    """
+
+    def __init__(self, path: Optional[str], ttl_seconds: float, max_entries: int, table: str = "entries"):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.path = path
+        self.table = table
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._db = None
+        if self.path:
+            try:
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+                self._db = sqlite3.connect(self.path, check_same_thread=False)
+                self._db.execute(
+                    f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+                )
+                self._db.commit()
+                self._load()
+            except Exception as e:
+                logger.warning("Cache persistence disabled for %s (%s)", self.table, e)
+                self._db = None
+
+    def _load(self):
+        cutoff = time.time() - self.ttl_seconds
+        self._db.execute(f"DELETE FROM {self.table} WHERE created_at < ?", (cutoff,))
+        rows = self._db.execute(
+            f"SELECT key, value, created_at FROM {self.table} ORDER BY created_at DESC LIMIT ?",
+            (self.max_entries,),
+        ).fetchall()
+        self._db.commit()
+        for key, value, created_at in reversed(rows):
+            try:
+                self._entries[key] = (json.loads(value), created_at)
+            except ValueError:
+                continue
+        logger.info("Loaded %s cached %s entries from %s", len(self._entries), self.table, self.path)
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            value = self._get_locked(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return value
+
+    def get_shared(self, key: str) -> Optional[dict]:
+        """
+        get(), falling back to the SQLite mirror for entries written since
+        startup by other processes sharing the path (app.serve workers).
+        """
+        with self._lock:
+            value = self._get_locked(key)
+            if value is None and self._db is not None:
+                value = self._read_mirror_locked(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return value
+
+    def _get_locked(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, created_at = entry
+        if time.time() - created_at > self.ttl_seconds:
+            self._delete_locked(key)
+            return None
+        self._entries.move_to_end(key)
+        return dict(value)
+
+    def _read_mirror_locked(self, key: str) -> Optional[dict]:
+        try:
+            row = self._db.execute(
+                f"SELECT value, created_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+        except Exception as e:
+            logger.debug("Failed to read %s cache entry: %s", self.table, e)
+            return None
+        if row is None or time.time() - row[1] > self.ttl_seconds:
+            return None
+        try:
+            value = json.loads(row[0])
+        except ValueError:
+            return None
+        self._entries[key] = (value, row[1])
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._delete_locked(next(iter(self._entries)))
+        return dict(value)
+
+    def set(self, key: str, value: dict):
+        now = time.time()
+        with self._lock:
+            self._entries[key] = (dict(value), now)
+            self._entries.move_to_end(key)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        f"INSERT OR REPLACE INTO {self.table} (key, value, created_at) VALUES (?, ?, ?)",
+                        (key, json.dumps(value), now),
+                    )
+                    self._db.commit()
+                except Exception as e:
+                    logger.debug("Failed to persist %s cache entry: %s", self.table, e)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._delete_locked(oldest)
+
+    def _delete_locked(self, key: str):
+        self._entries.pop(key, None)
+        if self._db is not None:
+            try:
+                self._db.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self._db.commit()
+            except Exception as e:
+                logger.debug("Failed to evict %s cache entry: %s", self.table, e)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits / total) if total else 0.0,
+        }
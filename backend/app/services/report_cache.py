@@ -0,0 +1,71 @@
+"""Idempotent scan report artifacts: reuse the uploaded PDF when inputs are unchanged."""
+import hashlib
+import json
+from typing import Optional
+
+from app.config import settings
+from app.services.persistent_cache import PersistentCache
+
+
+def report_inputs_hash(
+    patient_id: str,
+    patient_display_name: Optional[str],
+    glaucoma_msg: str,
+    dr_msg: str,
+    glaucoma_confidence: Optional[float],
+    dr_confidence: Optional[float],
+    images: list,
+) -> str:
+    """SHA-256 over everything rendered into the report (summary fields + image payloads)."""
+    digest = hashlib.sha256()
+    digest.update(
+        json.dumps(
+            [
+                patient_id,
+                patient_display_name or "",
+                glaucoma_msg or "",
+                dr_msg or "",
+                glaucoma_confidence,
+                dr_confidence,
+            ]
+        ).encode("utf-8")
+    )
+    for data in images:
+        digest.update(b"\x00")
+        if data:
+            digest.update(hashlib.sha256(str(data).encode("utf-8")).digest())
+    return digest.hexdigest()
+
+
+class ReportArtifactCache(PersistentCache):
+    """
+    Maps image_id -> (inputs_hash, pdf_url) for reports already built and uploaded.
+
+    A lookup only hits when the stored hash matches, so changed inputs always
+    rebuild the PDF. The TTL should stay below the signed URL lifetime.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl_seconds: Optional[float] = None,
+        max_entries: Optional[int] = None,
+    ):
+        super().__init__(
+            path=path if path is not None else settings.REPORT_CACHE_PATH,
+            ttl_seconds=settings.REPORT_CACHE_TTL_SECONDS if ttl_seconds is None else ttl_seconds,
+            max_entries=settings.REPORT_CACHE_MAX_ENTRIES if max_entries is None else max_entries,
+            table="scan_reports",
+        )
+
+    def get_pdf_url(self, image_id: str, inputs_hash: str) -> Optional[str]:
+        entry = self.get(image_id)
+        if not entry or entry.get("inputs_hash") != inputs_hash:
+            return None
+        return entry.get("pdf_url")
+
+    def set_pdf_url(self, image_id: str, inputs_hash: str, pdf_url: str):
+        self.set(image_id, {"inputs_hash": inputs_hash, "pdf_url": pdf_url})
+
+
+report_cache = ReportArtifactCache()
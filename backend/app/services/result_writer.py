@@ -0,0 +1,111 @@
+"""Batched Firestore persistence for analysis results (glucoma_result + dr_result)."""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Optional
+
+from app.config import settings
+from app.services.notification_writer import FIRESTORE_BATCH_LIMIT
+
+logger = logging.getLogger(__name__)
+
+# Each scan writes one glucoma_result and one dr_result document
+WRITES_PER_SCAN = 2
+
+
+class ResultWriter:
+    """
+    Persists scan results with both documents of a scan in one atomic batch.
+
+    write_scan() commits a single scan. submit() buffers scans from bulk
+    paths and flushes them when max_batch_scans are queued or flush_interval
+    seconds have passed, whichever comes first; the returned future resolves
+    once that scan's batch is durable (or raises if its commit failed).
+    """
+
+    def __init__(self, db, max_batch_scans: Optional[int] = None, flush_interval: Optional[float] = None):
+        self.db = db
+        self.max_batch_scans = min(
+            settings.RESULT_WRITE_BATCH_SCANS if max_batch_scans is None else max_batch_scans,
+            FIRESTORE_BATCH_LIMIT // WRITES_PER_SCAN,
+        )
+        self.flush_interval = settings.RESULT_WRITE_FLUSH_SECONDS if flush_interval is None else flush_interval
+        self._buffer: list = []  # (docs, future)
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes: set = set()
+
+    @staticmethod
+    def _result_docs(
+        patient_id: str, glaucoma_result: Optional[dict], dr_result: Optional[dict], image_id: str
+    ) -> list:
+        """One document per analyzed disease (a scan limited to one disease writes only that one)."""
+        current_date = datetime.now().isoformat()
+        return [
+            (collection, {
+                'patientId': patient_id,
+                'result_msg': result['result_msg'],
+                'imageId': image_id,
+                'doctor_feedback': '',
+                'date': current_date
+            })
+            for collection, result in (("glucoma_result", glaucoma_result), ("dr_result", dr_result))
+            if result is not None
+        ]
+
+    def _commit(self, docs: list):
+        batch = self.db.batch()
+        for collection, data in docs:
+            batch.set(self.db.collection(collection).document(), data)
+        batch.commit()
+
+    def write_scan(self, patient_id: str, glaucoma_result: dict, dr_result: dict, image_id: str):
+        """Write both result documents of one scan in a single atomic batch (blocking)."""
+        self._commit(self._result_docs(patient_id, glaucoma_result, dr_result, image_id))
+
+    def submit(self, patient_id: str, glaucoma_result: dict, dr_result: dict, image_id: str) -> asyncio.Future:
+        """Buffer a scan for the next flush; await the returned future for durability."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._buffer.append((self._result_docs(patient_id, glaucoma_result, dr_result, image_id), future))
+        if len(self._buffer) >= self.max_batch_scans:
+            self._schedule_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.flush_interval, self._schedule_flush)
+        return future
+
+    def _schedule_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._buffer:
+            return
+        items, self._buffer = self._buffer, []
+        task = asyncio.ensure_future(self._flush_items(items))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush_items(self, items: list):
+        for start in range(0, len(items), self.max_batch_scans):
+            chunk = items[start : start + self.max_batch_scans]
+            docs = [doc for scan_docs, _ in chunk for doc in scan_docs]
+            try:
+                await asyncio.to_thread(self._commit, docs)
+            except Exception as e:
+                logger.error("Result batch of %s scans failed: %s", len(chunk), e)
+                for _, future in chunk:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for _, future in chunk:
+                if not future.done():
+                    future.set_result(True)
+        logger.info("Flushed %s scan results to Firestore", len(items))
+
+    async def flush(self):
+        """Flush buffered results now and wait for all pending commits."""
+        self._schedule_flush()
+        if self._flushes:
+            await asyncio.gather(*list(self._flushes), return_exceptions=True)
+
+    def pending(self) -> int:
+        return len(self._buffer)
@@ -1,5 +1,6 @@
 """Build PDF reports for eye scan results (images + summary text)."""
 import base64
+import functools
 import io
 import logging
 from pathlib import Path
@@ -7,16 +8,23 @@ import re
 from typing import Optional
 
 from PIL import Image
+from reportlab import rl_config
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 from reportlab.platypus import Image as RLImage, Paragraph, SimpleDocTemplate, Spacer
 
-from app.services.gemini_service import gemini_service
+from app.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Store image streams as binary instead of ASCII85 text (~25% smaller PDFs)
+rl_config.useA85 = 0
+
+LOGO_PATH = Path(__file__).parent / "assets" / "logo.jpg"
+LOGO_WIDTH = 1.0 * inch
+
 
 def _decode_image(data: Optional[str]) -> Optional[bytes]:
     if not data or not str(data).strip():
@@ -31,30 +39,97 @@ def _decode_image(data: Optional[str]) -> Optional[bytes]:
         return None
 
 
-def _image_flowable(raw: bytes, max_width: float = 5.25 * inch):
+def _image_flowable(
+    raw: bytes,
+    max_width: float = 5.25 * inch,
+    max_height: float = 6.5 * inch,
+    dpi: Optional[float] = None,
+):
+    """
+    Build an image flowable sized to fit max_width x max_height.
+
+    JPEGs that already fit the target print resolution (settings.PDF_IMAGE_DPI)
+    are embedded byte-for-byte (ReportLab stores them as DCTDecode streams).
+    Anything larger is downsampled once to that resolution and other formats
+    are encoded to JPEG a single time.
+    """
     try:
-        bio = io.BytesIO(raw)
-        pil = Image.open(bio).convert("RGB")
-        out = io.BytesIO()
-        pil.save(out, format="JPEG", quality=82)
-        out.seek(0)
+        pil = Image.open(io.BytesIO(raw))  # lazy: only the header is parsed here
         w_px, h_px = pil.size
         if w_px <= 0 or h_px <= 0:
             return None
         disp_w = max_width
         disp_h = disp_w * h_px / w_px
-        max_h = 6.5 * inch
-        if disp_h > max_h:
-            scale = max_h / disp_h
+        if disp_h > max_height:
+            scale = max_height / disp_h
             disp_w *= scale
             disp_h *= scale
-        out.seek(0)
-        return RLImage(out, width=disp_w, height=disp_h)
+
+        dpi = dpi or settings.PDF_IMAGE_DPI
+        target_w = max(1, int(round(disp_w / inch * dpi)))
+        target_h = max(1, int(round(disp_h / inch * dpi)))
+        fits = w_px <= target_w and h_px <= target_h
+
+        if pil.format == "JPEG" and pil.mode in ("RGB", "L") and fits:
+            data = io.BytesIO(raw)
+        else:
+            if pil.mode not in ("RGB", "L"):
+                pil = pil.convert("RGB")
+            # thumbnail() uses JPEG draft mode, so oversized JPEGs are scaled while decoding
+            pil.thumbnail((target_w, target_h), Image.Resampling.LANCZOS)
+            data = io.BytesIO()
+            pil.save(data, format="JPEG", quality=82)
+            data.seek(0)
+        return RLImage(data, width=disp_w, height=disp_h)
     except Exception as e:
         logger.warning("Failed to build PDF image: %s", e)
         return None
 
 
+@functools.lru_cache(maxsize=1)
+def _report_styles() -> dict:
+    """Paragraph styles for the report (built once per process)."""
+    styles = getSampleStyleSheet()
+    title_style = ParagraphStyle(
+        "ScanTitle",
+        parent=styles["Heading1"],
+        fontSize=16,
+        spaceAfter=12,
+        textColor=colors.HexColor("#0f172a"),
+    )
+    h2 = ParagraphStyle(
+        "ScanH2",
+        parent=styles["Heading2"],
+        fontSize=12,
+        spaceBefore=10,
+        spaceAfter=6,
+        textColor=colors.HexColor("#334155"),
+    )
+    body = ParagraphStyle("ScanBody", parent=styles["Normal"], fontSize=10, leading=14)
+    return {"title": title_style, "h2": h2, "body": body}
+
+
+@functools.lru_cache(maxsize=1)
+def _logo_asset() -> Optional[tuple]:
+    """Footer logo (jpeg_bytes, width, height), read and measured once per process."""
+    if not LOGO_PATH.exists():
+        return None
+    try:
+        raw = LOGO_PATH.read_bytes()
+        with Image.open(io.BytesIO(raw)) as raw_logo:
+            ratio = (raw_logo.height / raw_logo.width) if raw_logo.width else 1.0
+        return raw, LOGO_WIDTH, LOGO_WIDTH * ratio
+    except Exception as e:
+        logger.warning("Failed to read footer logo: %s", e)
+        return None
+
+
+def warm_report_assets():
+    """Build cached styles and logo metadata (PDF render worker initializer)."""
+    _report_styles()
+    _logo_asset()
+
+
 def _summary_line(label: str, msg: str, confidence_text: str) -> str:
     # Normalize message so confidence appears once in a consistent format.
     safe_msg = (msg or "").strip()
@@ -79,7 +154,15 @@ def build_scan_report_pdf(
     glaucoma_overlay_base64: Optional[str],
     dr_heatmap_base64: Optional[str],
     dr_overlay_base64: Optional[str],
+    ai_data: Optional[dict] = None,
 ) -> bytes:
+    """
+    Render the scan report PDF.
+
+    ai_data is the Gemini commentary; async callers fetch it beforehand
+    (gemini_service.build_doctor_explanation_async) so this function never
+    blocks on the network. When omitted it is generated synchronously.
+    """
     buffer = io.BytesIO()
     doc = SimpleDocTemplate(
         buffer,
@@ -90,23 +173,10 @@ def build_scan_report_pdf(
         topMargin=0.65 * inch,
         bottomMargin=0.65 * inch,
     )
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(
-        "ScanTitle",
-        parent=styles["Heading1"],
-        fontSize=16,
-        spaceAfter=12,
-        textColor=colors.HexColor("#0f172a"),
-    )
-    h2 = ParagraphStyle(
-        "ScanH2",
-        parent=styles["Heading2"],
-        fontSize=12,
-        spaceBefore=10,
-        spaceAfter=6,
-        textColor=colors.HexColor("#334155"),
-    )
-    body = ParagraphStyle("ScanBody", parent=styles["Normal"], fontSize=10, leading=14)
+    styles = _report_styles()
+    title_style = styles["title"]
+    h2 = styles["h2"]
+    body = styles["body"]
 
     story = []
     story.append(Paragraph("DiagnoVision — Eye scan report", title_style))
@@ -122,12 +192,15 @@ def build_scan_report_pdf(
     story.append(Spacer(1, 0.15 * inch))
 
     story.append(Paragraph("AI clinical commentary (doctor-facing)", h2))
-    ai_data = gemini_service.build_doctor_explanation(
-        glaucoma_msg=glaucoma_msg,
-        dr_msg=dr_msg,
-        glaucoma_confidence=glaucoma_confidence,
-        dr_confidence=dr_confidence,
-    )
+    if ai_data is None:
+        from app.services.gemini_service import gemini_service
+
+        ai_data = gemini_service.build_doctor_explanation(
+            glaucoma_msg=glaucoma_msg,
+            dr_msg=dr_msg,
+            glaucoma_confidence=glaucoma_confidence,
+            dr_confidence=dr_confidence,
+        )
     if ai_data:
         summary = str(ai_data.get("clinical_summary", "")).strip()
         actions = ai_data.get("action_points") or []
@@ -194,15 +267,12 @@ def build_scan_report_pdf(
             body,
         )
     )
-    logo_path = Path(__file__).parent / "assets" / "logo.jpg"
-    if logo_path.exists():
+    logo_asset = _logo_asset()
+    if logo_asset:
         try:
             story.append(Spacer(1, 0.08 * inch))
-            with Image.open(str(logo_path)) as raw_logo:
-                ratio = (raw_logo.height / raw_logo.width) if raw_logo.width else 1.0
-            logo_w = 1.0 * inch
-            logo_h = logo_w * ratio
-            logo = RLImage(str(logo_path), width=logo_w, height=logo_h)
+            logo_bytes, logo_w, logo_h = logo_asset
+            logo = RLImage(io.BytesIO(logo_bytes), width=logo_w, height=logo_h)
             logo.hAlign = "LEFT"
             story.append(logo)
         except Exception as e:
@@ -0,0 +1,174 @@
+"""Storage backends used by SupabaseService (Supabase or local filesystem/SQLite)."""
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class StorageBackend(ABC):
+    """
+    Minimal storage interface behind SupabaseService.
+
+    Covers object uploads (retinal images, Grad-CAM renders, scan PDFs),
+    URL generation and inserts into the `images` metadata table.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def upload(
+        self,
+        bucket: str,
+        path: str,
+        data: bytes,
+        content_type: str,
+        upsert: bool = False,
+    ) -> None:
+        """Store data at bucket/path (raises if it exists and upsert is False)."""
+
+    @abstractmethod
+    def get_public_url(self, bucket: str, path: str) -> str:
+        """URL of the object at bucket/path."""
+
+    def create_signed_url(self, bucket: str, path: str, expires_in: int) -> Optional[str]:
+        """Return a signed URL, or None when the backend does not support it."""
+        return None
+
+    @abstractmethod
+    def insert_image_row(self, row: dict) -> None:
+        """Insert one row into the `images` metadata table."""
+
+
+class SupabaseStorageBackend(StorageBackend):
+    """Supabase Storage + `images` table (production backend)."""
+
+    name = "supabase"
+
+    def __init__(self):
+        # Validate that required environment variables are set
+        if not settings.SUPABASE_URL:
+            raise ValueError(
+                "SUPABASE_URL is not set. Please create a .env file in the backend directory "
+                "and add SUPABASE_URL. See .env.example for a template."
+            )
+        if not settings.SUPABASE_SERVICE_KEY:
+            raise ValueError(
+                "SUPABASE_SERVICE_KEY is not set. Please create a .env file in the backend directory "
+                "and add SUPABASE_SERVICE_KEY. See .env.example for a template."
+            )
+
+        from supabase import create_client
+
+        self.supabase = create_client(
+            settings.SUPABASE_URL,
+            settings.SUPABASE_SERVICE_KEY
+        )
+
+    def upload(self, bucket, path, data, content_type, upsert=False):
+        file_options = {"content-type": content_type}
+        if upsert:
+            file_options["x-upsert"] = "true"
+        self.supabase.storage.from_(bucket).upload(path, data, file_options=file_options)
+
+    def get_public_url(self, bucket, path):
+        return self.supabase.storage.from_(bucket).get_public_url(path)
+
+    def create_signed_url(self, bucket, path, expires_in):
+        signed = self.supabase.storage.from_(bucket).create_signed_url(path, expires_in)
+        if isinstance(signed, dict):
+            return signed.get("signedURL") or signed.get("signedUrl")
+        return None
+
+    def insert_image_row(self, row):
+        self.supabase.table("images").insert(row).execute()
+
+
+class LocalStorageBackend(StorageBackend):
+    """
+    Local stand-in for Supabase used for offline benchmarks and load tests.
+
+    Objects are written under `root/<bucket>/<path>` and `images` rows go into
+    a SQLite database at `root/images.sqlite3`. Every operation sleeps for
+    `latency_ms` (+/- `jitter_ms`) to approximate a network round trip; the
+    async callers run these calls in worker threads, so only the caller waits.
+    """
+
+    name = "local"
+
+    def __init__(
+        self,
+        root: Optional[str] = None,
+        latency_ms: Optional[float] = None,
+        jitter_ms: Optional[float] = None,
+    ):
+        self.root = Path(root or settings.LOCAL_STORAGE_DIR)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.latency_ms = settings.LOCAL_STORAGE_LATENCY_MS if latency_ms is None else latency_ms
+        self.jitter_ms = settings.LOCAL_STORAGE_LATENCY_JITTER_MS if jitter_ms is None else jitter_ms
+        self.db_path = self.root / "images.sqlite3"
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            "imageId TEXT PRIMARY KEY, row TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._db.commit()
+        logger.info("Local storage backend at %s (latency %.1f ms)", self.root, self.latency_ms)
+
+    def _simulate_latency(self):
+        if self.latency_ms <= 0 and self.jitter_ms <= 0:
+            return
+        delay = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+
+    def _object_path(self, bucket: str, path: str) -> Path:
+        target = (self.root / bucket / path).resolve()
+        if self.root.resolve() not in target.parents:
+            raise ValueError(f"Invalid storage path: {path}")
+        return target
+
+    def upload(self, bucket, path, data, content_type, upsert=False):
+        self._simulate_latency()
+        target = self._object_path(bucket, path)
+        if target.exists() and not upsert:
+            raise FileExistsError(f"Object already exists: {bucket}/{path}")
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_name(target.name + ".part")
+        tmp.write_bytes(data)
+        tmp.replace(target)
+
+    def get_public_url(self, bucket, path):
+        return self._object_path(bucket, path).as_uri()
+
+    def create_signed_url(self, bucket, path, expires_in):
+        self._simulate_latency()
+        return f"{self._object_path(bucket, path).as_uri()}?expires_in={int(expires_in)}"
+
+    def insert_image_row(self, row):
+        self._simulate_latency()
+        with self._db_lock:
+            self._db.execute(
+                "INSERT INTO images (imageId, row, created_at) VALUES (?, ?, ?)",
+                (row.get("imageId"), json.dumps(row), time.time()),
+            )
+            self._db.commit()
+
+
+def create_storage_backend(name: Optional[str] = None) -> StorageBackend:
+    """Build the storage backend selected by settings.STORAGE_BACKEND."""
+    name = (name or settings.STORAGE_BACKEND or "supabase").lower()
+    if name == "supabase":
+        return SupabaseStorageBackend()
+    if name == "local":
+        return LocalStorageBackend()
+    raise ValueError(f"Unknown STORAGE_BACKEND '{name}' (expected 'supabase' or 'local')")
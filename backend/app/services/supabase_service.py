@@ -1,33 +1,35 @@
-from supabase import create_client, Client
+import asyncio
 import logging
-from PIL import Image
+from typing import Optional
 import io
+import threading
 import uuid
-import numpy as np
 from app.config import settings
+from app.services.storage_backend import StorageBackend, create_storage_backend
 
 logger = logging.getLogger(__name__)
 
 class SupabaseService:
     """Service for Supabase operations"""
     
-    def __init__(self):
-        # Validate that required environment variables are set
-        if not settings.SUPABASE_URL:
-            raise ValueError(
-                "SUPABASE_URL is not set. Please create a .env file in the backend directory "
-                "and add SUPABASE_URL. See .env.example for a template."
-            )
-        if not settings.SUPABASE_SERVICE_KEY:
-            raise ValueError(
-                "SUPABASE_SERVICE_KEY is not set. Please create a .env file in the backend directory "
-                "and add SUPABASE_SERVICE_KEY. See .env.example for a template."
-            )
-        
-        self.supabase: Client = create_client(
-            settings.SUPABASE_URL,
-            settings.SUPABASE_SERVICE_KEY
-        )
+    def __init__(self, storage: Optional[StorageBackend] = None):
+        # Supabase by default; STORAGE_BACKEND=local swaps in the offline filesystem/SQLite backend.
+        # Created on first use so importing the API doesn't import / connect the Supabase client.
+        self._storage = storage
+        self._storage_lock = threading.Lock()
+    
+    @property
+    def storage(self) -> StorageBackend:
+        if self._storage is None:
+            with self._storage_lock:
+                if self._storage is None:
+                    self._storage = create_storage_backend()
+        return self._storage
+    
+    @property
+    def supabase(self):
+        """Raw Supabase client (None for non-Supabase backends)"""
+        return getattr(self.storage, "supabase", None)
     
     async def upload_images(
         self,
@@ -54,12 +56,13 @@ class SupabaseService:
             
             # Upload original image
             original_path = f"images/{patient_id}/{image_id}_original.jpg"
-            self.supabase.storage.from_("images").upload(
+            self.storage.upload(
+                "images",
                 original_path,
                 original_image,
-                file_options={"content-type": "image/jpeg"}
+                "image/jpeg"
             )
-            original_url = self.supabase.storage.from_("images").get_public_url(original_path)
+            original_url = self.storage.get_public_url("images", original_path)
             
             # Use Glaucoma GradCAM (or DR if Glaucoma not available)
             gradcam_data = glaucoma_gradcam if glaucoma_gradcam and glaucoma_gradcam.get("heatmap_only") is not None else dr_gradcam
@@ -81,12 +84,13 @@ class SupabaseService:
             if heatmap_only is not None:
                 heatmap_bytes = self._heatmap_to_bytes(heatmap_only)
                 heatmap_path = f"images/{patient_id}/{image_id}_heatmap.jpg"
-                self.supabase.storage.from_("images").upload(
+                self.storage.upload(
+                    "images",
                     heatmap_path,
                     heatmap_bytes,
-                    file_options={"content-type": "image/jpeg"}
+                    "image/jpeg"
                 )
-                heatmap_url = self.supabase.storage.from_("images").get_public_url(heatmap_path)
+                heatmap_url = self.storage.get_public_url("images", heatmap_path)
             else:
                 heatmap_url = None
             
@@ -95,23 +99,24 @@ class SupabaseService:
             if overlay is not None:
                 overlay_bytes = self._heatmap_to_bytes(overlay)
                 overlay_path = f"images/{patient_id}/{image_id}_overlay.jpg"
-                self.supabase.storage.from_("images").upload(
+                self.storage.upload(
+                    "images",
                     overlay_path,
                     overlay_bytes,
-                    file_options={"content-type": "image/jpeg"}
+                    "image/jpeg"
                 )
-                overlay_url = self.supabase.storage.from_("images").get_public_url(overlay_path)
+                overlay_url = self.storage.get_public_url("images", overlay_path)
             else:
                 overlay_url = None
             
             # Store metadata in images table (all three URLs)
-            self.supabase.table("images").insert({
+            self.storage.insert_image_row({
                 "imageId": image_id,
                 "Image_url": original_url,
                 "heatmap_url": heatmap_url,
                 "overlay_url": overlay_url,
                 "grad_cam_url": overlay_url if overlay_url else original_url  # For backward compatibility
-            }).execute()
+            })
             
             logger.info(f"Images uploaded to Supabase for image_id: {image_id}")
             
@@ -127,6 +132,19 @@ class SupabaseService:
             logger.error(f"Error uploading to Supabase: {str(e)}")
             raise
     
+    def _upload_jpeg(self, patient_id: str, image_id: str, suffix: str, image) -> Optional[str]:
+        """Upload one JPEG (bytes or RGB array) as images/{patient_id}/{image_id}_{suffix}.jpg; None is skipped."""
+        if image is None:
+            return None
+        path = f"images/{patient_id}/{image_id}_{suffix}.jpg"
+        self.storage.upload(
+            "images",
+            path,
+            self._heatmap_to_bytes(image),
+            "image/jpeg"
+        )
+        return self.storage.get_public_url("images", path)
+    
     async def upload_images_async(
         self,
         image_id: str,
@@ -137,83 +155,45 @@ class SupabaseService:
     ):
         """
         Upload images to Supabase asynchronously (non-blocking background task)
-        Uploads 5 images: original + 2 Glaucoma (heatmap, overlay) + 2 DR (heatmap, overlay)
+        Uploads up to 5 images: original + 2 Glaucoma (heatmap, overlay) + 2 DR (heatmap, overlay);
+        diseases and outputs the caller did not request are passed as None and skipped
         
         Args:
             image_id: Pre-generated image ID
             original_image: Original image bytes
-            glaucoma_gradcam: Dict with 'heatmap_only' and 'overlay' numpy arrays
-            dr_gradcam: Dict with 'heatmap_only' and 'overlay' numpy arrays (or None)
+            glaucoma_gradcam: Dict with 'heatmap_only' and/or 'overlay' as encoded JPEG bytes
+                              (numpy arrays are still accepted and encoded here), or None
+            dr_gradcam: Same for DR (or None)
             patient_id: Patient ID
+        
+        Returns:
+            Public URL per uploaded image ("original", "glaucoma_heatmap", ...); empty on failure
         """
         try:
-            # Upload original image
-            original_path = f"images/{patient_id}/{image_id}_original.jpg"
-            self.supabase.storage.from_("images").upload(
-                original_path,
-                original_image,
-                file_options={"content-type": "image/jpeg"}
-            )
-            original_url = self.supabase.storage.from_("images").get_public_url(original_path)
-            
-            # Initialize URLs
-            glaucoma_heatmap_url = None
-            glaucoma_overlay_url = None
-            dr_heatmap_url = None
-            dr_overlay_url = None
-            
-            # Upload Glaucoma GradCAM images
-            if glaucoma_gradcam and glaucoma_gradcam.get("heatmap_only") is not None:
-                # Upload Glaucoma heatmap
-                glaucoma_heatmap_bytes = self._heatmap_to_bytes(glaucoma_gradcam["heatmap_only"])
-                glaucoma_heatmap_path = f"images/{patient_id}/{image_id}_glaucoma_heatmap.jpg"
-                self.supabase.storage.from_("images").upload(
-                    glaucoma_heatmap_path,
-                    glaucoma_heatmap_bytes,
-                    file_options={"content-type": "image/jpeg"}
-                )
-                glaucoma_heatmap_url = self.supabase.storage.from_("images").get_public_url(glaucoma_heatmap_path)
-                
-                # Upload Glaucoma overlay
-                if glaucoma_gradcam.get("overlay") is not None:
-                    glaucoma_overlay_bytes = self._heatmap_to_bytes(glaucoma_gradcam["overlay"])
-                    glaucoma_overlay_path = f"images/{patient_id}/{image_id}_glaucoma_overlay.jpg"
-                    self.supabase.storage.from_("images").upload(
-                        glaucoma_overlay_path,
-                        glaucoma_overlay_bytes,
-                        file_options={"content-type": "image/jpeg"}
-                    )
-                    glaucoma_overlay_url = self.supabase.storage.from_("images").get_public_url(glaucoma_overlay_path)
-            
-            # Upload DR GradCAM images
-            if dr_gradcam and dr_gradcam.get("heatmap_only") is not None:
-                # Upload DR heatmap
-                dr_heatmap_bytes = self._heatmap_to_bytes(dr_gradcam["heatmap_only"])
-                dr_heatmap_path = f"images/{patient_id}/{image_id}_dr_heatmap.jpg"
-                self.supabase.storage.from_("images").upload(
-                    dr_heatmap_path,
-                    dr_heatmap_bytes,
-                    file_options={"content-type": "image/jpeg"}
-                )
-                dr_heatmap_url = self.supabase.storage.from_("images").get_public_url(dr_heatmap_path)
-                
-                # Upload DR overlay
-                if dr_gradcam.get("overlay") is not None:
-                    dr_overlay_bytes = self._heatmap_to_bytes(dr_gradcam["overlay"])
-                    dr_overlay_path = f"images/{patient_id}/{image_id}_dr_overlay.jpg"
-                    self.supabase.storage.from_("images").upload(
-                        dr_overlay_path,
-                        dr_overlay_bytes,
-                        file_options={"content-type": "image/jpeg"}
-                    )
-                    dr_overlay_url = self.supabase.storage.from_("images").get_public_url(dr_overlay_path)
+            # Upload original image and the Glaucoma and DR GradCAM images (whichever were
+            # computed) concurrently in worker threads; storage clients are blocking
+            glaucoma_gradcam = glaucoma_gradcam or {}
+            dr_gradcam = dr_gradcam or {}
+            uploads = [
+                ("original", original_image),
+                ("glaucoma_heatmap", glaucoma_gradcam.get("heatmap_only")),
+                ("glaucoma_overlay", glaucoma_gradcam.get("overlay")),
+                ("dr_heatmap", dr_gradcam.get("heatmap_only")),
+                ("dr_overlay", dr_gradcam.get("overlay")),
+            ]
+            (
+                original_url, glaucoma_heatmap_url, glaucoma_overlay_url, dr_heatmap_url, dr_overlay_url
+            ) = await asyncio.gather(*(
+                asyncio.to_thread(self._upload_jpeg, patient_id, image_id, suffix, image)
+                for suffix, image in uploads
+            ))
             
             # For backward compatibility, use Glaucoma URLs as default (or DR if Glaucoma not available)
             default_heatmap_url = glaucoma_heatmap_url or dr_heatmap_url
             default_overlay_url = glaucoma_overlay_url or dr_overlay_url
             
             # Store metadata in images table with all URLs
-            self.supabase.table("images").insert({
+            await asyncio.to_thread(self.storage.insert_image_row, {
                 "imageId": image_id,
                 "Image_url": original_url,
                 "glaucoma_heatmap_url": glaucoma_heatmap_url,
@@ -224,17 +204,26 @@ class SupabaseService:
                 "heatmap_url": default_heatmap_url,
                 "overlay_url": default_overlay_url,
                 "grad_cam_url": default_overlay_url if default_overlay_url else original_url
-            }).execute()
+            })
             
             logger.info(f"Images uploaded to Supabase for image_id: {image_id}")
+            urls = {
+                "original": original_url,
+                "glaucoma_heatmap": glaucoma_heatmap_url,
+                "glaucoma_overlay": glaucoma_overlay_url,
+                "dr_heatmap": dr_heatmap_url,
+                "dr_overlay": dr_overlay_url,
+            }
+            return {name: url for name, url in urls.items() if url}
             
         except Exception as e:
             logger.error(f"Error uploading to Supabase (async): {str(e)}")
             # Don't raise - this is background task, failure shouldn't affect response
+            return {}
 
     def upload_scan_report_pdf(self, patient_id: str, image_id: str, pdf_bytes: bytes) -> str:
         """
-        Upload a scan report PDF to Supabase Storage.
+        Upload a scan report PDF to Supabase Storage (or the configured storage backend).
 
         Uses bucket from settings.SUPABASE_SCAN_REPORTS_BUCKET (default: images).
         Path: scan_reports/{patient_id}/{image_id}.pdf
@@ -248,28 +237,23 @@ class SupabaseService:
         bucket = settings.SUPABASE_SCAN_REPORTS_BUCKET or "images"
         path = f"scan_reports/{patient_id}/{image_id}.pdf"
 
-        self.supabase.storage.from_(bucket).upload(
+        self.storage.upload(
+            bucket,
             path,
             pdf_bytes,
-            file_options={
-                "content-type": "application/pdf",
-                "x-upsert": "true",
-            },
+            "application/pdf",
+            upsert=True,
         )
 
         # Prefer signed URL (works for private buckets); fall back to public URL
         try:
-            signed = self.supabase.storage.from_(bucket).create_signed_url(
-                path, 60 * 60 * 24 * 365
-            )
-            if isinstance(signed, dict) and signed.get("signedURL"):
-                return signed["signedURL"]
-            if isinstance(signed, dict) and signed.get("signedUrl"):
-                return signed["signedUrl"]
+            signed_url = self.storage.create_signed_url(bucket, path, 60 * 60 * 24 * 365)
+            if signed_url:
+                return signed_url
         except Exception as e:
             logger.debug("Signed URL not used for scan PDF (%s), using public URL", e)
 
-        return self.supabase.storage.from_(bucket).get_public_url(path)
+        return self.storage.get_public_url(bucket, path)
 
     def _combine_gradcams(self, glaucoma_gradcam, dr_gradcam):
         """Combine Glaucoma and DR GradCAM heatmaps"""
@@ -278,7 +262,13 @@ class SupabaseService:
         return glaucoma_gradcam
     
     def _heatmap_to_bytes(self, heatmap):
-        """Convert heatmap numpy array (colored overlay) to image bytes"""
+        """Convert heatmap numpy array (colored overlay) to image bytes; encoded bytes pass through"""
+        if isinstance(heatmap, (bytes, bytearray)):
+            return bytes(heatmap)
+        # Only arrays need numpy / Pillow here; they load with the models, not with the app
+        import numpy as np
+        from PIL import Image
+
         try:
             # Heatmap is now a colored overlay (H, W, 3) in RGB format
             # Ensure it's uint8
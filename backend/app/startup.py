@@ -0,0 +1,78 @@
+"""Deferred service initialization: background warm-up, per-component startup timing and readiness."""
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class StartupReport:
+    """
+    Records how long each component took to import or initialize.
+
+    Components listed as required must finish before /ready reports ready;
+    the others (clients, caches) only affect the report.
+    """
+
+    def __init__(self, required: Tuple[str, ...] = ()):
+        self.required = required
+        self.seconds: Dict[str, float] = {}
+        self.errors: Dict[str, str] = {}
+        self.pending: List[str] = []
+        self.started_at = time.time()
+
+    def record(self, component: str, seconds: float):
+        self.seconds[component] = round(seconds, 4)
+
+    def run(self, component: str, init: Callable):
+        """Run one initializer, timing it; failures are recorded and logged, not raised."""
+        started = time.perf_counter()
+        try:
+            init()
+        except Exception as e:
+            self.errors[component] = str(e)
+            logger.error(f"Startup of {component} failed: {e}")
+        finally:
+            self.record(component, time.perf_counter() - started)
+            if component in self.pending:
+                self.pending.remove(component)
+
+    def is_ready(self) -> bool:
+        return all(c in self.seconds and c not in self.errors for c in self.required)
+
+    def as_dict(self) -> dict:
+        return {
+            "ready": self.is_ready(),
+            "uptime_seconds": round(time.time() - self.started_at, 3),
+            "components": dict(self.seconds),
+            "pending": list(self.pending),
+            "errors": dict(self.errors),
+        }
+
+    def stats(self) -> dict:
+        stats = {f"{name}_seconds": seconds for name, seconds in self.seconds.items()}
+        stats["ready"] = self.is_ready()
+        return stats
+
+
+async def warm_up(report: StartupReport, components: List[Tuple[str, Callable]]):
+    """
+    Initialize components one after another in a worker thread.
+
+    The event loop keeps serving (health checks, metrics) meanwhile; requests
+    that need a component before its turn initialize it on first use.
+    """
+    report.pending.extend(name for name, _ in components if name not in report.pending)
+    started = time.perf_counter()
+    for name, init in components:
+        await asyncio.to_thread(report.run, name, init)
+    logger.info(
+        "Warm-up finished in %.2fs: %s",
+        time.perf_counter() - started,
+        ", ".join(f"{name}={seconds:.2f}s" for name, seconds in report.seconds.items()),
+    )
+
+
+# Both models must be loaded before the instance takes analysis traffic
+startup_report = StartupReport(required=("glaucoma_model", "dr_model"))
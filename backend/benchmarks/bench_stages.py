@@ -0,0 +1,281 @@
+"""
+Stage-level microbenchmarks for the analysis and report pipeline.
+
+Models are built with random weights (same architectures as production), so
+timings reflect real compute even when no .pth files are present. Inputs are
+synthetic fundus images at camera-like resolutions.
+
+Usage (from backend/):
+    python -m benchmarks.bench_stages                      # run + compare to baseline
+    python -m benchmarks.bench_stages --save-baseline      # record a new baseline
+    python -m benchmarks.bench_stages --sizes 1536,3072 --batch-sizes 1,8 --threads 1,4
+    python -m benchmarks.bench_stages --stages forward_dr,gradcam_dr --repeat 10
+
+Exits with status 1 when a stage is slower than the baseline by more than
+--tolerance (and --min-delta-ms), unless --no-fail is given.
+"""
+import argparse
+import base64
+import io
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import torch
+from PIL import Image
+
+from benchmarks.synthetic import synthetic_fundus_jpeg
+
+DEFAULT_BASELINE = Path(__file__).parent / "baseline.json"
+
+STAGES = (
+    "decode",
+    "preprocess_glaucoma",
+    "ben_graham",
+    "preprocess_dr",
+    "forward_glaucoma",
+    "forward_dr",
+    "gradcam_glaucoma",
+    "gradcam_dr",
+    "render_glaucoma",
+    "render_dr",
+    "jpeg_encode",
+    "pdf_build",
+)
+
+
+class BenchContext:
+    """Random-weight models, preprocessors and Grad-CAM helpers shared by all runs."""
+
+    def __init__(self, storage_dir: str):
+        from app.gradcam.dr_gradcam import DRGradCAM
+        from app.gradcam.glaucoma_gradcam import GlaucomaGradCAM
+        from app.models.dr_model import DRModel
+        from app.models.glaucoma_model import GlaucomaModel
+        from app.preprocessing.dr_preprocess import BenGrahamPreprocessing, DRPreprocessor
+        from app.preprocessing.glaucoma_preprocess import GlaucomaPreprocessor
+        from app.services.storage_backend import LocalStorageBackend
+        from app.services.supabase_service import SupabaseService
+
+        torch.manual_seed(0)
+        missing = str(Path(storage_dir) / "missing.pth")
+        self.glaucoma_model = GlaucomaModel(missing)
+        self.glaucoma_model.model = self.glaucoma_model.build_architecture().eval().to(self.glaucoma_model.device)
+        self.dr_model = DRModel(missing)
+        self.dr_model.model = self.dr_model.build_architecture().eval().to(self.dr_model.device)
+        self.device = self.dr_model.device
+
+        self.glaucoma_pre = GlaucomaPreprocessor()
+        self.dr_pre = DRPreprocessor()
+        self.ben_graham = BenGrahamPreprocessing(sigmaX=10)
+        self.glaucoma_gradcam = GlaucomaGradCAM(self.glaucoma_model.model)
+        self.dr_gradcam = DRGradCAM(self.dr_model.model)
+        self.supabase_service = SupabaseService(storage=LocalStorageBackend(root=storage_dir))
+
+
+class BenchInputs:
+    """Per (size, batch) inputs, prepared outside the timed region."""
+
+    def __init__(self, ctx: BenchContext, size: int, batch: int):
+        self.size = size
+        self.batch = batch
+        self.jpegs = [synthetic_fundus_jpeg(size, seed=i) for i in range(batch)]
+        self.images = [Image.open(io.BytesIO(b)).convert("RGB") for b in self.jpegs]
+        self.small = [img.resize((300, 300)) for img in self.images]
+        self.glaucoma_batch = torch.stack([ctx.glaucoma_pre.transform(img) for img in self.images]).to(ctx.device)
+        self.dr_batch = torch.stack([ctx.dr_pre.transform(img) for img in self.images]).to(ctx.device)
+        self.glaucoma_attr = ctx.glaucoma_gradcam.lgc.attribute(self.glaucoma_batch, target=0)
+        self.dr_attr = ctx.dr_gradcam.lgc.attribute(self.dr_batch, target=0)
+        rendered = ctx.dr_gradcam.render_heatmap(self.dr_attr[0:1], self.jpegs[0])
+        self.overlays = [rendered["overlay"]] * batch
+        heatmap_b64 = base64.b64encode(ctx.supabase_service._heatmap_to_bytes(rendered["heatmap_only"])).decode()
+        overlay_b64 = base64.b64encode(ctx.supabase_service._heatmap_to_bytes(rendered["overlay"])).decode()
+        self.report_kwargs = dict(
+            patient_display_name="Benchmark Patient",
+            image_id="00000000-0000-0000-0000-000000000000",
+            glaucoma_msg="No signs of Glaucoma detected (confidence: 85.0%)",
+            dr_msg="No signs of DR detected (confidence: 90.0%)",
+            glaucoma_confidence=0.85,
+            dr_confidence=0.9,
+            image_base64=f"data:image/jpeg;base64,{base64.b64encode(self.jpegs[0]).decode()}",
+            glaucoma_heatmap_base64=f"data:image/jpeg;base64,{heatmap_b64}",
+            glaucoma_overlay_base64=f"data:image/jpeg;base64,{overlay_b64}",
+            dr_heatmap_base64=f"data:image/jpeg;base64,{heatmap_b64}",
+            dr_overlay_base64=f"data:image/jpeg;base64,{overlay_b64}",
+            ai_data={},
+        )
+
+
+def _stage_fn(name: str, ctx: BenchContext, inputs: BenchInputs):
+    """Return a zero-arg callable running one stage over the whole batch."""
+    from app.services.scan_pdf import build_scan_report_pdf
+
+    if name == "decode":
+        return lambda: [Image.open(io.BytesIO(b)).convert("RGB") for b in inputs.jpegs]
+    if name == "preprocess_glaucoma":
+        return lambda: torch.stack([ctx.glaucoma_pre.transform(img) for img in inputs.images])
+    if name == "ben_graham":
+        return lambda: [ctx.ben_graham(img) for img in inputs.small]
+    if name == "preprocess_dr":
+        return lambda: torch.stack([ctx.dr_pre.transform(img) for img in inputs.images])
+    if name in ("forward_glaucoma", "forward_dr"):
+        model = ctx.glaucoma_model.model if name == "forward_glaucoma" else ctx.dr_model.model
+        batch = inputs.glaucoma_batch if name == "forward_glaucoma" else inputs.dr_batch
+
+        def forward():
+            with torch.no_grad():
+                return model(batch)
+        return forward
+    if name == "gradcam_glaucoma":
+        return lambda: ctx.glaucoma_gradcam.lgc.attribute(inputs.glaucoma_batch, target=0)
+    if name == "gradcam_dr":
+        return lambda: ctx.dr_gradcam.lgc.attribute(inputs.dr_batch, target=0)
+    if name == "render_glaucoma":
+        return lambda: [
+            ctx.glaucoma_gradcam.render_heatmap(inputs.glaucoma_attr[i : i + 1], jpeg)
+            for i, jpeg in enumerate(inputs.jpegs)
+        ]
+    if name == "render_dr":
+        return lambda: [
+            ctx.dr_gradcam.render_heatmap(inputs.dr_attr[i : i + 1], jpeg)
+            for i, jpeg in enumerate(inputs.jpegs)
+        ]
+    if name == "jpeg_encode":
+        return lambda: [ctx.supabase_service._heatmap_to_bytes(overlay) for overlay in inputs.overlays]
+    if name == "pdf_build":
+        return lambda: [build_scan_report_pdf(**inputs.report_kwargs) for _ in range(inputs.batch)]
+    raise ValueError(f"Unknown stage: {name}")
+
+
+def _time(fn, repeat: int, warmup: int) -> list:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def _set_threads(threads: int):
+    torch.set_num_threads(threads)
+    cv2.setNumThreads(threads)
+
+
+def environment() -> dict:
+    return {
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "opencv": cv2.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "cuda": torch.cuda.is_available(),
+    }
+
+
+def run(stages, sizes, batch_sizes, thread_counts, repeat: int, warmup: int) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as storage_dir:
+        ctx = BenchContext(storage_dir)
+        for size in sizes:
+            for batch in batch_sizes:
+                inputs = BenchInputs(ctx, size, batch)
+                for threads in thread_counts:
+                    _set_threads(threads)
+                    for stage in stages:
+                        key = f"{stage}/size={size}/batch={batch}/threads={threads}"
+                        samples = _time(_stage_fn(stage, ctx, inputs), repeat, warmup)
+                        ms = sorted(s * 1000 for s in samples)
+                        median = statistics.median(ms)
+                        results[key] = {
+                            "ms_median": round(median, 3),
+                            "ms_p90": round(ms[min(len(ms) - 1, int(0.9 * len(ms)))], 3),
+                            "ms_min": round(ms[0], 3),
+                            "ms_per_image": round(median / batch, 3),
+                            "repeat": repeat,
+                        }
+                        print(f"{key:<60} {median:10.2f} ms  ({median / batch:.2f} ms/image)", flush=True)
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_delta_ms: float) -> list:
+    """Return [(key, baseline_ms, current_ms, ratio)] for regressed stages and print a summary."""
+    base_results = baseline.get("results", {})
+    if baseline.get("environment") != environment():
+        print("WARNING: baseline was recorded on a different environment; comparisons may be noisy")
+    regressions = []
+    for key, current in results.items():
+        previous = base_results.get(key)
+        if previous is None:
+            continue
+        before, after = previous["ms_median"], current["ms_median"]
+        ratio = after / before if before else float("inf")
+        if ratio > 1 + tolerance and after - before > min_delta_ms:
+            regressions.append((key, before, after, ratio))
+            print(f"REGRESSION {key}: {before:.2f} -> {after:.2f} ms (x{ratio:.2f})")
+        elif ratio < 1 - tolerance and before - after > min_delta_ms:
+            print(f"improved   {key}: {before:.2f} -> {after:.2f} ms (x{ratio:.2f})")
+    missing = sorted(set(base_results) - set(results))
+    if missing:
+        print(f"{len(missing)} baseline entries were not run this time")
+    return regressions
+
+
+def _int_list(value: str) -> list:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stages", default=",".join(STAGES), help="Comma-separated stages to run")
+    parser.add_argument("--sizes", type=_int_list, default=[2048], help="Square image sizes in pixels")
+    parser.add_argument("--batch-sizes", type=_int_list, default=[1, 4])
+    parser.add_argument("--threads", type=_int_list, default=sorted({1, os.cpu_count() or 1}))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Write results as the new baseline")
+    parser.add_argument("--output", type=Path, help="Also write this run's results to a JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown ratio (0.2 = 20%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=0.5, help="Ignore slowdowns smaller than this")
+    parser.add_argument("--no-fail", action="store_true", help="Exit 0 even when regressions are found")
+    args = parser.parse_args(argv)
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = sorted(set(stages) - set(STAGES))
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)} (choose from {', '.join(STAGES)})")
+
+    # Model-missing warnings are expected: the benchmark installs random weights itself
+    logging.basicConfig(level=logging.ERROR)
+
+    results = run(stages, args.sizes, args.batch_sizes, args.threads, args.repeat, args.warmup)
+    report = {"environment": environment(), "results": results}
+
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(report, indent=2))
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one")
+        return 0
+    regressions = compare(results, json.loads(args.baseline.read_text()), args.tolerance, args.min_delta_ms)
+    if regressions and not args.no_fail:
+        print(f"{len(regressions)} stage(s) regressed beyond {args.tolerance:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""Local stand-ins for Supabase Storage, Firestore and Gemini with latency / error injection."""
+import asyncio
+import json
+import random
+import threading
+import time
+import uuid
+from typing import Optional
+
+import httpx
+
+from app.services.storage_backend import LocalStorageBackend
+
+
+def _sleep_ms(latency_ms: float, jitter_ms: float = 0.0):
+    delay = latency_ms + random.uniform(-jitter_ms, jitter_ms)
+    if delay > 0:
+        time.sleep(delay / 1000.0)
+
+
+class InjectedFault(RuntimeError):
+    """Raised by a fake to simulate a dependency failure."""
+
+
+class FlakyLocalStorageBackend(LocalStorageBackend):
+    """LocalStorageBackend whose uploads and row inserts fail at error_rate."""
+
+    def __init__(self, root: Optional[str] = None, latency_ms: Optional[float] = None,
+                 jitter_ms: Optional[float] = None, error_rate: float = 0.0):
+        super().__init__(root=root, latency_ms=latency_ms, jitter_ms=jitter_ms)
+        self.error_rate = error_rate
+
+    def _maybe_fail(self, op: str):
+        if self.error_rate > 0 and random.random() < self.error_rate:
+            self._simulate_latency()
+            raise InjectedFault(f"injected storage {op} failure")
+
+    def upload(self, bucket, path, data, content_type, upsert=False):
+        self._maybe_fail("upload")
+        super().upload(bucket, path, data, content_type, upsert=upsert)
+
+    def insert_image_row(self, row):
+        self._maybe_fail("insert")
+        super().insert_image_row(row)
+
+
+class FakeFirestore:
+    """
+    Minimal in-memory Firestore client covering what FirebaseService uses:
+    collection().document(), collection().where().stream(), batch().set()/commit().
+
+    Every patient has doctors_per_patient active patient_doctor links. Queries
+    and batch commits sleep for latency_ms and fail at error_rate.
+    """
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 error_rate: float = 0.0, doctors_per_patient: int = 2):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.doctors_per_patient = doctors_per_patient
+        self._lock = threading.Lock()
+        self.writes = 0
+        self.commits = 0
+        self.queries = 0
+        self.failures = 0
+
+    def _round_trip(self, op: str):
+        _sleep_ms(self.latency_ms, self.jitter_ms)
+        if self.error_rate > 0 and random.random() < self.error_rate:
+            with self._lock:
+                self.failures += 1
+            raise InjectedFault(f"injected Firestore {op} failure")
+
+    def collection(self, name: str) -> "_FakeCollection":
+        return _FakeCollection(self, name)
+
+    def batch(self) -> "_FakeBatch":
+        return _FakeBatch(self)
+
+    def patient_doctor_links(self, patient_id: str) -> list:
+        return [
+            {"patientId": patient_id, "doctorId": f"doctor-{patient_id}-{i}", "status": "active"}
+            for i in range(self.doctors_per_patient)
+        ]
+
+    def stats(self) -> dict:
+        return {"writes": self.writes, "commits": self.commits, "queries": self.queries, "failures": self.failures}
+
+
+class _FakeSnapshot:
+    def __init__(self, data: dict):
+        self._data = data
+
+    def to_dict(self) -> dict:
+        return dict(self._data)
+
+
+class _FakeDocument:
+    def __init__(self, collection: str):
+        self.collection = collection
+        self.id = uuid.uuid4().hex
+
+
+class _FakeQuery:
+    def __init__(self, client: FakeFirestore, collection: str, field: str, op: str, value):
+        self.client = client
+        self.collection = collection
+        self.field = field
+        self.op = op
+        self.value = value
+
+    def stream(self):
+        self.client._round_trip("query")
+        with self.client._lock:
+            self.client.queries += 1
+        if self.collection != "patient_doctor" or self.field != "patientId":
+            return iter(())
+        patient_ids = self.value if self.op == "in" else [self.value]
+        return iter(
+            [_FakeSnapshot(link) for pid in patient_ids for link in self.client.patient_doctor_links(pid)]
+        )
+
+
+class _FakeCollection:
+    def __init__(self, client: FakeFirestore, name: str):
+        self.client = client
+        self.name = name
+
+    def document(self, document_id: Optional[str] = None) -> _FakeDocument:
+        return _FakeDocument(self.name)
+
+    def where(self, field: str, op: str, value) -> _FakeQuery:
+        return _FakeQuery(self.client, self.name, field, op, value)
+
+
+class _FakeBatch:
+    def __init__(self, client: FakeFirestore):
+        self.client = client
+        self._writes = 0
+
+    def set(self, ref, data):
+        self._writes += 1
+
+    def commit(self):
+        self.client._round_trip("commit")
+        with self.client._lock:
+            self.client.commits += 1
+            self.client.writes += self._writes
+
+
+def gemini_mock_transport(latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                          error_rate: float = 0.0) -> httpx.MockTransport:
+    """httpx transport answering Gemini generateContent calls locally (503 at error_rate)."""
+    commentary = json.dumps(
+        {
+            "clinical_summary": "Load-test commentary: findings are consistent with the model outputs.",
+            "action_points": ["Review the Grad-CAM overlays", "Correlate clinically", "Schedule follow-up"],
+            "disclaimer": "This is AI-generated support text for clinicians and is not a diagnosis.",
+        }
+    )
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        delay = latency_ms + random.uniform(-jitter_ms, jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000.0)
+        if error_rate > 0 and random.random() < error_rate:
+            return httpx.Response(503, json={"error": {"message": "injected failure"}})
+        return httpx.Response(200, json={"candidates": [{"content": {"parts": [{"text": commentary}]}}]})
+
+    return httpx.MockTransport(handler)
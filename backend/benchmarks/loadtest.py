@@ -0,0 +1,425 @@
+"""
+End-to-end load test against the real FastAPI app with local dependency fakes.
+
+The app (app.main) runs under uvicorn in a child process. Supabase Storage is
+swapped for a local filesystem backend, Firestore for an in-memory fake and
+Gemini for a mock HTTP transport, each with configurable latency and error
+rate, so no cloud credentials are needed. Models use random weights by
+default so inference cost is real.
+
+Each iteration posts /api/analyze and then (with --notify-ratio probability)
+/api/scan-report-notify using the analyze response.
+
+Usage (from backend/):
+    python -m benchmarks.loadtest --concurrency 8 --duration 60
+    python -m benchmarks.loadtest --rate 2.5 --duration 120 --gemini-latency-ms 1500
+    python -m benchmarks.loadtest --concurrency 4 --firestore-error-rate 0.05 --json out.json
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import httpx
+
+from benchmarks.synthetic import synthetic_fundus_jpeg
+
+
+def _percentile(values: list, pct: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def _summary_ms(values: list) -> dict:
+    return {
+        "p50_ms": _round(_percentile(values, 50)),
+        "p95_ms": _round(_percentile(values, 95)),
+        "p99_ms": _round(_percentile(values, 99)),
+        "max_ms": _round(max(values) if values else None),
+    }
+
+
+def _round(value):
+    return None if value is None else round(value, 2)
+
+
+def _peak_rss_mb(children: bool = False) -> float:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+# --- server side (child process) ---------------------------------------------
+
+def _configure_env(options: dict, workdir: str):
+    os.environ.update(
+        {
+            "STORAGE_BACKEND": "local",
+            "LOCAL_STORAGE_DIR": str(Path(workdir) / "storage"),
+            "LOCAL_STORAGE_LATENCY_MS": str(options["storage_latency_ms"]),
+            "LOCAL_STORAGE_LATENCY_JITTER_MS": str(options["storage_jitter_ms"]),
+            "GEMINI_CACHE_PATH": str(Path(workdir) / "gemini_commentary.sqlite3"),
+            "REPORT_CACHE_PATH": str(Path(workdir) / "scan_reports.sqlite3"),
+            "PDF_RENDER_WORKERS": str(options["pdf_workers"]),
+            "GEMINI_PREFETCH_ENABLED": "true" if options["prefetch"] else "false",
+            # Never reach real cloud services, even if backend/.env has credentials
+            "FIREBASE_SERVICE_ACCOUNT_KEY_PATH": "",
+            "GEMINI_API_KEY": "loadtest",
+        }
+    )
+
+
+def _install_fakes(options: dict, workdir: str):
+    from app.api import routes
+    from app.services.firebase_service import firebase_service
+    from app.services.gemini_service import gemini_service
+    from app.services.supabase_service import SupabaseService
+    from benchmarks.fakes import FakeFirestore, FlakyLocalStorageBackend, gemini_mock_transport
+
+    routes.supabase_service = SupabaseService(
+        storage=FlakyLocalStorageBackend(
+            root=str(Path(workdir) / "storage"),
+            error_rate=options["storage_error_rate"],
+        )
+    )
+    firebase_service.use_db(
+        FakeFirestore(
+            latency_ms=options["firestore_latency_ms"],
+            jitter_ms=options["firestore_jitter_ms"],
+            error_rate=options["firestore_error_rate"],
+            doctors_per_patient=options["doctors_per_patient"],
+        )
+    )
+    gemini_service._async_client = httpx.AsyncClient(
+        timeout=gemini_service.timeout,
+        transport=gemini_mock_transport(
+            latency_ms=options["gemini_latency_ms"],
+            jitter_ms=options["gemini_jitter_ms"],
+            error_rate=options["gemini_error_rate"],
+        ),
+    )
+
+    if options["models"] == "random":
+        import torch
+        from app.gradcam.dr_gradcam import DRGradCAM
+        from app.gradcam.glaucoma_gradcam import GlaucomaGradCAM
+        from app.services.model_registry import model_registry
+
+        torch.manual_seed(0)
+        for disease, gradcam_cls in (("glaucoma", GlaucomaGradCAM), ("dr", DRGradCAM)):
+            pipeline = model_registry.active(disease).pipeline
+            if pipeline.model.model is None:
+                pipeline.model.model = pipeline.model.build_architecture().eval().to(pipeline.model.device)
+                pipeline.gradcam = gradcam_cls(pipeline.model.model)
+
+
+def _serve(options: dict, port: int, conn):
+    """Child process: boot app.main with fakes and serve until told to stop."""
+    import logging
+
+    with tempfile.TemporaryDirectory(prefix="diagnovision-loadtest-") as workdir:
+        _configure_env(options, workdir)
+        logging.basicConfig(level=logging.WARNING)
+
+        import uvicorn
+        from app.main import app
+
+        _install_fakes(options, workdir)
+
+        lag_samples = []
+        interval = options["lag_interval_ms"] / 1000.0
+
+        async def monitor_loop_lag():
+            while True:
+                started = time.perf_counter()
+                await asyncio.sleep(interval)
+                lag_samples.append((time.perf_counter() - started - interval) * 1000.0)
+
+        lag_task = {}
+
+        async def start_monitor():
+            lag_task["task"] = asyncio.ensure_future(monitor_loop_lag())
+
+        app.add_event_handler("startup", start_monitor)
+
+        server = uvicorn.Server(
+            uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", access_log=False)
+        )
+
+        def wait_for_stop():
+            conn.recv()
+            server.should_exit = True
+
+        threading.Thread(target=wait_for_stop, daemon=True).start()
+        server.run()
+
+        from app.services.firebase_service import firebase_service
+
+        fake_db = firebase_service.db
+        conn.send(
+            {
+                "event_loop_lag": {**_summary_ms(lag_samples), "samples": len(lag_samples)},
+                "peak_rss_mb": round(_peak_rss_mb(), 1),
+                # Largest PDF worker process (ru_maxrss of children is a max, not a sum)
+                "peak_rss_children_mb": round(_peak_rss_mb(children=True), 1),
+                "firestore": fake_db.stats() if hasattr(fake_db, "stats") else {},
+            }
+        )
+
+
+# --- client side -------------------------------------------------------------
+
+class Recorder:
+    def __init__(self, measure_from: float):
+        self.measure_from = measure_from
+        self.latencies: dict = {}
+        self.errors: dict = {}
+        self.iterations = 0
+
+    def record(self, endpoint: str, started: float, elapsed: float, ok: bool):
+        if started < self.measure_from:
+            return  # warm-up
+        if ok:
+            self.latencies.setdefault(endpoint, []).append(elapsed * 1000.0)
+        else:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+
+async def _iteration(client: httpx.AsyncClient, args, images: list, recorder: Recorder, started: float):
+    patient_id = f"patient-{random.randrange(args.patients)}"
+    image = random.choice(images)
+    try:
+        resp = await client.post(
+            "/api/analyze",
+            files={"image": ("fundus.jpg", image, "image/jpeg")},
+            data={"patient_id": patient_id},
+        )
+        ok = resp.status_code == 200
+    except httpx.HTTPError:
+        ok = False
+    recorder.record("analyze", started, time.perf_counter() - started, ok)
+    # Every measured iteration counts, including failed analyses and those without a notify
+    if started >= recorder.measure_from:
+        recorder.iterations += 1
+    if not ok or random.random() >= args.notify_ratio:
+        return
+    result = resp.json()
+    notify_started = time.perf_counter()
+    try:
+        resp = await client.post(
+            "/api/scan-report-notify",
+            json={
+                "patient_id": patient_id,
+                "image_id": result["image_id"],
+                "patient_display_name": "Load Test",
+                "glaucoma_result_msg": result["glaucoma"]["result_msg"],
+                "glaucoma_confidence": result["glaucoma"]["confidence"],
+                "dr_result_msg": result["dr"]["result_msg"],
+                "dr_confidence": result["dr"]["confidence"],
+                "image_base64": result.get("image_base64"),
+                "glaucoma_heatmap_base64": result.get("glaucoma_heatmap_base64"),
+                "glaucoma_overlay_base64": result.get("glaucoma_overlay_base64"),
+                "dr_heatmap_base64": result.get("dr_heatmap_base64"),
+                "dr_overlay_base64": result.get("dr_overlay_base64"),
+            },
+        )
+        ok = resp.status_code == 200 and resp.json().get("success", False)
+    except httpx.HTTPError:
+        ok = False
+    recorder.record("scan_report_notify", started, time.perf_counter() - notify_started, ok)
+
+
+async def _closed_loop(client, args, images, recorder, deadline):
+    async def worker():
+        while time.perf_counter() < deadline:
+            await _iteration(client, args, images, recorder, time.perf_counter())
+
+    await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+
+
+async def _open_loop(client, args, images, recorder, deadline):
+    """Poisson arrivals at args.rate/s; latency counts from the scheduled arrival time."""
+    tasks = set()
+    next_arrival = time.perf_counter()
+    dropped = 0
+    while next_arrival < deadline:
+        delay = next_arrival - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(tasks) >= args.max_outstanding:
+            dropped += 1
+        else:
+            task = asyncio.ensure_future(_iteration(client, args, images, recorder, next_arrival))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        next_arrival += random.expovariate(args.rate)
+    if tasks:
+        await asyncio.gather(*tasks)
+    return dropped
+
+
+async def _drive(args, base_url: str) -> dict:
+    images = [synthetic_fundus_jpeg(args.image_size, seed=i) for i in range(args.distinct_images)]
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.request_timeout, limits=limits) as client:
+        started = time.perf_counter()
+        recorder = Recorder(measure_from=started + args.warmup)
+        deadline = started + args.warmup + args.duration
+        dropped = 0
+        if args.rate:
+            dropped = await _open_loop(client, args, images, recorder, deadline)
+        else:
+            await _closed_loop(client, args, images, recorder, deadline)
+        elapsed = max(time.perf_counter() - recorder.measure_from, 1e-9)
+
+    endpoints = {}
+    for endpoint in ("analyze", "scan_report_notify"):
+        latencies = recorder.latencies.get(endpoint, [])
+        errors = recorder.errors.get(endpoint, 0)
+        endpoints[endpoint] = {
+            "ok": len(latencies),
+            "errors": errors,
+            "throughput_rps": round(len(latencies) / elapsed, 3),
+            **_summary_ms(latencies),
+        }
+    return {
+        "mode": f"open-loop {args.rate}/s" if args.rate else f"closed-loop x{args.concurrency}",
+        "measured_seconds": round(elapsed, 2),
+        "iterations_per_second": round(recorder.iterations / elapsed, 3),
+        "dropped_arrivals": dropped,
+        "endpoints": endpoints,
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_until_up(base_url: str, process, timeout: float) -> dict:
+    """Wait for /ready (models loaded) and return its startup report."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not process.is_alive():
+            raise RuntimeError("server process exited during startup")
+        try:
+            response = httpx.get(f"{base_url}/ready", timeout=1.0)
+            if response.status_code == 200:
+                return response.json()
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f"server did not become ready within {timeout:.0f}s")
+
+
+def _print_report(report: dict):
+    print(f"\n{report['mode']}, {report['measured_seconds']}s measured, "
+          f"{report['iterations_per_second']} iterations/s, {report['dropped_arrivals']} dropped arrivals")
+    print(f"{'endpoint':<20}{'ok':>7}{'err':>6}{'rps':>9}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for name, s in report["endpoints"].items():
+        cells = [s[k] if s[k] is not None else "-" for k in ("p50_ms", "p95_ms", "p99_ms", "max_ms")]
+        print(f"{name:<20}{s['ok']:>7}{s['errors']:>6}{s['throughput_rps']:>9}" + "".join(f"{c:>10}" for c in cells))
+    server = report.get("server", {})
+    lag = server.get("event_loop_lag", {})
+    print(f"event-loop lag: p50 {lag.get('p50_ms')} ms, p99 {lag.get('p99_ms')} ms, max {lag.get('max_ms')} ms")
+    startup = report.get("startup", {}).get("components", {})
+    if startup:
+        print("startup: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in startup.items()))
+    print(f"peak RSS: server {server.get('peak_rss_mb')} MB, PDF workers {server.get('peak_rss_children_mb')} MB")
+    if server.get("firestore"):
+        print(f"firestore fake: {server['firestore']}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    load = parser.add_argument_group("load shape")
+    load.add_argument("--concurrency", type=int, default=4, help="Closed-loop virtual users")
+    load.add_argument("--rate", type=float, help="Open-loop arrivals per second (overrides --concurrency)")
+    load.add_argument("--max-outstanding", type=int, default=256, help="Open-loop cap on in-flight iterations")
+    load.add_argument("--duration", type=float, default=30.0, help="Measured seconds")
+    load.add_argument("--warmup", type=float, default=5.0, help="Unmeasured seconds before measuring")
+    load.add_argument("--notify-ratio", type=float, default=1.0, help="Fraction of analyses followed by a report")
+    load.add_argument("--patients", type=int, default=50)
+    load.add_argument("--image-size", type=int, default=2048)
+    load.add_argument("--distinct-images", type=int, default=4)
+    load.add_argument("--request-timeout", type=float, default=120.0)
+
+    deps = parser.add_argument_group("dependency fakes")
+    deps.add_argument("--storage-latency-ms", type=float, default=40.0)
+    deps.add_argument("--storage-jitter-ms", type=float, default=10.0)
+    deps.add_argument("--storage-error-rate", type=float, default=0.0)
+    deps.add_argument("--firestore-latency-ms", type=float, default=30.0)
+    deps.add_argument("--firestore-jitter-ms", type=float, default=10.0)
+    deps.add_argument("--firestore-error-rate", type=float, default=0.0)
+    deps.add_argument("--doctors-per-patient", type=int, default=2)
+    deps.add_argument("--gemini-latency-ms", type=float, default=1200.0)
+    deps.add_argument("--gemini-jitter-ms", type=float, default=300.0)
+    deps.add_argument("--gemini-error-rate", type=float, default=0.0)
+
+    server = parser.add_argument_group("server")
+    server.add_argument("--models", choices=("random", "placeholder"), default="random",
+                        help="random: real architectures with random weights; placeholder: skip inference")
+    server.add_argument("--pdf-workers", type=int, default=2)
+    server.add_argument("--prefetch", action="store_true", help="Enable Gemini commentary prefetch")
+    server.add_argument("--lag-interval-ms", type=float, default=50.0)
+    server.add_argument("--startup-timeout", type=float, default=180.0)
+    parser.add_argument("--json", type=Path, help="Write the report as JSON")
+    args = parser.parse_args(argv)
+
+    options = {
+        key: getattr(args, key)
+        for key in (
+            "storage_latency_ms", "storage_jitter_ms", "storage_error_rate",
+            "firestore_latency_ms", "firestore_jitter_ms", "firestore_error_rate", "doctors_per_patient",
+            "gemini_latency_ms", "gemini_jitter_ms", "gemini_error_rate",
+            "models", "pdf_workers", "prefetch", "lag_interval_ms",
+        )
+    }
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    ctx = multiprocessing.get_context("spawn")
+    parent_conn, child_conn = ctx.Pipe()
+    # Not a daemon: the server process owns its own PDF worker pool
+    process = ctx.Process(target=_serve, args=(options, port, child_conn), name="loadtest-server")
+    process.start()
+    try:
+        startup = _wait_until_up(base_url, process, args.startup_timeout)
+        report = asyncio.run(_drive(args, base_url))
+        report["startup"] = startup
+        parent_conn.send("stop")
+        report["server"] = parent_conn.recv() if parent_conn.poll(60) else {}
+    finally:
+        if process.is_alive() and not parent_conn.closed:
+            try:
+                parent_conn.send("stop")
+            except OSError:
+                pass
+        process.join(timeout=60)
+        if process.is_alive():
+            process.terminate()
+    report["options"] = {**options, "concurrency": args.concurrency, "rate": args.rate,
+                         "image_size": args.image_size, "notify_ratio": args.notify_ratio}
+    _print_report(report)
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""Synthetic fundus-like test images (no patient data needed for benchmarks)."""
+import io
+import math
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+def synthetic_fundus(size: int = 2048, seed: int = 0) -> Image.Image:
+    """
+    Generate a fundus-like RGB image: dark surround, orange-red vignetted
+    retina, bright optic disc, darker macula, branching vessels and a few
+    lesion-like dots. Content is deterministic per seed.
+    """
+    rng = np.random.default_rng(seed)
+    h = w = size
+    cx, cy = w / 2, h / 2
+    radius = size * 0.46
+
+    yy, xx = np.mgrid[0:h, 0:w].astype(np.float32)
+    dist = np.sqrt((xx - cx) ** 2 + (yy - cy) ** 2) / radius
+    inside = dist <= 1.0
+
+    shade = np.clip(1.0 - 0.45 * dist ** 2, 0, 1)
+    img = np.empty((h, w, 3), dtype=np.float32)
+    img[..., 0] = (185 + rng.uniform(-15, 15)) * shade
+    img[..., 1] = (80 + rng.uniform(-10, 10)) * shade
+    img[..., 2] = (35 + rng.uniform(-8, 8)) * shade
+
+    # Optic disc on one side, macula on the other
+    side = 1 if rng.random() < 0.5 else -1
+    disc_x, disc_y = cx + side * 0.32 * radius, cy + rng.uniform(-0.05, 0.05) * radius
+    disc = np.exp(-((xx - disc_x) ** 2 + (yy - disc_y) ** 2) / (2 * (0.07 * radius) ** 2))
+    img += disc[..., None] * np.array([60, 120, 85], dtype=np.float32)
+    mac_x, mac_y = cx - side * 0.12 * radius, cy
+    macula = np.exp(-((xx - mac_x) ** 2 + (yy - mac_y) ** 2) / (2 * (0.09 * radius) ** 2))
+    img -= macula[..., None] * np.array([45, 25, 10], dtype=np.float32)
+
+    img += rng.normal(0, 4, size=(h, w, 3)).astype(np.float32)
+    canvas = np.clip(img, 0, 255).astype(np.uint8)
+
+    # Vessels: random walks leaving the optic disc, thinning as they go
+    base_thickness = max(2, size // 250)
+    for _ in range(14):
+        angle = rng.uniform(0, 2 * math.pi)
+        x, y = disc_x, disc_y
+        points = []
+        for _ in range(45):
+            angle += rng.normal(0, 0.18)
+            x += math.cos(angle) * radius / 28
+            y += math.sin(angle) * radius / 28
+            points.append((int(x), int(y)))
+        pts = np.array(points, dtype=np.int32)
+        for i, thickness in enumerate(np.linspace(base_thickness, 1, 3).astype(int)):
+            segment = pts[i * 15 : (i + 1) * 15 + 1]
+            cv2.polylines(canvas, [segment], False, (110, 28, 18), int(thickness), cv2.LINE_AA)
+
+    # Lesion-like dots (microaneurysms / exudates)
+    for _ in range(int(rng.integers(0, 25))):
+        px = int(cx + rng.uniform(-0.8, 0.8) * radius)
+        py = int(cy + rng.uniform(-0.8, 0.8) * radius)
+        color = (90, 15, 10) if rng.random() < 0.6 else (230, 210, 120)
+        cv2.circle(canvas, (px, py), max(1, size // 600), color, -1, cv2.LINE_AA)
+
+    canvas[~inside] = 0
+    return Image.fromarray(canvas)
+
+
+def synthetic_fundus_jpeg(size: int = 2048, seed: int = 0, quality: int = 92) -> bytes:
+    """synthetic_fundus() encoded as JPEG bytes, like a camera upload."""
+    buf = io.BytesIO()
+    synthetic_fundus(size, seed).save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
@@ -0,0 +1,148 @@
+import asyncio
+
+import pytest
+
+from app.services import admission
+from app.services.admission import AdmissionController, AdmissionRejected
+
+
+def make_controller(**kwargs):
+    options = dict(max_concurrency=1, max_queue=2, queue_timeout=1.0)
+    options.update(kwargs)
+    return AdmissionController("test", **options)
+
+
+def test_admits_up_to_max_concurrency_then_queues():
+    async def scenario():
+        controller = make_controller(max_concurrency=2)
+        first = await controller.acquire()
+        await controller.acquire()
+        waiter = asyncio.ensure_future(controller.acquire())
+        await asyncio.sleep(0)
+        assert controller.stats()["queued"] == 1 and not waiter.done()
+
+        controller.release(first)
+        await waiter
+        # The slot was handed straight to the waiter
+        assert controller.stats()["active"] == 2
+        assert controller.stats()["queued"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_queue_deadline_rejects_and_leaves_the_queue():
+    async def scenario():
+        controller = make_controller(queue_timeout=0.01)
+        await controller.acquire()
+        with pytest.raises(AdmissionRejected) as excinfo:
+            await controller.acquire()
+        assert excinfo.value.reason == "queue_timeout"
+        assert excinfo.value.retry_after >= 1
+        assert controller.stats()["queued"] == 0
+        assert controller.stats()["rejected_timeout"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_slot_handed_over_at_the_deadline_is_not_leaked(monkeypatch):
+    async def scenario():
+        controller = make_controller()
+        holder = await controller.acquire()
+
+        async def wait_for_racing_release(future, timeout):
+            controller.release(holder)  # the holder hands its slot to this waiter...
+            assert future.done()
+            raise asyncio.TimeoutError  # ...just as the deadline fires
+
+        monkeypatch.setattr(admission.asyncio, "wait_for", wait_for_racing_release)
+        with pytest.raises(AdmissionRejected):
+            await controller.acquire()
+        assert controller.stats()["active"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        controller = make_controller()
+        holder = await controller.acquire()
+        cancelled = asyncio.ensure_future(controller.acquire())
+        second = asyncio.ensure_future(controller.acquire())
+        await asyncio.sleep(0)
+
+        cancelled.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        assert controller.stats()["queued"] == 1
+        controller.release(holder)
+        await second
+        assert controller.stats()["active"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_passes_on_a_slot_it_was_given(monkeypatch):
+    async def scenario():
+        controller = make_controller()
+        holder = await controller.acquire()
+
+        async def wait_for_racing_release(future, timeout):
+            controller.release(holder)
+            raise asyncio.CancelledError  # the client goes away as the slot arrives
+
+        monkeypatch.setattr(admission.asyncio, "wait_for", wait_for_racing_release)
+        with pytest.raises(asyncio.CancelledError):
+            await controller.acquire()
+        assert controller.stats()["active"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_higher_lanes_are_served_first():
+    async def scenario():
+        controller = make_controller(max_queue=3)
+        holder = await controller.acquire()
+        order = []
+
+        async def request(lane):
+            admitted_at = await controller.acquire(lane)
+            order.append(lane)
+            controller.release(admitted_at)
+
+        tasks = [asyncio.ensure_future(request(lane)) for lane in ("bulk", "normal", "high")]
+        await asyncio.sleep(0)
+        controller.release(holder)
+        await asyncio.gather(*tasks)
+        assert order == ["high", "normal", "bulk"]
+        assert controller.stats()["active"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_preempts_lower_lane_or_rejects():
+    async def scenario():
+        controller = make_controller(max_queue=1)
+        await controller.acquire()
+        bulk = asyncio.ensure_future(controller.acquire("bulk"))
+        await asyncio.sleep(0)
+
+        high = asyncio.ensure_future(controller.acquire("high"))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as excinfo:
+            await bulk
+        assert excinfo.value.reason == "preempted"
+
+        # Nothing below "bulk" to preempt: a full queue rejects it
+        with pytest.raises(AdmissionRejected) as excinfo:
+            await controller.acquire("bulk")
+        assert excinfo.value.reason == "queue_full"
+        assert controller.stats()["preempted"] == 1
+        high.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_unknown_priority_is_rejected():
+    with pytest.raises(ValueError):
+        AdmissionController.resolve_priority("urgent")
+    assert AdmissionController.resolve_priority(" HIGH ") == "high"
@@ -0,0 +1,99 @@
+import pytest
+
+from app.services import circuit_breaker
+from app.services.circuit_breaker import CircuitBreaker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", clock.monotonic)
+    return clock
+
+
+def make_breaker(**kwargs):
+    options = dict(min_calls=2, error_rate_threshold=0.5, slow_call_seconds=5.0, open_seconds=30.0)
+    options.update(kwargs)
+    return CircuitBreaker("test", **options)
+
+
+def trip(breaker):
+    for _ in range(breaker.min_calls):
+        breaker.record(False, 0.1, breaker.allow())
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_opens_on_error_rate_and_rejects(clock):
+    breaker = make_breaker()
+    assert breaker.allow() == CircuitBreaker.CALL
+    trip(breaker)
+    assert breaker.allow() is None
+    assert breaker.snapshot()["rejected_total"] == 1
+
+
+def test_opens_on_slow_calls(clock):
+    breaker = make_breaker()
+    for _ in range(2):
+        breaker.record(True, 6.0, breaker.allow())
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_half_open_probe_success_closes(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    clock.now += 30
+    permit = breaker.allow()
+    assert permit == CircuitBreaker.PROBE
+    assert breaker.allow() is None  # one probe at a time
+    breaker.record(True, 0.1, permit)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_probe_failure_reopens(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    clock.now += 30
+    breaker.record(False, 0.1, breaker.allow())
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.snapshot()["opened_total"] == 2
+
+
+def test_released_probe_frees_slot(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    clock.now += 30
+    breaker.release_probe(breaker.allow())
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow() == CircuitBreaker.PROBE
+
+
+def test_lost_probe_expires(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    clock.now += 30
+    assert breaker.allow() == CircuitBreaker.PROBE
+    clock.now += 30
+    assert breaker.allow() == CircuitBreaker.PROBE
+
+
+def test_call_admitted_while_closed_does_not_take_probe_slot(clock):
+    breaker = make_breaker()
+    slow_call = breaker.allow()
+    trip(breaker)
+    clock.now += 30
+    probe = breaker.allow()
+    # The earlier call finishing now neither frees the probe's slot nor decides the state
+    breaker.record(True, 0.1, slow_call)
+    breaker.release_probe(slow_call)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow() is None
+    breaker.record(True, 0.1, probe)
+    assert breaker.state == CircuitBreaker.CLOSED
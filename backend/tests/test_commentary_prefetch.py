@@ -0,0 +1,53 @@
+import asyncio
+
+from app.services import commentary_prefetch
+from app.services.commentary_cache import CommentaryCache
+from app.services.commentary_prefetch import CommentaryPrefetcher
+
+INPUTS = dict(
+    glaucoma_msg="No glaucoma detected (confidence: 91%)",
+    dr_msg="Mild DR",
+    glaucoma_confidence=0.91,
+    dr_confidence=0.62,
+)
+
+
+def test_get_shared_reads_entries_written_by_another_process(tmp_path):
+    path = str(tmp_path / "commentary.sqlite3")
+    worker_a = CommentaryCache(path=path, ttl_seconds=60, max_entries=10)
+    worker_b = CommentaryCache(path=path, ttl_seconds=60, max_entries=10)
+    key = CommentaryCache.make_key(**INPUTS)
+
+    worker_a.set(key, {"summary": "from a"})
+
+    assert worker_b.get(key) is None
+    assert worker_b.get_shared(key) == {"summary": "from a"}
+    # Adopted into memory: plain get() hits from now on
+    assert worker_b.get(key) == {"summary": "from a"}
+    assert worker_b.stats()["hits"] == 2
+
+
+def test_get_shared_ignores_expired_mirror_rows(tmp_path):
+    path = str(tmp_path / "commentary.sqlite3")
+    writer = CommentaryCache(path=path, ttl_seconds=60, max_entries=10)
+    reader = CommentaryCache(path=path, ttl_seconds=0, max_entries=10)
+    key = CommentaryCache.make_key(**INPUTS)
+
+    writer.set(key, {"summary": "stale"})
+
+    assert reader.get_shared(key) is None
+
+
+def test_take_falls_back_to_shared_cache_without_local_prefetch(tmp_path, monkeypatch):
+    path = str(tmp_path / "commentary.sqlite3")
+    other_worker = CommentaryCache(path=path, ttl_seconds=60, max_entries=10)
+    this_worker = CommentaryCache(path=path, ttl_seconds=60, max_entries=10)
+    monkeypatch.setattr(commentary_prefetch.gemini_service, "cache", this_worker)
+    other_worker.set(CommentaryCache.make_key(**INPUTS), {"summary": "prefetched elsewhere"})
+    prefetcher = CommentaryPrefetcher(max_inflight=1, ttl_seconds=60)
+
+    data = asyncio.run(prefetcher.take("image-1", **INPUTS, timeout=1.0))
+
+    assert data == {"summary": "prefetched elsewhere"}
+    assert prefetcher.stats()["shared_hits"] == 1
+    assert asyncio.run(prefetcher.take("image-2", **dict(INPUTS, dr_msg="Severe DR"), timeout=1.0)) is None
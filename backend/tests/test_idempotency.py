@@ -0,0 +1,165 @@
+import asyncio
+
+import pytest
+
+from app.services.idempotency import (
+    IdempotencyConflict,
+    IdempotencyInterrupted,
+    IdempotencyStore,
+    request_fingerprint,
+)
+
+
+def make_store(path=""):
+    return IdempotencyStore(path=path, ttl_seconds=60, max_entries=10)
+
+
+def test_completed_response_is_replayed_without_images():
+    async def scenario():
+        store = make_store()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            return {"image_id": "img-1", "image_base64": "aGVsbG8=", "glaucoma_result": "none"}
+
+        fingerprint = request_fingerprint("patient-1", "sha")
+        first, replayed = await store.run("key-1", fingerprint, compute)
+        assert not replayed and first["image_base64"] == "aGVsbG8="
+
+        second, replayed = await store.run("key-1", fingerprint, compute)
+        assert replayed and len(calls) == 1
+        assert second == {"image_id": "img-1", "image_base64": None, "glaucoma_result": "none"}
+
+    asyncio.run(scenario())
+
+
+def test_key_reused_with_a_different_payload_conflicts():
+    async def scenario():
+        store = make_store()
+
+        async def compute():
+            return {"image_id": "img-1"}
+
+        await store.run("key-1", request_fingerprint("patient-1"), compute)
+        with pytest.raises(IdempotencyConflict):
+            await store.run("key-1", request_fingerprint("patient-2"), compute)
+        assert store.stats()["conflicts"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_duplicates_share_one_computation():
+    async def scenario():
+        store = make_store()
+        gate = asyncio.Event()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await gate.wait()
+            return {"image_id": "img-1"}
+
+        fingerprint = request_fingerprint("patient-1")
+        original = asyncio.ensure_future(store.run("key-1", fingerprint, compute))
+        await asyncio.sleep(0)
+        duplicate = asyncio.ensure_future(store.run("key-1", fingerprint, compute))
+        conflicting = asyncio.ensure_future(store.run("key-1", request_fingerprint("patient-2"), compute))
+        await asyncio.sleep(0)
+        gate.set()
+
+        assert await original == ({"image_id": "img-1"}, False)
+        assert await duplicate == ({"image_id": "img-1"}, True)
+        with pytest.raises(IdempotencyConflict):
+            await conflicting
+        assert len(calls) == 1 and store.stats()["coalesced"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_computation_outlives_a_disconnected_caller():
+    async def scenario():
+        store = make_store()
+        gate = asyncio.Event()
+        released = []
+
+        async def compute():
+            await gate.wait()
+            return {"image_id": "img-1"}
+
+        fingerprint = request_fingerprint("patient-1")
+        original = asyncio.ensure_future(store.run("key-1", fingerprint, compute, release=lambda: released.append(1)))
+        await asyncio.sleep(0)
+        original.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await original
+        # Inputs are held until the computation itself finishes
+        assert released == []
+
+        gate.set()
+        response, replayed = await store.run("key-1", fingerprint, compute)
+        assert response == {"image_id": "img-1"} and replayed
+        assert released == [1]
+
+    asyncio.run(scenario())
+
+
+def test_duplicate_of_a_cancelled_computation_is_told_to_retry():
+    async def scenario():
+        store = make_store()
+
+        async def compute():
+            await asyncio.Event().wait()
+
+        fingerprint = request_fingerprint("patient-1")
+        original = asyncio.ensure_future(store.run("key-1", fingerprint, compute))
+        await asyncio.sleep(0)
+        duplicate = asyncio.ensure_future(store.run("key-1", fingerprint, compute))
+        await asyncio.sleep(0)
+
+        _, task = store._inflight["key-1"]
+        task.cancel()
+        with pytest.raises(IdempotencyInterrupted):
+            await duplicate
+        with pytest.raises(asyncio.CancelledError):
+            await original
+        # Nothing was stored, so the retry computes afresh
+        assert store.get("key-1") is None
+
+    asyncio.run(scenario())
+
+
+def test_failed_attempts_are_not_stored_and_release_inputs():
+    async def scenario():
+        store = make_store()
+        released = []
+
+        async def failing():
+            raise RuntimeError("model crashed")
+
+        async def succeeding():
+            return {"image_id": "img-1"}
+
+        fingerprint = request_fingerprint("patient-1")
+        with pytest.raises(RuntimeError):
+            await store.run("key-1", fingerprint, failing, release=lambda: released.append(1))
+        assert released == [1]
+
+        assert await store.run("key-1", fingerprint, succeeding) == ({"image_id": "img-1"}, False)
+
+    asyncio.run(scenario())
+
+
+def test_stored_responses_survive_a_restart(tmp_path):
+    async def scenario():
+        path = str(tmp_path / "idempotency.sqlite3")
+
+        async def compute():
+            return {"image_id": "img-1", "image_base64": "aGVsbG8="}
+
+        fingerprint = request_fingerprint("patient-1")
+        await make_store(path).run("key-1", fingerprint, compute)
+        response, replayed = await make_store(path).run("key-1", fingerprint, compute)
+        assert replayed and response == {"image_id": "img-1", "image_base64": None}
+
+    asyncio.run(scenario())
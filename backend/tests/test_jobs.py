@@ -0,0 +1,158 @@
+import asyncio
+
+import pytest
+
+from app.config import settings
+from app.services import jobs
+from app.services.analysis import AnalysisOptions
+from app.services.jobs import COMPLETED, QUEUED, RUNNING, JobRunner, JobStore, LeaseLost
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(jobs.time, "time", clock.time)
+    return clock
+
+
+@pytest.fixture
+def store(tmp_path, clock):
+    return JobStore(
+        path=str(tmp_path / "jobs.sqlite3"),
+        jobs_dir=str(tmp_path / "jobs"),
+        lease_seconds=60,
+        max_attempts=3,
+        retention_seconds=3600,
+    )
+
+
+def create_job(store, clock, job_id, images=2):
+    job_dir = store.job_dir(job_id)
+    job_dir.mkdir(parents=True)
+    entries = []
+    for index in range(images):
+        path = job_dir / f"input_{index}.jpg"
+        path.write_bytes(b"jpeg")
+        entries.append({"index": index, "filename": f"{index}.jpg", "path": str(path)})
+    job = store.create(job_id, "patient-1", AnalysisOptions(), "bulk", entries)
+    clock.now += 1
+    return job
+
+
+def test_claim_takes_the_oldest_queued_job(store, clock):
+    create_job(store, clock, "job-1")
+    create_job(store, clock, "job-2")
+
+    job = store.claim("worker-a")
+    assert job["id"] == "job-1"
+    assert job["status"] == RUNNING and job["worker"] == "worker-a" and job["attempts"] == 1
+    assert store.claim("worker-b")["id"] == "job-2"
+    assert store.claim("worker-c") is None
+    assert store.stats() == {QUEUED: 0, RUNNING: 2, COMPLETED: 0, "failed": 0}
+
+
+def test_stale_lease_is_reclaimed_and_old_runner_locked_out(store, clock):
+    create_job(store, clock, "job-1")
+    store.claim("worker-a")
+    clock.now += 30
+    assert store.heartbeat("job-1", "worker-a")
+    # Heartbeat kept the lease fresh
+    clock.now += 59
+    assert store.claim("worker-b") is None
+
+    clock.now += 61
+    job = store.claim("worker-b")
+    assert job["worker"] == "worker-b" and job["attempts"] == 2
+
+    assert not store.heartbeat("job-1", "worker-a")
+    assert not store.save_results("job-1", "worker-a", job["results"])
+    assert not store.finish("job-1", "worker-a", COMPLETED)
+    assert store.get("job-1")["status"] == RUNNING
+
+
+def test_finish_deletes_inputs_and_requeue_gives_back_the_attempt(store, clock):
+    create_job(store, clock, "job-1")
+    create_job(store, clock, "job-2")
+    store.claim("worker-a")
+    store.claim("worker-a")
+
+    assert store.finish("job-1", "worker-a", COMPLETED)
+    assert not list(store.job_dir("job-1").glob("input_*"))
+
+    store.requeue("job-2", "worker-b")  # not the holder: no effect
+    assert store.get("job-2")["status"] == RUNNING
+    store.requeue("job-2", "worker-a")
+    job = store.get("job-2")
+    assert job["status"] == QUEUED and job["worker"] is None and job["attempts"] == 0
+
+
+def run_job(runner, job, worker):
+    asyncio.run(runner._run(job, worker))
+
+
+@pytest.fixture
+def runner(store, monkeypatch):
+    monkeypatch.setattr(settings, "JOB_SAVE_RESULTS", False)
+    return JobRunner(store, workers=0)
+
+
+def test_reclaimed_job_resumes_at_its_first_pending_image(store, clock, runner, monkeypatch):
+    create_job(store, clock, "job-1", images=3)
+    job = store.claim("worker-a")
+    job["results"][0].update(status="done", image_id="img-0")
+    store.save_results("job-1", "worker-a", job["results"])
+    clock.now += 120  # worker-a died after the first image
+
+    analyzed = []
+
+    async def analyze(job, image, options):
+        analyzed.append(image["index"])
+        return {"image_id": f"img-{image['index']}", "glaucoma": None, "dr": None}
+
+    monkeypatch.setattr(runner, "_analyze", analyze)
+    job = store.claim("worker-b")
+    run_job(runner, job, "worker-b")
+
+    assert analyzed == [1, 2]
+    finished = store.get("job-1")
+    assert finished["status"] == COMPLETED
+    assert [r["image_id"] for r in finished["results"]] == ["img-0", "img-1", "img-2"]
+    assert runner.stats()["jobs_resumed"] == 1
+
+
+def test_runner_abandons_a_job_taken_over_mid_analysis(store, clock, runner, monkeypatch):
+    create_job(store, clock, "job-1")
+
+    async def analyze(job, image, options):
+        # This runner stalls past its lease and another one takes the job
+        clock.now += 120
+        assert store.claim("worker-b")["id"] == "job-1"
+        return {"image_id": "img-0", "glaucoma": None, "dr": None}
+
+    monkeypatch.setattr(runner, "_analyze", analyze)
+    job = store.claim("worker-a")
+    with pytest.raises(LeaseLost):
+        run_job(runner, job, "worker-a")
+
+    taken_over = store.get("job-1")
+    assert taken_over["worker"] == "worker-b"
+    assert [r["status"] for r in taken_over["results"]] == ["pending", "pending"]
+
+
+def test_job_over_max_attempts_fails(store, clock, runner):
+    create_job(store, clock, "job-1")
+    for worker in ("worker-a", "worker-b", "worker-c", "worker-d"):
+        job = store.claim(worker)
+        clock.now += 120
+
+    run_job(runner, job, "worker-d")
+    failed = store.get("job-1")
+    assert failed["status"] == "failed" and "Gave up" in failed["error"]